@@ -1,4 +1,6 @@
 load("//extractors/line_detection:line_detection.bzl", _line_detection_geojson = "line_detection_geojson")
+load("//extractors/line_detection/quantize:rules.bzl", _line_quantize = "line_quantize")
+load("//extractors/line_detection/roi:rules.bzl", _line_region_of_interest = "line_region_of_interest")
 load("//extractors/line_detection/segment:rules.bzl", _line_segmentation = "line_segmentation")
 load("//extractors/line_detection/binarize:rules.bzl", _line_binarize = "line_binarize")
 load("//extractors/line_detection/morphology:rules.bzl", _line_morphology = "line_morphology")
@@ -6,8 +8,13 @@ load("//extractors/line_detection/artifact:rules.bzl", _line_artifact_mask = "li
 load("//extractors/line_detection/skeleton:rules.bzl", _line_skeleton = "line_skeleton")
 load("//extractors/line_detection/vectorize:rules.bzl", _line_vectorize = "line_vectorize")
 load("//extractors/line_detection/topology:rules.bzl", _line_topology_cleanup = "line_topology_cleanup")
+load("//extractors/line_detection/incremental:rules.bzl", _line_change_detect = "line_change_detect", _line_incremental_splice = "line_incremental_splice")
+load("//extractors/line_detection/index:rules.bzl", _line_index = "line_index")
+load("//extractors/line_detection/mosaic:rules.bzl", _line_mosaic = "line_mosaic")
 
 line_detection_geojson = _line_detection_geojson
+line_quantize = _line_quantize
+line_region_of_interest = _line_region_of_interest
 line_segmentation = _line_segmentation
 line_binarize = _line_binarize
 line_morphology = _line_morphology
@@ -15,3 +22,7 @@ line_artifact_mask = _line_artifact_mask
 line_skeleton = _line_skeleton
 line_vectorize = _line_vectorize
 line_topology_cleanup = _line_topology_cleanup
+line_change_detect = _line_change_detect
+line_incremental_splice = _line_incremental_splice
+line_index = _line_index
+line_mosaic = _line_mosaic
@@ -2,16 +2,52 @@
 from __future__ import annotations
 
 import argparse
-from typing import List, Tuple
+import hashlib
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
 
 import cv2
 import numpy as np
 
-from extractors.line_detection.pipeline_utils import load_mask, save_mask
+from extractors.line_detection.pipeline_utils import (
+    SPARSE_TILE_SIZE,
+    AsyncWriter,
+    SparseWindow,
+    StageMetrics,
+    crop_to_roi,
+    load_mask,
+    load_roi,
+    opencv_threads,
+    paint_mask,
+    save_json,
+    set_thread_budget,
+    sparse_apply,
+    sparse_windows,
+)
+from extractors.line_detection.worker import run_stage
 
 
-def detect_grid_lines(mask: np.ndarray, min_length: int, max_gap: int) -> List[Tuple[int, int, int, int]]:
-    edges = cv2.Canny(mask, 50, 150)
+SKEW_SAMPLE_POINTS = 100000
+SYMBOL_TILE_MIN = 512
+# Pixels a --sparse window must reach past the mask: the 9x9 circle pre-blur reads 4 pixels,
+# Canny's Sobel and non-maximum suppression 2. On a 0/255 mask every gradient clears the high
+# Canny threshold, so its hysteresis never links edges across windows.
+SPARSE_REACH = 4
+SPARSE_HALO = 8
+
+
+def canny_edges(mask: np.ndarray, windows: Optional[Sequence[SparseWindow]]) -> np.ndarray:
+    if windows is None:
+        with opencv_threads("Canny"):
+            return cv2.Canny(mask, 50, 150)
+    return sparse_apply(mask, windows, lambda crop: cv2.Canny(crop, 50, 150))
+
+
+def detect_grid_lines(
+    mask: np.ndarray, min_length: int, max_gap: int, windows: Optional[Sequence[SparseWindow]] = None
+) -> List[Tuple[int, int, int, int]]:
+    edges = canny_edges(mask, windows)
     lines = cv2.HoughLinesP(edges, 1, np.pi / 180, threshold=80, minLineLength=min_length, maxLineGap=max_gap)
     results: List[Tuple[int, int, int, int]] = []
     if lines is None:
@@ -22,8 +58,114 @@ def detect_grid_lines(mask: np.ndarray, min_length: int, max_gap: int) -> List[T
     return results
 
 
-def detect_circles(mask: np.ndarray, min_radius: int, max_radius: int, param1: float, param2: float) -> List[Tuple[int, int, int]]:
-    blurred = cv2.GaussianBlur(mask, (9, 9), 2)
+def profile_sharpness(xs: np.ndarray, ys: np.ndarray, angle: float) -> float:
+    theta = np.deg2rad(angle)
+    sin_t, cos_t = np.sin(theta), np.cos(theta)
+    rows = np.rint(ys * cos_t - xs * sin_t).astype(np.int64)
+    cols = np.rint(xs * cos_t + ys * sin_t).astype(np.int64)
+    row_hist = np.bincount(rows - rows.min())
+    col_hist = np.bincount(cols - cols.min())
+    # Sharply peaked profiles (sum of squares) mean the grid is axis-aligned at this angle.
+    return float(np.dot(row_hist, row_hist) + np.dot(col_hist, col_hist))
+
+
+def estimate_skew_angle(xs: np.ndarray, ys: np.ndarray, max_angle: float, step: float) -> float:
+    if max_angle <= 0 or step <= 0 or xs.size == 0:
+        return 0.0
+    stride = max(1, xs.size // SKEW_SAMPLE_POINTS)
+    xs, ys = xs[::stride], ys[::stride]
+    coarse_step = max(step, max_angle / 10.0)
+    candidates = np.arange(-max_angle, max_angle + coarse_step / 2, coarse_step)
+    best_angle = max(candidates, key=lambda angle: profile_sharpness(xs, ys, angle))
+    fine = np.arange(best_angle - coarse_step, best_angle + coarse_step + step / 2, step)
+    fine = fine[np.abs(fine) <= max_angle + step / 2]
+    return float(max(fine, key=lambda angle: profile_sharpness(xs, ys, angle)))
+
+
+def profile_bands(profile: np.ndarray, threshold: float) -> List[Tuple[int, int]]:
+    active = np.concatenate(([0], (profile >= threshold).astype(np.int8), [0]))
+    changes = np.flatnonzero(np.diff(active))
+    return [(int(start), int(end) - 1) for start, end in zip(changes[::2], changes[1::2])]
+
+
+def detect_grid_bands(
+    mask: np.ndarray,
+    min_length: int,
+    min_coverage: float,
+    thickness: int,
+    max_angle: float,
+    angle_step: float,
+) -> Tuple[List[Tuple[int, int, int, int, int]], float]:
+    height, width = mask.shape[:2]
+    ys, xs = np.nonzero(mask)
+    results: List[Tuple[int, int, int, int, int]] = []
+    if xs.size == 0:
+        return results, 0.0
+    xs = xs.astype(np.float64)
+    ys = ys.astype(np.float64)
+    angle = estimate_skew_angle(xs, ys, max_angle, angle_step)
+    theta = np.deg2rad(angle)
+    sin_t, cos_t = np.sin(theta), np.cos(theta)
+
+    rows = np.rint(ys * cos_t - xs * sin_t).astype(np.int64)
+    cols = np.rint(xs * cos_t + ys * sin_t).astype(np.int64)
+    row_offset, col_offset = int(rows.min()), int(cols.min())
+    row_profile = np.bincount(rows - row_offset)
+    col_profile = np.bincount(cols - col_offset)
+
+    row_threshold = max(float(min_length), min_coverage * width)
+    col_threshold = max(float(min_length), min_coverage * height)
+    span = float(max(width, height))
+
+    for start, end in profile_bands(row_profile, row_threshold):
+        # Line y*cos - x*sin = r, drawn across the full frame in image coordinates.
+        r = (start + end) / 2.0 + row_offset
+        band = max(thickness, end - start + 3)
+        x0, x1 = -span, width + span
+        y0 = (r + x0 * sin_t) / cos_t
+        y1 = (r + x1 * sin_t) / cos_t
+        results.append((int(round(x0)), int(round(y0)), int(round(x1)), int(round(y1)), band))
+
+    for start, end in profile_bands(col_profile, col_threshold):
+        # Line x*cos + y*sin = c.
+        c = (start + end) / 2.0 + col_offset
+        band = max(thickness, end - start + 3)
+        y0, y1 = -span, height + span
+        x0 = (c - y0 * sin_t) / cos_t
+        x1 = (c - y1 * sin_t) / cos_t
+        results.append((int(round(x0)), int(round(y0)), int(round(x1)), int(round(y1)), band))
+
+    return results, angle
+
+
+def filter_oblique(
+    lines: List[Tuple[int, int, int, int]],
+    skew_angle: float,
+    tolerance: float,
+) -> List[Tuple[int, int, int, int]]:
+    results: List[Tuple[int, int, int, int]] = []
+    for x1, y1, x2, y2 in lines:
+        angle = np.degrees(np.arctan2(y2 - y1, x2 - x1)) - skew_angle
+        offset = abs(((angle + 45.0) % 90.0) - 45.0)
+        if offset > tolerance:
+            results.append((x1, y1, x2, y2))
+    return results
+
+
+def detect_circles(
+    mask: np.ndarray,
+    min_radius: int,
+    max_radius: int,
+    param1: float,
+    param2: float,
+    windows: Optional[Sequence[SparseWindow]] = None,
+) -> List[Tuple[int, int, int]]:
+    if windows is None:
+        with opencv_threads("GaussianBlur"):
+            blurred = cv2.GaussianBlur(mask, (9, 9), 2)
+    else:
+        blurred = sparse_apply(mask, windows, lambda crop: cv2.GaussianBlur(crop, (9, 9), 2))
+    # The Hough accumulators themselves stay full-frame; their voting already scales with edge pixels.
     circles = cv2.HoughCircles(
         blurred,
         cv2.HOUGH_GRADIENT,
@@ -43,55 +185,288 @@ def detect_circles(mask: np.ndarray, min_radius: int, max_radius: int, param1: f
     return results
 
 
+@dataclass(frozen=True)
+class SymbolTemplate:
+    name: str
+    digest: str
+    mask: np.ndarray
+
+
+@dataclass(frozen=True)
+class ScaledTemplate:
+    footprint: np.ndarray
+    centered: np.ndarray
+    norm: float
+
+
+def load_symbol_templates(paths: Sequence[str]) -> List[SymbolTemplate]:
+    templates: List[SymbolTemplate] = []
+    for path in paths:
+        digest = hashlib.sha256(Path(path).read_bytes()).hexdigest()
+        templates.append(SymbolTemplate(name=Path(path).stem, digest=digest, mask=load_mask(path)))
+    return templates
+
+
+def scale_template(template: SymbolTemplate, scale: float) -> ScaledTemplate:
+    height, width = template.mask.shape[:2]
+    size = (max(1, int(round(width * scale))), max(1, int(round(height * scale))))
+    resized = cv2.resize(template.mask, size, interpolation=cv2.INTER_AREA)
+    footprint = (resized >= 128).astype(np.uint8) * 255
+    values = footprint.astype(np.float32) / 255.0
+    centered = values - values.mean()
+    return ScaledTemplate(footprint=footprint, centered=centered, norm=float(np.sqrt(np.sum(centered * centered))))
+
+
+def load_spectra_cache(path: str | None) -> Dict[str, np.ndarray]:
+    if not path or not Path(path).exists():
+        return {}
+    with np.load(path) as data:
+        return {key: data[key] for key in data.files}
+
+
+def save_spectra_cache(path: str | None, cache: Dict[str, np.ndarray]) -> None:
+    if not path:
+        return
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "wb") as handle:
+        np.savez(handle, **cache)
+
+
+def template_spectra(
+    templates: Sequence[SymbolTemplate],
+    scaled: Sequence[ScaledTemplate],
+    scale: float,
+    tile_shape: Tuple[int, int],
+    cache: Dict[str, np.ndarray],
+) -> np.ndarray:
+    spectra = []
+    for template, item in zip(templates, scaled):
+        key = f"{template.digest}_{scale:.4f}_{tile_shape[0]}x{tile_shape[1]}"
+        if key not in cache:
+            cache[key] = np.fft.rfft2(item.centered, s=tile_shape).astype(np.complex64)
+        spectra.append(cache[key])
+    return np.conj(np.stack(spectra))
+
+
+def window_sums(integral: np.ndarray, height: int, width: int, rows: int, cols: int) -> np.ndarray:
+    return (
+        integral[height : height + rows, width : width + cols]
+        - integral[:rows, width : width + cols]
+        - integral[height : height + rows, :cols]
+        + integral[:rows, :cols]
+    )
+
+
+def match_symbols_at_scale(
+    mask: np.ndarray,
+    templates: Sequence[SymbolTemplate],
+    scale: float,
+    threshold: float,
+    cache: Dict[str, np.ndarray],
+) -> List[Tuple[int, int, np.ndarray]]:
+    scaled = [scale_template(template, scale) for template in templates]
+    max_h = max(item.centered.shape[0] for item in scaled)
+    max_w = max(item.centered.shape[1] for item in scaled)
+    tile_h = cv2.getOptimalDFTSize(max(SYMBOL_TILE_MIN, 2 * max_h))
+    tile_w = cv2.getOptimalDFTSize(max(SYMBOL_TILE_MIN, 2 * max_w))
+    step_h, step_w = tile_h - max_h + 1, tile_w - max_w + 1
+    # One conjugate spectrum per template, shared by every tile at this scale.
+    spectra = template_spectra(templates, scaled, scale, (tile_h, tile_w), cache)
+
+    height, width = mask.shape[:2]
+    matches: List[Tuple[int, int, np.ndarray]] = []
+    for top in range(0, height, step_h):
+        for left in range(0, width, step_w):
+            tile = np.zeros((tile_h, tile_w), dtype=np.float32)
+            source = mask[top : top + tile_h, left : left + tile_w]
+            if not np.any(source):
+                continue
+            tile[: source.shape[0], : source.shape[1]] = source / 255.0
+            # Whole library in one batched multiply + inverse transform.
+            correlation = np.fft.irfft2(np.fft.rfft2(tile)[np.newaxis, ...] * spectra, s=(tile_h, tile_w))
+            integral, integral_sq = cv2.integral2(tile, sdepth=cv2.CV_64F)
+            for index, item in enumerate(scaled):
+                t_h, t_w = item.centered.shape
+                rows = min(step_h, height - top - t_h + 1)
+                cols = min(step_w, width - left - t_w + 1)
+                if rows <= 0 or cols <= 0 or item.norm == 0:
+                    continue
+                count = float(t_h * t_w)
+                sums = window_sums(integral, t_h, t_w, rows, cols)
+                sums_sq = window_sums(integral_sq, t_h, t_w, rows, cols)
+                variance = np.maximum(sums_sq - sums * sums / count, 0.0)
+                denominator = np.sqrt(variance) * item.norm
+                scores = np.zeros((rows, cols), dtype=np.float32)
+                valid = denominator > 1e-6
+                scores[valid] = correlation[index, :rows, :cols][valid] / denominator[valid]
+                peaks = scores >= threshold
+                if not np.any(peaks):
+                    continue
+                kernel = np.ones((max(3, t_h // 2 | 1), max(3, t_w // 2 | 1)), dtype=np.uint8)
+                peaks &= scores >= cv2.dilate(scores, kernel)
+                # Flat plateaus yield several equal maxima; keep one per connected plateau.
+                count, labels = cv2.connectedComponents(peaks.astype(np.uint8), connectivity=8)
+                ys, xs = np.nonzero(peaks)
+                _, first = np.unique(labels[ys, xs], return_index=True)
+                for y, x in zip(ys[first], xs[first]):
+                    matches.append((left + int(x), top + int(y), item.footprint))
+    return matches
+
+
+def detect_symbols(
+    mask: np.ndarray,
+    templates: Sequence[SymbolTemplate],
+    scales: Sequence[float],
+    threshold: float,
+    cache: Dict[str, np.ndarray],
+) -> List[Tuple[int, int, np.ndarray]]:
+    matches: List[Tuple[int, int, np.ndarray]] = []
+    if not templates:
+        return matches
+    for scale in scales:
+        matches.extend(match_symbols_at_scale(mask, templates, scale, threshold, cache))
+    return matches
+
+
+def stamp_symbols(suppressed: np.ndarray, matches: Sequence[Tuple[int, int, np.ndarray]], dilate: int) -> None:
+    height, width = suppressed.shape[:2]
+    kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (2 * dilate + 1, 2 * dilate + 1)) if dilate > 0 else None
+    for x, y, footprint in matches:
+        if kernel is not None:
+            footprint = cv2.copyMakeBorder(footprint, dilate, dilate, dilate, dilate, cv2.BORDER_CONSTANT, value=0)
+            footprint = cv2.dilate(footprint, kernel)
+            x, y = x - dilate, y - dilate
+        x0, y0 = max(x, 0), max(y, 0)
+        x1 = min(x + footprint.shape[1], width)
+        y1 = min(y + footprint.shape[0], height)
+        if x1 <= x0 or y1 <= y0:
+            continue
+        region = suppressed[y0:y1, x0:x1]
+        cv2.bitwise_or(region, footprint[y0 - y : y1 - y, x0 - x : x1 - x], dst=region)
+
+
 def build_parser() -> argparse.ArgumentParser:
     parser = argparse.ArgumentParser(description="Suppress known artifacts before skeletonization.")
     parser.add_argument("--mask", required=True, help="Input binary mask")
     parser.add_argument("--output", required=True, help="Masked output")
     parser.add_argument("--output-debug", required=True, help="Debug visualization output")
+    parser.add_argument("--output-metrics", help="Optional JSON performance metrics output")
+    parser.add_argument("--roi", help="ROI metadata JSON from the roi pass; rasters are cropped to its window")
     parser.add_argument("--roi-mask", help="Optional ROI mask bitmap")
     parser.add_argument("--roi-mode", choices=["exclude", "include"], default="exclude")
     parser.add_argument("--detect-grid", action="store_true")
     parser.add_argument("--grid-min-length", type=int, default=120)
     parser.add_argument("--grid-gap", type=int, default=8)
     parser.add_argument("--grid-thickness", type=int, default=6)
+    parser.add_argument("--grid-method", choices=["hough", "projection"], default="hough")
+    parser.add_argument("--grid-min-coverage", type=float, default=0.5, help="Fraction of the frame a projected grid line must cover")
+    parser.add_argument("--grid-deskew-max-angle", type=float, default=0.0, help="Search +/- this many degrees for sheet skew")
+    parser.add_argument("--grid-deskew-step", type=float, default=0.1)
+    parser.add_argument("--grid-oblique-hough", action="store_true", help="Run Hough on the residue for oblique lines")
+    parser.add_argument("--grid-axis-tolerance", type=float, default=2.0, help="Degrees from an axis treated as axis-aligned")
     parser.add_argument("--detect-circles", action="store_true")
     parser.add_argument("--circle-min-radius", type=int, default=30)
     parser.add_argument("--circle-max-radius", type=int, default=200)
     parser.add_argument("--circle-param1", type=float, default=120)
     parser.add_argument("--circle-param2", type=float, default=30)
+    parser.add_argument("--detect-symbols", action="store_true")
+    parser.add_argument("--symbol-template", action="append", default=[], help="Binary symbol template image")
+    parser.add_argument("--symbol-scales", default="1.0", help="Comma-separated template scales")
+    parser.add_argument("--symbol-threshold", type=float, default=0.75, help="Minimum normalized correlation")
+    parser.add_argument("--symbol-dilate", type=int, default=2, help="Grow matched footprints by this many pixels")
+    parser.add_argument("--symbol-cache", help="Optional .npz cache of template spectra reused between runs")
+    parser.add_argument("--sparse", action="store_true", help="Run Canny and the circle pre-blur only near mask pixels (same output)")
+    parser.add_argument("--sparse-tile-size", type=int, default=SPARSE_TILE_SIZE)
+    parser.add_argument("--threads", type=int, help="OpenCV threads (default: $LINE_DETECTION_THREADS or 1)")
+    parser.add_argument("--memory-budget-mb", type=int, help="Peak RSS budget to report against")
     return parser
 
 
 def main() -> int:
     args = build_parser().parse_args()
-    mask = load_mask(args.mask)
+    metrics = StageMetrics("artifact_mask")
+    metrics.count("threads", set_thread_budget(args.threads))
+    metrics.set_memory_budget(args.memory_budget_mb)
+    region = load_roi(args.roi)
+    mask = crop_to_roi(load_mask(args.mask, metrics), region)
+    metrics.count("input_pixels", mask.size)
     suppressed = np.zeros_like(mask)
 
     if args.roi_mask:
-        roi = load_mask(args.roi_mask)
+        roi = crop_to_roi(load_mask(args.roi_mask, metrics), region)
         if args.roi_mode == "exclude":
             suppressed = cv2.bitwise_or(suppressed, roi)
         else:
             mask = cv2.bitwise_and(mask, roi)
 
-    if args.detect_grid:
-        lines = detect_grid_lines(mask, args.grid_min_length, args.grid_gap)
-        for x1, y1, x2, y2 in lines:
-            cv2.line(suppressed, (x1, y1), (x2, y2), 255, args.grid_thickness)
+    windows = None
+    if args.sparse:
+        with metrics.step("tiles"):
+            windows = sparse_windows(mask, args.sparse_tile_size, SPARSE_REACH, SPARSE_HALO)
+        metrics.count("sparse_windows", len(windows))
+        metrics.count("sparse_pixels", sum((w.y1 - w.y0) * (w.x1 - w.x0) for w in windows))
+
+    if args.detect_grid and args.grid_method == "projection":
+        with metrics.step("grid"):
+            bands, skew_angle = detect_grid_bands(
+                mask,
+                args.grid_min_length,
+                args.grid_min_coverage,
+                args.grid_thickness,
+                args.grid_deskew_max_angle,
+                args.grid_deskew_step,
+            )
+            for x1, y1, x2, y2, thickness in bands:
+                cv2.line(suppressed, (x1, y1), (x2, y2), 255, thickness)
+            if args.grid_oblique_hough:
+                residue = cv2.bitwise_and(mask, cv2.bitwise_not(suppressed))
+                lines = detect_grid_lines(residue, args.grid_min_length, args.grid_gap, windows)
+                for x1, y1, x2, y2 in filter_oblique(lines, skew_angle, args.grid_axis_tolerance):
+                    cv2.line(suppressed, (x1, y1), (x2, y2), 255, args.grid_thickness)
+    elif args.detect_grid:
+        with metrics.step("grid"):
+            lines = detect_grid_lines(mask, args.grid_min_length, args.grid_gap, windows)
+            for x1, y1, x2, y2 in lines:
+                cv2.line(suppressed, (x1, y1), (x2, y2), 255, args.grid_thickness)
 
     if args.detect_circles:
-        circles = detect_circles(mask, args.circle_min_radius, args.circle_max_radius, args.circle_param1, args.circle_param2)
-        for x, y, r in circles:
-            cv2.circle(suppressed, (x, y), r, 255, thickness=-1)
+        with metrics.step("circles"):
+            circles = detect_circles(
+                mask,
+                args.circle_min_radius,
+                args.circle_max_radius,
+                args.circle_param1,
+                args.circle_param2,
+                windows,
+            )
+            for x, y, r in circles:
+                cv2.circle(suppressed, (x, y), r, 255, thickness=-1)
 
-    output = cv2.bitwise_and(mask, cv2.bitwise_not(suppressed))
-    debug = cv2.cvtColor(mask, cv2.COLOR_GRAY2BGR)
-    debug[suppressed > 0] = (0, 0, 255)
+    if args.detect_symbols:
+        with metrics.step("symbols"):
+            templates = load_symbol_templates(args.symbol_template)
+            scales = [float(item) for item in args.symbol_scales.split(",") if item.strip() != ""]
+            cache = load_spectra_cache(args.symbol_cache)
+            cached_keys = set(cache)
+            matches = detect_symbols(mask, templates, scales, args.symbol_threshold, cache)
+            stamp_symbols(suppressed, matches, args.symbol_dilate)
+            if set(cache) != cached_keys:
+                save_spectra_cache(args.symbol_cache, cache)
 
-    save_mask(args.output, output)
-    cv2.imwrite(args.output_debug, debug)
+    with AsyncWriter(metrics) as writer:
+        with metrics.step("threshold"):
+            output = cv2.bitwise_and(mask, cv2.bitwise_not(suppressed))
+        writer.save_mask(args.output, output)
+        metrics.count("output_pixels", cv2.countNonZero(output))
+        with metrics.step("debug"):
+            debug = cv2.cvtColor(mask, cv2.COLOR_GRAY2BGR)
+            paint_mask(debug, suppressed, (0, 0, 255))
+        writer.save_image(args.output_debug, debug)
+    metrics.check_memory_budget()
+    if args.output_metrics:
+        save_json(args.output_metrics, metrics.as_dict())
     return 0
 
 
 if __name__ == "__main__":
-    raise SystemExit(main())
+    raise SystemExit(run_stage(main))
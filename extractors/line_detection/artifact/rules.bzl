@@ -1,14 +1,22 @@
-load("//extractors/line_detection:defs.bzl", "TransformationInfo")
+load("//extractors/line_detection:defs.bzl", "TransformationInfo", "declare_profile", "declare_memory_budget", "declare_threads")
 load("//tools/previewer:preview_rules.bzl", "run_preview_action")
 
 
 def _artifact_impl(ctx):
     output = ctx.outputs.out
     debug = ctx.outputs.debug
+    metrics = ctx.actions.declare_file(ctx.label.name + "_metrics.json")
+    profile, profile_env = declare_profile(ctx)
+    execution_requirements, threads_env = declare_threads(ctx)
+    env = dict(profile_env, **threads_env)
+    env.update(declare_memory_budget(ctx))
     args = ctx.actions.args()
+    args.use_param_file("@%s", use_always = True)
+    args.set_param_file_format("multiline")
     args.add("--mask", ctx.file.mask.path)
     args.add("--output", output.path)
     args.add("--output-debug", debug.path)
+    args.add("--output-metrics", metrics.path)
     if ctx.file.roi_mask:
         args.add("--roi-mask", ctx.file.roi_mask.path)
         args.add("--roi-mode", ctx.attr.roi_mode)
@@ -17,23 +25,48 @@ def _artifact_impl(ctx):
     args.add("--grid-min-length", ctx.attr.grid_min_length)
     args.add("--grid-gap", ctx.attr.grid_gap)
     args.add("--grid-thickness", ctx.attr.grid_thickness)
+    args.add("--grid-method", ctx.attr.grid_method)
+    args.add("--grid-min-coverage", ctx.attr.grid_min_coverage)
+    args.add("--grid-deskew-max-angle", ctx.attr.grid_deskew_max_angle)
+    args.add("--grid-deskew-step", ctx.attr.grid_deskew_step)
+    if ctx.attr.grid_oblique_hough:
+        args.add("--grid-oblique-hough")
+    args.add("--grid-axis-tolerance", ctx.attr.grid_axis_tolerance)
     if ctx.attr.detect_circles:
         args.add("--detect-circles")
     args.add("--circle-min-radius", ctx.attr.circle_min_radius)
     args.add("--circle-max-radius", ctx.attr.circle_max_radius)
     args.add("--circle-param1", ctx.attr.circle_param1)
     args.add("--circle-param2", ctx.attr.circle_param2)
+    if ctx.attr.detect_symbols:
+        args.add("--detect-symbols")
+        for template in ctx.files.symbol_templates:
+            args.add("--symbol-template", template.path)
+    args.add("--symbol-scales", ctx.attr.symbol_scales)
+    args.add("--symbol-threshold", ctx.attr.symbol_threshold)
+    args.add("--symbol-dilate", ctx.attr.symbol_dilate)
+    if ctx.attr.sparse:
+        args.add("--sparse")
+        args.add("--sparse-tile-size", ctx.attr.sparse_tile_size)
 
     inputs = [ctx.file.mask]
     if ctx.file.roi_mask:
         inputs.append(ctx.file.roi_mask)
+    if ctx.attr.detect_symbols:
+        inputs.extend(ctx.files.symbol_templates)
+    if ctx.file.roi:
+        args.add("--roi", ctx.file.roi.path)
+        inputs.append(ctx.file.roi)
 
     ctx.actions.run(
         inputs = inputs,
-        outputs = [output, debug],
+        outputs = [output, debug, metrics] + ([profile] if profile else []),
         executable = ctx.executable._tool,
         arguments = [args],
         tools = [ctx.executable._tool],
+        env = env,
+        mnemonic = "LineArtifactMask",
+        execution_requirements = execution_requirements,
         progress_message = "Suppressing artifacts",
     )
 
@@ -41,6 +74,7 @@ def _artifact_impl(ctx):
         ctx,
         image = ctx.file.image,
         overlay_mask = output,
+        roi = ctx.file.roi,
         debug_images = [debug],
         title = "Artifact suppression preview",
         parameters = {
@@ -49,11 +83,19 @@ def _artifact_impl(ctx):
             "grid_min_length": str(ctx.attr.grid_min_length),
             "grid_gap": str(ctx.attr.grid_gap),
             "grid_thickness": str(ctx.attr.grid_thickness),
+            "grid_method": ctx.attr.grid_method,
+            "grid_min_coverage": ctx.attr.grid_min_coverage,
+            "grid_deskew_max_angle": ctx.attr.grid_deskew_max_angle,
+            "grid_oblique_hough": str(ctx.attr.grid_oblique_hough),
             "detect_circles": str(ctx.attr.detect_circles),
             "circle_min_radius": str(ctx.attr.circle_min_radius),
             "circle_max_radius": str(ctx.attr.circle_max_radius),
             "circle_param1": ctx.attr.circle_param1,
             "circle_param2": ctx.attr.circle_param2,
+            "detect_symbols": str(ctx.attr.detect_symbols),
+            "symbol_templates": str(len(ctx.files.symbol_templates)),
+            "symbol_scales": ctx.attr.symbol_scales,
+            "symbol_threshold": ctx.attr.symbol_threshold,
         },
         assets = [
             {"label": "artifact_masked", "path": output.short_path},
@@ -63,9 +105,17 @@ def _artifact_impl(ctx):
 
     return [
         DefaultInfo(files = depset([output, debug, preview])),
+        OutputGroupInfo(
+            metrics = depset([metrics]),
+            profile = depset([profile] if profile else []),
+        ),
         TransformationInfo(
-            description = "Suppress grid/circle artifacts before skeletonization.",
-            metadata = {"detect_grid": ctx.attr.detect_grid, "detect_circles": ctx.attr.detect_circles},
+            description = "Suppress grid/circle/symbol artifacts before skeletonization.",
+            metadata = {
+                "detect_grid": ctx.attr.detect_grid,
+                "detect_circles": ctx.attr.detect_circles,
+                "detect_symbols": ctx.attr.detect_symbols,
+            },
         ),
     ]
 
@@ -74,6 +124,7 @@ line_artifact_mask = rule(
     implementation = _artifact_impl,
     attrs = {
         "image": attr.label(allow_single_file = True, mandatory = True),
+        "roi": attr.label(allow_single_file = True),
         "mask": attr.label(allow_single_file = True, mandatory = True),
         "roi_mask": attr.label(allow_single_file = True),
         "roi_mode": attr.string(default = "exclude"),
@@ -83,11 +134,24 @@ line_artifact_mask = rule(
         "grid_min_length": attr.int(default = 120),
         "grid_gap": attr.int(default = 8),
         "grid_thickness": attr.int(default = 6),
+        "grid_method": attr.string(default = "hough"),
+        "grid_min_coverage": attr.string(default = "0.5"),
+        "grid_deskew_max_angle": attr.string(default = "0.0"),
+        "grid_deskew_step": attr.string(default = "0.1"),
+        "grid_oblique_hough": attr.bool(default = False),
+        "grid_axis_tolerance": attr.string(default = "2.0"),
         "detect_circles": attr.bool(default = False),
         "circle_min_radius": attr.int(default = 30),
         "circle_max_radius": attr.int(default = 200),
         "circle_param1": attr.string(default = "120"),
         "circle_param2": attr.string(default = "30"),
+        "detect_symbols": attr.bool(default = False),
+        "symbol_templates": attr.label_list(allow_files = True),
+        "symbol_scales": attr.string(default = "1.0"),
+        "symbol_threshold": attr.string(default = "0.75"),
+        "symbol_dilate": attr.int(default = 2),
+        "sparse": attr.bool(default = False),
+        "sparse_tile_size": attr.int(default = 64),
         "_tool": attr.label(
             default = Label("//extractors/line_detection/artifact:artifact_mask"),
             executable = True,
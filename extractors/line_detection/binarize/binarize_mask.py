@@ -2,12 +2,28 @@
 from __future__ import annotations
 
 import argparse
-from typing import Tuple
+from typing import Optional, Tuple
 
 import cv2
 import numpy as np
 
-from extractors.line_detection.pipeline_utils import ensure_odd, load_image, load_mask, save_mask
+from extractors.line_detection.pipeline_utils import (
+    SPARSE_TILE_SIZE,
+    AsyncWriter,
+    StageMetrics,
+    crop_to_roi,
+    ensure_odd,
+    load_image,
+    load_mask,
+    load_roi,
+    opencv_threads,
+    paint_mask,
+    save_image,
+    save_json,
+    set_thread_budget,
+    sparse_windows,
+)
+from extractors.line_detection.worker import run_stage
 
 
 def parse_tuple(value: str) -> Tuple[int, int]:
@@ -31,16 +47,53 @@ def apply_blur(gray: np.ndarray, blur_type: str, radius: int) -> np.ndarray:
     raise ValueError(f"Unsupported blur type: {blur_type}")
 
 
+def blur_reach(blur_type: str, radius: int) -> int:
+    if blur_type == "none" or radius <= 0:
+        return 0
+    if blur_type == "bilateral":
+        return radius // 2
+    return ensure_odd(radius) // 2
+
+
+def mask_gray(image: np.ndarray, candidate: np.ndarray, blur_type: str, radius: int) -> np.ndarray:
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    gray = apply_blur(gray, blur_type, radius)
+    return cv2.bitwise_and(gray, gray, mask=candidate)
+
+
+def threshold_reach(args: argparse.Namespace) -> int:
+    return ensure_odd(max(args.adaptive_window, 3)) // 2 if args.method == "adaptive" else 0
+
+
+def threshold_gray(masked_gray: np.ndarray, args: argparse.Namespace) -> np.ndarray:
+    if args.method == "adaptive":
+        return cv2.adaptiveThreshold(
+            masked_gray,
+            255,
+            cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
+            cv2.THRESH_BINARY,
+            ensure_odd(max(args.adaptive_window, 3)),
+            args.adaptive_c,
+        )
+    _, thresh = cv2.threshold(masked_gray, args.global_threshold, 255, cv2.THRESH_BINARY)
+    return thresh
+
+
+def threshold_debug(masked_gray: np.ndarray, thresh: np.ndarray, out: Optional[np.ndarray] = None) -> np.ndarray:
+    debug = cv2.cvtColor(masked_gray, cv2.COLOR_GRAY2BGR, dst=out)
+    paint_mask(debug, thresh, (255, 255, 255))
+    return debug
+
+
 def hysteresis_threshold(gray: np.ndarray, low: int, high: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
-    strong = (gray >= high).astype(np.uint8) * 255
-    weak = (gray >= low).astype(np.uint8) * 255
-    labels, count = cv2.connectedComponents(weak)
-    output = np.zeros_like(gray, dtype=np.uint8)
-    for label in range(1, count):
-        component = labels == label
-        if np.any(strong[component] > 0):
-            output[component] = 255
-    return output, strong, weak
+    strong = cv2.compare(gray, high, cv2.CMP_GE)
+    weak = cv2.compare(gray, low, cv2.CMP_GE)
+    count, labels = cv2.connectedComponents(weak)
+    # Keep every weak component that holds a strong pixel, through one per-label lookup table.
+    keep = np.zeros(count, dtype=np.uint8)
+    keep[labels[strong > 0]] = 255
+    keep[0] = 0
+    return keep[labels], strong, weak
 
 
 def build_parser() -> argparse.ArgumentParser:
@@ -49,6 +102,8 @@ def build_parser() -> argparse.ArgumentParser:
     parser.add_argument("--mask", required=True, help="Candidate mask from segmentation")
     parser.add_argument("--output", required=True, help="Binary mask output")
     parser.add_argument("--output-debug", required=True, help="Debug visualization output")
+    parser.add_argument("--output-metrics", help="Optional JSON performance metrics output")
+    parser.add_argument("--roi", help="ROI metadata JSON from the roi pass; rasters are cropped to its window")
     parser.add_argument("--method", choices=["adaptive", "hysteresis", "global"], default="adaptive")
     parser.add_argument("--adaptive-window", type=int, default=31)
     parser.add_argument("--adaptive-c", type=float, default=2.0)
@@ -56,49 +111,111 @@ def build_parser() -> argparse.ArgumentParser:
     parser.add_argument("--global-threshold", type=int, default=120)
     parser.add_argument("--blur", choices=["none", "gaussian", "median", "bilateral"], default="gaussian")
     parser.add_argument("--blur-radius", type=int, default=3)
+    parser.add_argument("--sparse", action="store_true", help="Only process tiles near candidate pixels (same output)")
+    parser.add_argument("--sparse-tile-size", type=int, default=SPARSE_TILE_SIZE)
+    parser.add_argument("--threads", type=int, help="OpenCV threads (default: $LINE_DETECTION_THREADS or 1)")
+    parser.add_argument("--lean", action="store_true", help="Overwrite dead buffers in place to lower peak memory (same output)")
+    parser.add_argument("--memory-budget-mb", type=int, help="Peak RSS budget to report against")
     return parser
 
 
-def main() -> int:
-    args = build_parser().parse_args()
+def binarize_sparse(
+    image: np.ndarray, candidate: np.ndarray, args: argparse.Namespace, metrics: StageMetrics
+) -> Tuple[np.ndarray, Optional[np.ndarray], Optional[np.ndarray], Optional[np.ndarray]]:
+    # Away from candidate pixels the masked grey is 0, so the threshold there is whatever the
+    # operator gives on an all-zero image; only windows within its reach need computing.
+    reach = 0 if args.method == "hysteresis" else threshold_reach(args)
+    with metrics.step("tiles"):
+        windows = sparse_windows(
+            candidate, args.sparse_tile_size, reach, reach + blur_reach(args.blur, args.blur_radius)
+        )
+    metrics.count("sparse_windows", len(windows))
+    metrics.count("sparse_pixels", sum((w.y1 - w.y0) * (w.x1 - w.x0) for w in windows))
+    masked_gray = np.zeros_like(candidate)
+    if args.method == "hysteresis":
+        for window in windows:
+            with metrics.step("convert"):
+                masked_gray[window.area] = mask_gray(image[window.crop], candidate[window.crop], args.blur, args.blur_radius)[window.inner]
+        return masked_gray, None, None, None
+    empty = threshold_gray(np.zeros((1, 1), dtype=np.uint8), args)[0, 0]
+    thresh = np.full_like(candidate, empty)
+    binary = np.zeros_like(candidate)
+    debug = np.full((candidate.shape[0], candidate.shape[1], 3), empty, dtype=np.uint8)
+    for window in windows:
+        with metrics.step("convert"):
+            masked = mask_gray(image[window.crop], candidate[window.crop], args.blur, args.blur_radius)
+        with metrics.step("threshold"):
+            tile = threshold_gray(masked, args)[window.inner]
+            masked = masked[window.inner]
+            thresh[window.area] = tile
+            masked_gray[window.area] = masked
+            binary[window.area] = cv2.bitwise_and(tile, tile, mask=candidate[window.area])
+        with metrics.step("debug"):
+            debug[window.area] = threshold_debug(masked, tile)
+    return masked_gray, thresh, binary, debug
 
-    image = load_image(args.image)
-    candidate = load_mask(args.mask)
-    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-    gray = apply_blur(gray, args.blur, args.blur_radius)
-    masked_gray = cv2.bitwise_and(gray, gray, mask=candidate)
 
-    if args.method == "adaptive":
-        window = ensure_odd(max(args.adaptive_window, 3))
-        thresh = cv2.adaptiveThreshold(
-            masked_gray,
-            255,
-            cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
-            cv2.THRESH_BINARY,
-            window,
-            args.adaptive_c,
-        )
-        binary = cv2.bitwise_and(thresh, thresh, mask=candidate)
-        debug = cv2.cvtColor(masked_gray, cv2.COLOR_GRAY2BGR)
-        debug[thresh > 0] = (255, 255, 255)
-    elif args.method == "global":
-        _, thresh = cv2.threshold(masked_gray, args.global_threshold, 255, cv2.THRESH_BINARY)
-        binary = cv2.bitwise_and(thresh, thresh, mask=candidate)
-        debug = cv2.cvtColor(masked_gray, cv2.COLOR_GRAY2BGR)
-        debug[thresh > 0] = (255, 255, 255)
+def main() -> int:
+    args = build_parser().parse_args()
+    metrics = StageMetrics("binarize_mask")
+    metrics.count("threads", set_thread_budget(args.threads))
+    metrics.set_memory_budget(args.memory_budget_mb)
+
+    roi = load_roi(args.roi)
+    image = crop_to_roi(load_image(args.image, metrics), roi)
+    candidate = crop_to_roi(load_mask(args.mask, metrics), roi)
+    metrics.count("input_pixels", candidate.size)
+    thresh = debug = None
+    debug_written = False
+    if args.sparse:
+        masked_gray, thresh, binary, debug = binarize_sparse(image, candidate, args, metrics)
     else:
-        low, high = parse_tuple(args.hysteresis)
-        binary, strong, weak = hysteresis_threshold(masked_gray, low, high)
-        binary = cv2.bitwise_and(binary, binary, mask=candidate)
-        debug = np.zeros((binary.shape[0], binary.shape[1], 3), dtype=np.uint8)
-        debug[weak > 0] = (80, 80, 80)
-        debug[strong > 0] = (255, 255, 255)
-        debug[binary > 0] = (0, 200, 255)
-
-    save_mask(args.output, binary)
-    cv2.imwrite(args.output_debug, debug)
+        with metrics.step("convert"), opencv_threads("cvtColor", "GaussianBlur", "medianBlur", "bilateralFilter"):
+            masked_gray = mask_gray(image, candidate, args.blur, args.blur_radius)
+    del image
+
+    with AsyncWriter(metrics) as writer:
+        # Both operands are 0/255, so a plain AND is the masked copy without a temporary.
+        if args.method == "hysteresis":
+            low, high = parse_tuple(args.hysteresis)
+            with metrics.step("label"), opencv_threads("connectedComponents"):
+                binary, strong, weak = hysteresis_threshold(masked_gray, low, high)
+                cv2.bitwise_and(binary, candidate, dst=binary)
+        elif thresh is None:
+            with metrics.step("threshold"), opencv_threads("adaptiveThreshold", "threshold"):
+                thresh = threshold_gray(masked_gray, args)
+            if args.lean:
+                # The overlay is the last reader of the grey and thresh, so --lean writes it first
+                # and then masks thresh in place instead of allocating the binary frame.
+                with metrics.step("debug"):
+                    debug = threshold_debug(masked_gray, thresh)
+                save_image(args.output_debug, debug, metrics)
+                debug_written = True
+                del debug, masked_gray
+                binary = cv2.bitwise_and(thresh, candidate, dst=thresh)
+            else:
+                binary = cv2.bitwise_and(thresh, candidate)
+        # The debug overlay is built while the binary mask encodes.
+        writer.save_mask(args.output, binary)
+        metrics.count("output_pixels", cv2.countNonZero(binary))
+
+        if args.method == "hysteresis":
+            with metrics.step("debug"):
+                debug = np.zeros((binary.shape[0], binary.shape[1], 3), dtype=np.uint8)
+                paint_mask(debug, weak, (80, 80, 80))
+                paint_mask(debug, strong, (255, 255, 255))
+                paint_mask(debug, binary, (0, 200, 255))
+            writer.save_image(args.output_debug, debug)
+        elif not debug_written:
+            with metrics.step("debug"):
+                if debug is None:
+                    debug = threshold_debug(masked_gray, thresh)
+            writer.save_image(args.output_debug, debug)
+    metrics.check_memory_budget()
+    if args.output_metrics:
+        save_json(args.output_metrics, metrics.as_dict())
     return 0
 
 
 if __name__ == "__main__":
-    raise SystemExit(main())
+    raise SystemExit(run_stage(main))
@@ -1,15 +1,23 @@
-load("//extractors/line_detection:defs.bzl", "TransformationInfo")
+load("//extractors/line_detection:defs.bzl", "TransformationInfo", "declare_profile", "declare_memory_budget", "declare_threads")
 load("//tools/previewer:preview_rules.bzl", "run_preview_action")
 
 
 def _binarize_impl(ctx):
     output = ctx.outputs.out
     debug = ctx.outputs.debug
+    metrics = ctx.actions.declare_file(ctx.label.name + "_metrics.json")
+    profile, profile_env = declare_profile(ctx)
+    execution_requirements, threads_env = declare_threads(ctx)
+    env = dict(profile_env, **threads_env)
+    env.update(declare_memory_budget(ctx))
     args = ctx.actions.args()
+    args.use_param_file("@%s", use_always = True)
+    args.set_param_file_format("multiline")
     args.add("--image", ctx.file.image.path)
     args.add("--mask", ctx.file.mask.path)
     args.add("--output", output.path)
     args.add("--output-debug", debug.path)
+    args.add("--output-metrics", metrics.path)
     args.add("--method", ctx.attr.method)
     args.add("--adaptive-window", ctx.attr.adaptive_window)
     args.add("--adaptive-c", ctx.attr.adaptive_c)
@@ -17,13 +25,23 @@ def _binarize_impl(ctx):
     args.add("--global-threshold", ctx.attr.global_threshold)
     args.add("--blur", ctx.attr.blur)
     args.add("--blur-radius", ctx.attr.blur_radius)
+    if ctx.attr.sparse:
+        args.add("--sparse")
+        args.add("--sparse-tile-size", ctx.attr.sparse_tile_size)
+    if ctx.attr.lean:
+        args.add("--lean")
+    if ctx.file.roi:
+        args.add("--roi", ctx.file.roi.path)
 
     ctx.actions.run(
-        inputs = [ctx.file.image, ctx.file.mask],
-        outputs = [output, debug],
+        inputs = [ctx.file.image, ctx.file.mask] + ([ctx.file.roi] if ctx.file.roi else []),
+        outputs = [output, debug, metrics] + ([profile] if profile else []),
         executable = ctx.executable._tool,
         arguments = [args],
         tools = [ctx.executable._tool],
+        env = env,
+        mnemonic = "LineBinarize",
+        execution_requirements = execution_requirements,
         progress_message = "Binarizing candidate mask",
     )
 
@@ -31,6 +49,7 @@ def _binarize_impl(ctx):
         ctx,
         image = ctx.file.image,
         overlay_mask = output,
+        roi = ctx.file.roi,
         debug_images = [debug],
         title = "Binarization preview",
         parameters = {
@@ -50,6 +69,10 @@ def _binarize_impl(ctx):
 
     return [
         DefaultInfo(files = depset([output, debug, preview])),
+        OutputGroupInfo(
+            metrics = depset([metrics]),
+            profile = depset([profile] if profile else []),
+        ),
         TransformationInfo(
             description = "Binarize the candidate mask using adaptive or hysteresis thresholding.",
             metadata = {"method": ctx.attr.method},
@@ -61,6 +84,7 @@ line_binarize = rule(
     implementation = _binarize_impl,
     attrs = {
         "image": attr.label(allow_single_file = True, mandatory = True),
+        "roi": attr.label(allow_single_file = True),
         "mask": attr.label(allow_single_file = True, mandatory = True),
         "out": attr.output(mandatory = True),
         "debug": attr.output(mandatory = True),
@@ -71,6 +95,9 @@ line_binarize = rule(
         "global_threshold": attr.int(default = 120),
         "blur": attr.string(default = "gaussian"),
         "blur_radius": attr.int(default = 3),
+        "sparse": attr.bool(default = False),
+        "sparse_tile_size": attr.int(default = 64),
+        "lean": attr.bool(default = False),
         "_tool": attr.label(
             default = Label("//extractors/line_detection/binarize:binarize_mask"),
             executable = True,
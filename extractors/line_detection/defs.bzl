@@ -2,3 +2,74 @@ TransformationInfo = provider(
     doc = "Describes a line-detection transformation and its parameters.",
     fields = ["description", "metadata"],
 )
+
+PROFILE_DEFINE = "line_detection_profile"
+THREADS_DEFINE = "line_detection_threads"
+MEMORY_BUDGET_DEFINE = "line_detection_memory_budget_mb"
+
+# Stage tools speak the JSON persistent-worker protocol (see worker.py).
+WORKER_EXECUTION_REQUIREMENTS = {
+    "supports-workers": "1",
+    "requires-worker-protocol": "json",
+}
+
+
+def declare_profile(ctx):
+    """Declares a collapsed-stack profile for the action when built with --define=line_detection_profile=1.
+
+    Returns the profile file (or None) and the environment that enables the stage's sampler.
+    """
+    if ctx.var.get(PROFILE_DEFINE) != "1":
+        return None, {}
+    profile = ctx.actions.declare_file(ctx.label.name + "_profile.folded")
+    return profile, {"LINE_DETECTION_PROFILE": profile.path}
+
+
+def declare_threads(ctx):
+    """Thread budget for stages with threaded OpenCV operations, from --define=line_detection_threads=N.
+
+    Returns the execution requirements with a cpu:N resource hint, so schedulers reserve the
+    cores the stage will use, and the environment that hands the same budget to the stage.
+    """
+    value = ctx.var.get(THREADS_DEFINE, "1")
+    if not value.isdigit() or int(value) < 1:
+        fail("--define=%s must be a positive integer, got '%s'" % (THREADS_DEFINE, value))
+    threads = int(value)
+    if threads == 1:
+        return WORKER_EXECUTION_REQUIREMENTS, {}
+    requirements = dict(WORKER_EXECUTION_REQUIREMENTS)
+    requirements["cpu:%d" % threads] = ""
+    return requirements, {"LINE_DETECTION_THREADS": str(threads)}
+
+
+def declare_workers(ctx, execution_requirements):
+    """Adds a cpu:N resource hint for stages that spread --components over `workers` processes.
+
+    The hint covers the larger of the worker count and any thread budget already requested,
+    since the stage uses one and then the other.
+    """
+    if not ctx.attr.components or ctx.attr.workers <= 1:
+        return execution_requirements
+    cores = ctx.attr.workers
+    requirements = {}
+    for key, value in execution_requirements.items():
+        if key.startswith("cpu:"):
+            cores = max(cores, int(key[len("cpu:"):]))
+        else:
+            requirements[key] = value
+    requirements["cpu:%d" % cores] = ""
+    return requirements
+
+
+def declare_memory_budget(ctx):
+    """Peak RSS budget for raster stages, from --define=line_detection_memory_budget_mb=N.
+
+    Returns the environment that hands the budget to the stage; the stage reports its peak
+    against it in the metrics and warns when it goes over.
+    """
+    value = ctx.var.get(MEMORY_BUDGET_DEFINE)
+    if value == None:
+        return {}
+    if not value.isdigit() or int(value) < 1:
+        fail("--define=%s must be a positive integer, got '%s'" % (MEMORY_BUDGET_DEFINE, value))
+    return {"LINE_DETECTION_MEMORY_BUDGET_MB": value}
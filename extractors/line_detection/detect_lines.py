@@ -25,7 +25,8 @@ except ImportError as exc:  # pragma: no cover - runtime dependency
     raise SystemExit("Missing dependency: opencv-python. Install with 'pip install opencv-python'.") from exc
 
 try:
-    from shapely.geometry import LineString, MultiLineString, Polygon
+    import shapely
+    from shapely.geometry import LineString, MultiPolygon, Polygon
 except ImportError as exc:  # pragma: no cover - runtime dependency
     raise SystemExit("Missing dependency: shapely. Install with 'pip install shapely'.") from exc
 
@@ -46,6 +47,11 @@ class Bounds:
         world_y = self.max_y - y_ratio * (self.max_y - self.min_y)
         return world_x, world_y
 
+    def to_pixels(self, coords: np.ndarray, width: int, height: int) -> np.ndarray:
+        pixel_x = (coords[:, 0] - self.min_x) / (self.max_x - self.min_x) * (width - 1)
+        pixel_y = (self.max_y - coords[:, 1]) / (self.max_y - self.min_y) * (height - 1)
+        return np.column_stack([pixel_x, pixel_y])
+
 
 def load_image(path: str) -> np.ndarray:
     image = cv2.imread(path, cv2.IMREAD_COLOR)
@@ -75,6 +81,14 @@ def parse_polygon(value: str) -> List[Tuple[float, float]]:
     return points
 
 
+# Rasterized clip regions are grown by this many pixels so contours cut at the
+# region edge end outside the polygon, where the exact vector clip removes them.
+ROI_MARGIN = 2
+# extract_color_mask runs a 3x3 open then close; crops keep this much extra context.
+MORPHOLOGY_CONTEXT = 2
+LINEAR_TYPES = (shapely.GeometryType.LINESTRING, shapely.GeometryType.MULTILINESTRING)
+
+
 def extract_color_mask(image: np.ndarray, lower_hsv: Tuple[int, int, int], upper_hsv: Tuple[int, int, int]) -> np.ndarray:
     hsv = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
     mask = cv2.inRange(hsv, np.array(lower_hsv), np.array(upper_hsv))
@@ -84,38 +98,106 @@ def extract_color_mask(image: np.ndarray, lower_hsv: Tuple[int, int, int], upper
     return mask
 
 
-def contours_to_lines(
+def polygon_pixel_rings(polygon: Polygon | MultiPolygon, bounds: Bounds, width: int, height: int) -> Tuple[list, list]:
+    exteriors, holes = [], []
+    for part in getattr(polygon, "geoms", [polygon]):
+        exteriors.append(bounds.to_pixels(np.asarray(part.exterior.coords), width, height))
+        holes.extend(bounds.to_pixels(np.asarray(ring.coords), width, height) for ring in part.interiors)
+    return exteriors, holes
+
+
+def polygon_window(
+    polygon: Polygon | MultiPolygon,
+    bounds: Bounds,
+    width: int,
+    height: int,
+) -> Tuple[Tuple[int, int, int, int], np.ndarray] | None:
+    """Return the pixel window (x0, y0, x1, y1) covering the polygon and its mask within that window."""
+    exteriors, holes = polygon_pixel_rings(polygon, bounds, width, height)
+    corners = np.concatenate(exteriors)
+    pad = ROI_MARGIN + MORPHOLOGY_CONTEXT + 1
+    x0 = max(int(np.floor(corners[:, 0].min())) - pad, 0)
+    y0 = max(int(np.floor(corners[:, 1].min())) - pad, 0)
+    x1 = min(int(np.ceil(corners[:, 0].max())) + pad + 1, width)
+    y1 = min(int(np.ceil(corners[:, 1].max())) + pad + 1, height)
+    if x0 >= x1 or y0 >= y1:
+        return None
+
+    offset = np.array([x0, y0], dtype=np.float64)
+    mask = np.zeros((y1 - y0, x1 - x0), dtype=np.uint8)
+    cv2.fillPoly(mask, [np.rint(ring - offset).astype(np.int32) for ring in exteriors], 255)
+    if holes:
+        cv2.fillPoly(mask, [np.rint(ring - offset).astype(np.int32) for ring in holes], 0)
+    kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (2 * ROI_MARGIN + 1, 2 * ROI_MARGIN + 1))
+    return (x0, y0, x1, y1), cv2.dilate(mask, kernel)
+
+
+def contours_to_world(
     contours: Iterable[np.ndarray],
     bounds: Bounds,
     width: int,
     height: int,
     simplify_tolerance: float,
-    polygon: Polygon | None,
-) -> List[LineString]:
-    lines: List[LineString] = []
+) -> List[np.ndarray]:
+    coords: List[np.ndarray] = []
     for contour in contours:
         if contour.shape[0] < 2:
             continue
         arc_length = cv2.arcLength(contour, False)
         epsilon = simplify_tolerance * arc_length if simplify_tolerance > 0 else 0
         simplified = cv2.approxPolyDP(contour, epsilon, False) if epsilon > 0 else contour
-        coords = [bounds.to_world(float(point[0][0]), float(point[0][1]), width, height) for point in simplified]
-        if len(coords) < 2:
+        if simplified.shape[0] < 2:
             continue
-        line = LineString(coords)
-        if polygon is not None:
-            clipped = line.intersection(polygon)
-            if clipped.is_empty:
-                continue
-            if isinstance(clipped, LineString):
-                lines.append(clipped)
-            elif isinstance(clipped, MultiLineString):
-                lines.extend(list(clipped.geoms))
-            else:
-                continue
-        else:
-            lines.append(line)
-    return lines
+        pixels = simplified[:, 0, :].astype(np.float64)
+        # Same arithmetic as Bounds.to_world, applied to the whole contour at once.
+        world_x = bounds.min_x + pixels[:, 0] / (width - 1) * (bounds.max_x - bounds.min_x)
+        world_y = bounds.max_y - pixels[:, 1] / (height - 1) * (bounds.max_y - bounds.min_y)
+        coords.append(np.column_stack([world_x, world_y]))
+    return coords
+
+
+def clip_lines(lines: np.ndarray, polygon: Polygon | MultiPolygon) -> np.ndarray:
+    if lines.size == 0:
+        return lines
+    shapely.prepare(polygon)
+    min_x, min_y, max_x, max_y = polygon.bounds
+    line_bounds = shapely.bounds(lines)
+    candidates = (
+        (line_bounds[:, 0] <= max_x)
+        & (line_bounds[:, 2] >= min_x)
+        & (line_bounds[:, 1] <= max_y)
+        & (line_bounds[:, 3] >= min_y)
+    )
+    candidates = lines[candidates]
+    candidates = candidates[shapely.intersects(polygon, candidates)]
+    # Every surviving line goes through the overlay, even when wholly inside: GEOS nodes
+    # self-overlapping contours into separate parts, and the output depends on that.
+    clipped = shapely.intersection(candidates, polygon)
+
+    # Keep linear results only, exploding multi-part lines in contour order.
+    linear = np.isin(shapely.get_type_id(clipped), LINEAR_TYPES)
+    parts = shapely.get_parts(clipped[linear])
+    return parts[~shapely.is_empty(parts)]
+
+
+def contours_to_lines(
+    contours: Iterable[np.ndarray],
+    bounds: Bounds,
+    width: int,
+    height: int,
+    simplify_tolerance: float,
+    polygon: Polygon | MultiPolygon | None,
+) -> List[LineString]:
+    coords = contours_to_world(contours, bounds, width, height, simplify_tolerance)
+    if not coords:
+        return []
+    lines = shapely.linestrings(
+        np.concatenate(coords),
+        indices=np.repeat(np.arange(len(coords)), [part.shape[0] for part in coords]),
+    )
+    if polygon is not None:
+        lines = clip_lines(lines, polygon)
+    return list(lines)
 
 
 def lines_to_geojson(lines: Iterable[LineString]) -> dict:
@@ -178,29 +260,60 @@ def parse_hsv(value: str) -> Tuple[int, int, int]:
     return tuple(int(part) for part in parts)  # type: ignore[return-value]
 
 
-def main() -> int:
-    parser = build_arg_parser()
-    args = parser.parse_args()
-
-    bounds = parse_bbox(args.bbox)
-    polygon_points = parse_polygon(args.polygon)
-    polygon = Polygon(polygon_points)
+def build_polygon(value: str) -> Polygon:
+    polygon = Polygon(parse_polygon(value))
     if not polygon.is_valid:
         polygon = polygon.buffer(0)
     if polygon.is_empty:
-        raise SystemExit("Provided polygon is invalid or empty.")
+        raise ValueError("Provided polygon is invalid or empty.")
+    return polygon
 
-    image = load_image(args.image)
+
+def detect_lines(
+    image: np.ndarray,
+    bounds: Bounds,
+    polygon: Polygon | MultiPolygon | None,
+    lower_hsv: Tuple[int, int, int],
+    upper_hsv: Tuple[int, int, int],
+    simplify: float,
+) -> dict:
     height, width = image.shape[:2]
+    if polygon is None:
+        mask = extract_color_mask(image, lower_hsv, upper_hsv)
+        offset = (0, 0)
+    else:
+        # Only the polygon's pixel window is converted and traced; everything else is skipped.
+        window = polygon_window(polygon, bounds, width, height)
+        if window is None:
+            return lines_to_geojson([])
+        (x0, y0, x1, y1), roi = window
+        mask = extract_color_mask(image[y0:y1, x0:x1], lower_hsv, upper_hsv)
+        cv2.bitwise_and(mask, roi, dst=mask)
+        offset = (x0, y0)
+    contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_NONE, offset=offset)
+    lines = contours_to_lines(contours, bounds, width, height, simplify, polygon)
+    return lines_to_geojson(lines)
 
-    lower_hsv = parse_hsv(args.lower_hsv)
-    upper_hsv = parse_hsv(args.upper_hsv)
-    mask = extract_color_mask(image, lower_hsv, upper_hsv)
 
-    contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_NONE)
-    lines = contours_to_lines(contours, bounds, width, height, args.simplify, polygon)
+def main() -> int:
+    parser = build_arg_parser()
+    args = parser.parse_args()
+
+    bounds = parse_bbox(args.bbox)
+    try:
+        polygon = build_polygon(args.polygon)
+    except ValueError as exc:
+        raise SystemExit(str(exc)) from exc
 
-    geojson = lines_to_geojson(lines)
+    image = load_image(args.image)
+    geojson = detect_lines(
+        image,
+        bounds,
+        polygon,
+        parse_hsv(args.lower_hsv),
+        parse_hsv(args.upper_hsv),
+        args.simplify,
+    )
     output_text = json.dumps(geojson, ensure_ascii=False, indent=2)
 
     if args.output == "-":
@@ -212,9 +325,22 @@ def main() -> int:
     return 0
 
 
+def run_main() -> int:
+    # The script must keep working on its own, so the profiler is optional. Run as
+    # `python extractors/line_detection/detect_lines.py`, only this directory is on sys.path.
+    try:
+        from extractors.line_detection.profiling import run_profiled
+    except ImportError:
+        try:
+            from profiling import run_profiled
+        except ImportError:
+            return main()
+    return run_profiled(main)
+
+
 if __name__ == "__main__":
     try:
-        raise SystemExit(main())
+        raise SystemExit(run_main())
     except Exception as exc:  # pragma: no cover - surface errors
         print(f"Error: {exc}", file=sys.stderr)
         raise SystemExit(1)
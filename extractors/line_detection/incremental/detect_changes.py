@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+from __future__ import annotations
+
+import argparse
+from typing import List, Tuple
+
+import cv2
+import numpy as np
+import shapely
+
+from extractors.line_detection.pipeline_utils import (
+    ROI_CONTEXT,
+    ROI_MARGIN,
+    AsyncWriter,
+    Bounds,
+    RegionOfInterest,
+    StageMetrics,
+    load_image,
+    paint_mask,
+    save_json,
+)
+from extractors.line_detection.worker import run_stage
+
+# The warp is estimated on a copy whose longer side is at most this many pixels.
+ALIGN_MAX_SIDE = 1024
+# Sub-pixel shifts below this are treated as no shift, so an unchanged re-issue is not resampled.
+ALIGN_MIN_SHIFT = 0.05
+MOTIONS = {"translation": cv2.MOTION_TRANSLATION, "euclidean": cv2.MOTION_EUCLIDEAN, "affine": cv2.MOTION_AFFINE}
+
+
+def estimate_warp(previous: np.ndarray, current: np.ndarray, motion: str) -> np.ndarray:
+    # Returns the 2x3 map from previous-sheet pixels to new-image pixels.
+    scale = min(1.0, ALIGN_MAX_SIDE / max(previous.shape))
+    template = cv2.resize(previous, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    moving = cv2.resize(current, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    warp = np.eye(2, 3, dtype=np.float32)
+    criteria = (cv2.TERM_CRITERIA_EPS | cv2.TERM_CRITERIA_COUNT, 100, 1e-6)
+    try:
+        _, warp = cv2.findTransformECC(template, moving, warp, MOTIONS[motion], criteria, None, 5)
+    except cv2.error as exc:
+        raise ValueError(f"Failed to align the new image with the previous version: {exc}") from exc
+    warp = warp.astype(np.float64)
+    warp[:, 2] /= scale
+    return warp
+
+
+def is_identity(warp: np.ndarray, extent: int) -> bool:
+    # Largest displacement the warp causes anywhere on a sheet of this extent.
+    linear = np.abs(warp[:, :2] - np.eye(2)).max() * extent
+    return float(np.abs(warp[:, 2]).max() + linear) < ALIGN_MIN_SHIFT
+
+
+def tile_changes(diff: np.ndarray, tile_size: int, min_pixels: int) -> np.ndarray:
+    height, width = diff.shape
+    rows = -(-height // tile_size)
+    cols = -(-width // tile_size)
+    padded = np.zeros((rows * tile_size, cols * tile_size), dtype=np.int32)
+    padded[:height, :width] = diff > 0
+    counts = padded.reshape(rows, tile_size, cols, tile_size).sum(axis=(1, 3))
+    return counts >= min_pixels
+
+
+def tile_regions(
+    changed: np.ndarray, tile_size: int, halo: int, width: int, height: int
+) -> Tuple[shapely.Geometry, shapely.Geometry]:
+    # Pixel centres sit on integer coordinates, so tile edges fall on half-pixel lines.
+    sheet = shapely.box(-0.5, -0.5, width - 0.5, height - 0.5)
+    rows, cols = np.nonzero(changed)
+    x0 = cols * tile_size - 0.5
+    y0 = rows * tile_size - 0.5
+    core = shapely.intersection(
+        shapely.union_all(shapely.box(x0, y0, x0 + tile_size, y0 + tile_size)), sheet
+    )
+    region = shapely.intersection(shapely.buffer(core, halo, join_style="mitre"), sheet)
+    return core, region
+
+
+def polygon_rings(geometry: shapely.Geometry) -> List[np.ndarray]:
+    # Holes are dropped: an unchanged pocket inside a changed area is simply re-extracted.
+    return [
+        shapely.get_coordinates(shapely.get_exterior_ring(polygon))
+        for polygon in shapely.get_parts(geometry)
+        if not polygon.is_empty
+    ]
+
+
+def rings_to_world(rings: List[np.ndarray], bounds: Bounds, width: int, height: int) -> List[List[List[float]]]:
+    return [[list(bounds.to_world(x, y, width, height)) for x, y in ring] for ring in rings]
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Align a re-issued map sheet with its previous version and find changed tiles.")
+    parser.add_argument("--image", required=True, help="New version of the map image")
+    parser.add_argument("--previous-image", required=True, help="Previous version of the map image")
+    parser.add_argument("--bbox", required=True, nargs=4, metavar=("MIN_X", "MIN_Y", "MAX_X", "MAX_Y"))
+    parser.add_argument("--output", required=True, help="Change report JSON output")
+    parser.add_argument("--output-aligned", required=True, help="New image warped onto the previous sheet")
+    parser.add_argument("--output-roi", required=True, help="ROI metadata JSON covering changed tiles plus halo")
+    parser.add_argument("--output-mask", required=True, help="Sheet-sized mask of changed tiles")
+    parser.add_argument("--output-debug", required=True, help="Debug image output")
+    parser.add_argument("--output-metrics", help="Optional JSON performance metrics output")
+    parser.add_argument("--motion", choices=["none", *MOTIONS], default="translation")
+    parser.add_argument("--tile-size", type=int, default=256)
+    parser.add_argument("--halo", type=int, default=64, help="Pixels re-extracted around changed tiles")
+    parser.add_argument("--threshold", type=int, default=40, help="Grey-level difference counted as a change")
+    parser.add_argument("--blur", type=int, default=5, help="Gaussian kernel applied before differencing (0 disables)")
+    parser.add_argument("--min-changed-pixels", type=int, default=8, help="Changed pixels needed to mark a tile")
+    parser.add_argument("--margin", type=int, default=ROI_MARGIN)
+    parser.add_argument("--context", type=int, default=ROI_CONTEXT)
+    return parser
+
+
+def main() -> int:
+    args = build_parser().parse_args()
+    if args.tile_size < 16:
+        raise ValueError("--tile-size must be >= 16")
+    if args.halo < 0 or args.margin < 0 or args.context < 0:
+        raise ValueError("--halo, --margin and --context must be >= 0")
+    if args.blur and args.blur % 2 == 0:
+        raise ValueError("--blur must be odd")
+    metrics = StageMetrics("detect_changes")
+    bounds = Bounds.from_sequence(args.bbox)
+    previous = load_image(args.previous_image, metrics)
+    current = load_image(args.image, metrics)
+    height, width = previous.shape[:2]
+    metrics.count("input_pixels", width * height)
+
+    with metrics.step("convert"):
+        previous_gray = cv2.cvtColor(previous, cv2.COLOR_BGR2GRAY)
+        current_gray = cv2.cvtColor(current, cv2.COLOR_BGR2GRAY)
+    warp = np.eye(2, 3)
+    if args.motion != "none":
+        with metrics.step("align"):
+            warp = estimate_warp(previous_gray, current_gray, args.motion)
+    resample = not is_identity(warp, max(width, height)) or current.shape != previous.shape
+    with metrics.step("warp"):
+        if resample:
+            flags = cv2.INTER_LINEAR | cv2.WARP_INVERSE_MAP
+            aligned = cv2.warpAffine(current, warp, (width, height), flags=flags, borderMode=cv2.BORDER_REPLICATE)
+            aligned_gray = cv2.cvtColor(aligned, cv2.COLOR_BGR2GRAY)
+        else:
+            aligned, aligned_gray = current, current_gray
+
+    with metrics.step("difference"):
+        if args.blur:
+            previous_gray = cv2.GaussianBlur(previous_gray, (args.blur, args.blur), 0)
+            aligned_gray = cv2.GaussianBlur(aligned_gray, (args.blur, args.blur), 0)
+        diff = cv2.absdiff(previous_gray, aligned_gray)
+        _, diff = cv2.threshold(diff, args.threshold, 255, cv2.THRESH_BINARY)
+        changed = tile_changes(diff, args.tile_size, args.min_changed_pixels)
+    metrics.count("changed_tiles", int(changed.sum()))
+    metrics.count("tiles", changed.size)
+
+    with metrics.step("regions"):
+        if changed.any():
+            core, region = tile_regions(changed, args.tile_size, args.halo, width, height)
+            core_rings = polygon_rings(core)
+            region_rings = polygon_rings(region)
+        else:
+            # Nothing to re-extract; the downstream chain still needs an ROI, so it gets one
+            # tile at the origin and splicing ignores its output because the core is empty.
+            core_rings = []
+            _, region = tile_regions(np.ones((1, 1), dtype=bool), args.tile_size, 0, width, height)
+            region_rings = polygon_rings(region)
+        region_world = rings_to_world(region_rings, bounds, width, height)
+        roi = RegionOfInterest.from_polygons(
+            bounds, region_world, width, height, margin=args.margin, context=args.context
+        )
+        tile_mask = np.kron(changed.astype(np.uint8) * 255, np.ones((args.tile_size, args.tile_size), np.uint8))
+        tile_mask = np.ascontiguousarray(tile_mask[:height, :width])
+    metrics.count("output_pixels", roi.width * roi.height)
+
+    report = {
+        "bbox": [bounds.min_x, bounds.min_y, bounds.max_x, bounds.max_y],
+        "source_size": [width, height],
+        "motion": args.motion,
+        "warp": warp.tolist(),
+        "resampled": resample,
+        "tile_size": args.tile_size,
+        "halo": args.halo,
+        "tiles": [[int(col), int(row)] for row, col in zip(*np.nonzero(changed))],
+        "changed_fraction": round(float(changed.mean()), 6),
+        "window_fraction": round(roi.width * roi.height / (width * height), 6),
+        "core": rings_to_world(core_rings, bounds, width, height),
+        "region": region_world,
+    }
+    with AsyncWriter(metrics) as writer:
+        writer.save_image(args.output_aligned, aligned)
+        writer.save_mask(args.output_mask, tile_mask)
+        writer.save_json(args.output_roi, roi.as_dict())
+        writer.save_json(args.output, report)
+        with metrics.step("debug"):
+            debug = aligned.copy()
+            paint_mask(debug, diff, (0, 0, 255))
+            cv2.polylines(debug, [np.rint(ring).astype(np.int32) for ring in core_rings], True, (0, 255, 255), 2)
+            cv2.polylines(debug, [np.rint(ring).astype(np.int32) for ring in region_rings], True, (255, 0, 255), 1)
+        writer.save_image(args.output_debug, debug)
+    if args.output_metrics:
+        save_json(args.output_metrics, metrics.as_dict())
+
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(run_stage(main))
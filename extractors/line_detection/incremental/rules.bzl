@@ -0,0 +1,191 @@
+load("//extractors/line_detection:defs.bzl", "TransformationInfo", "WORKER_EXECUTION_REQUIREMENTS", "declare_profile")
+load("//tools/previewer:preview_rules.bzl", "run_preview_action")
+
+
+def _change_detect_impl(ctx):
+    output = ctx.outputs.out
+    aligned = ctx.outputs.aligned
+    roi = ctx.outputs.roi
+    mask = ctx.outputs.mask
+    debug = ctx.outputs.debug
+    metrics = ctx.actions.declare_file(ctx.label.name + "_metrics.json")
+    profile, profile_env = declare_profile(ctx)
+    args = ctx.actions.args()
+    args.use_param_file("@%s", use_always = True)
+    args.set_param_file_format("multiline")
+    args.add("--image", ctx.file.image.path)
+    args.add("--previous-image", ctx.file.previous_image.path)
+    args.add("--bbox")
+    args.add_all(ctx.attr.bbox)
+    args.add("--output", output.path)
+    args.add("--output-aligned", aligned.path)
+    args.add("--output-roi", roi.path)
+    args.add("--output-mask", mask.path)
+    args.add("--output-debug", debug.path)
+    args.add("--output-metrics", metrics.path)
+    args.add("--motion", ctx.attr.motion)
+    args.add("--tile-size", ctx.attr.tile_size)
+    args.add("--halo", ctx.attr.halo)
+    args.add("--threshold", ctx.attr.threshold)
+    args.add("--blur", ctx.attr.blur)
+    args.add("--min-changed-pixels", ctx.attr.min_changed_pixels)
+    args.add("--margin", ctx.attr.margin)
+    args.add("--context", ctx.attr.context)
+
+    ctx.actions.run(
+        inputs = [ctx.file.image, ctx.file.previous_image],
+        outputs = [output, aligned, roi, mask, debug, metrics] + ([profile] if profile else []),
+        executable = ctx.executable._tool,
+        arguments = [args],
+        tools = [ctx.executable._tool],
+        env = profile_env,
+        mnemonic = "LineChangeDetect",
+        execution_requirements = WORKER_EXECUTION_REQUIREMENTS,
+        progress_message = "Detecting changed tiles",
+    )
+
+    preview = run_preview_action(
+        ctx,
+        image = aligned,
+        overlay_mask = mask,
+        debug_images = [debug],
+        title = "Change detection preview",
+        parameters = {
+            "motion": ctx.attr.motion,
+            "tile_size": str(ctx.attr.tile_size),
+            "halo": str(ctx.attr.halo),
+            "threshold": str(ctx.attr.threshold),
+        },
+        assets = [
+            {"label": "changes", "path": output.short_path},
+            {"label": "roi_metadata", "path": roi.short_path},
+            {"label": "debug_overlay", "path": debug.short_path},
+        ],
+    )
+
+    return [
+        DefaultInfo(files = depset([output, aligned, roi, mask, debug, preview])),
+        OutputGroupInfo(
+            metrics = depset([metrics]),
+            profile = depset([profile] if profile else []),
+        ),
+        TransformationInfo(
+            description = "Align a new sheet version with the previous one and mark changed tiles.",
+            metadata = {"tile_size": ctx.attr.tile_size, "halo": ctx.attr.halo},
+        ),
+    ]
+
+
+line_change_detect = rule(
+    implementation = _change_detect_impl,
+    attrs = {
+        "image": attr.label(allow_single_file = True, mandatory = True),
+        "previous_image": attr.label(allow_single_file = True, mandatory = True),
+        "bbox": attr.string_list(mandatory = True),
+        "out": attr.output(mandatory = True),
+        "aligned": attr.output(mandatory = True),
+        "roi": attr.output(mandatory = True),
+        "mask": attr.output(mandatory = True),
+        "debug": attr.output(mandatory = True),
+        "motion": attr.string(default = "translation", values = ["none", "translation", "euclidean", "affine"]),
+        "tile_size": attr.int(default = 256),
+        "halo": attr.int(default = 64),
+        "threshold": attr.int(default = 40),
+        "blur": attr.int(default = 5),
+        "min_changed_pixels": attr.int(default = 8),
+        "margin": attr.int(default = 16),
+        "context": attr.int(default = 32),
+        "_tool": attr.label(
+            default = Label("//extractors/line_detection/incremental:detect_changes"),
+            executable = True,
+            cfg = "exec",
+        ),
+        "_preview_tool": attr.label(
+            default = Label("//tools/previewer:preview_pass"),
+            executable = True,
+            cfg = "exec",
+        ),
+    },
+    doc = "Change detection pass for incremental re-extraction.",
+)
+
+
+def _splice_impl(ctx):
+    output = ctx.outputs.out
+    report = ctx.outputs.report
+    metrics = ctx.actions.declare_file(ctx.label.name + "_metrics.json")
+    profile, profile_env = declare_profile(ctx)
+    args = ctx.actions.args()
+    args.use_param_file("@%s", use_always = True)
+    args.set_param_file_format("multiline")
+    args.add("--previous", ctx.file.previous_geojson.path)
+    args.add("--update", ctx.file.update_geojson.path)
+    args.add("--changes", ctx.file.changes.path)
+    args.add("--output", output.path)
+    args.add("--output-report", report.path)
+    args.add("--output-metrics", metrics.path)
+    args.add("--seam-tolerance", ctx.attr.seam_tolerance)
+
+    ctx.actions.run(
+        inputs = [ctx.file.previous_geojson, ctx.file.update_geojson, ctx.file.changes],
+        outputs = [output, report, metrics] + ([profile] if profile else []),
+        executable = ctx.executable._tool,
+        arguments = [args],
+        tools = [ctx.executable._tool],
+        env = profile_env,
+        mnemonic = "LineSplice",
+        execution_requirements = WORKER_EXECUTION_REQUIREMENTS,
+        progress_message = "Splicing re-extracted lines",
+    )
+
+    preview = run_preview_action(
+        ctx,
+        image = ctx.file.image,
+        overlay_geojson = output,
+        bbox = ctx.attr.bbox,
+        debug_images = [],
+        title = "Incremental splice preview",
+        parameters = {"seam_tolerance": ctx.attr.seam_tolerance},
+        assets = [
+            {"label": "geojson", "path": output.short_path},
+            {"label": "splice_report", "path": report.short_path},
+        ],
+    )
+
+    return [
+        DefaultInfo(files = depset([output, report, preview])),
+        OutputGroupInfo(
+            metrics = depset([metrics]),
+            profile = depset([profile] if profile else []),
+        ),
+        TransformationInfo(
+            description = "Splice re-extracted linework for changed tiles into the previous GeoJSON.",
+            metadata = {"seam_tolerance": ctx.attr.seam_tolerance},
+        ),
+    ]
+
+
+line_incremental_splice = rule(
+    implementation = _splice_impl,
+    attrs = {
+        "image": attr.label(allow_single_file = True, mandatory = True),
+        "previous_geojson": attr.label(allow_single_file = True, mandatory = True),
+        "update_geojson": attr.label(allow_single_file = True, mandatory = True),
+        "changes": attr.label(allow_single_file = True, mandatory = True),
+        "bbox": attr.string_list(mandatory = True),
+        "out": attr.output(mandatory = True),
+        "report": attr.output(mandatory = True),
+        "seam_tolerance": attr.string(default = "1.5"),
+        "_tool": attr.label(
+            default = Label("//extractors/line_detection/incremental:splice_lines"),
+            executable = True,
+            cfg = "exec",
+        ),
+        "_preview_tool": attr.label(
+            default = Label("//tools/previewer:preview_pass"),
+            executable = True,
+            cfg = "exec",
+        ),
+    },
+    doc = "Splice pass for incremental re-extraction.",
+)
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+from __future__ import annotations
+
+import argparse
+import json
+from typing import List, Tuple
+
+import numpy as np
+import shapely
+from shapely.geometry import LineString, Polygon, mapping, shape
+
+from extractors.line_detection.pipeline_utils import StageMetrics, save_json
+from extractors.line_detection.worker import run_stage
+
+LINEAR_TYPES = (shapely.GeometryType.LINESTRING, shapely.GeometryType.MULTILINESTRING)
+
+
+def load_features(path: str) -> List[dict]:
+    with open(path, "r", encoding="utf-8") as handle:
+        return json.load(handle).get("features", [])
+
+
+def linear_parts(geometries: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    # Returns the non-empty line parts and the index of the geometry each came from.
+    linear = np.isin(shapely.get_type_id(geometries), LINEAR_TYPES)
+    parts, index = shapely.get_parts(np.where(linear, geometries, None), return_index=True)
+    keep = ~shapely.is_empty(parts)
+    return parts[keep], index[keep]
+
+
+def snap_seam_endpoints(
+    lines: np.ndarray, anchors: np.ndarray, boundary: shapely.Geometry, tolerance: float
+) -> Tuple[np.ndarray, int]:
+    # Moves new line ends that stop on the splice boundary onto the nearest end of a trimmed
+    # previous line, so linework crossing a seam stays connected.
+    if tolerance <= 0 or len(lines) == 0 or len(anchors) == 0:
+        return lines, 0
+    coords = [shapely.get_coordinates(line) for line in lines]
+    ends = np.array([[c[0], c[-1]] for c in coords]).reshape(-1, 2)
+    points = shapely.points(ends)
+    on_seam = np.flatnonzero(shapely.dwithin(points, boundary, tolerance))
+    tree = shapely.STRtree(shapely.points(anchors))
+    (query, target), _ = tree.query_nearest(points[on_seam], max_distance=tolerance, return_distance=True, all_matches=False)
+    for end, anchor in zip(on_seam[query], target):
+        line, side = divmod(int(end), 2)
+        coords[line][0 if side == 0 else -1] = anchors[anchor]
+    return np.array([LineString(c) for c in coords], dtype=object), len(query)
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Splice re-extracted linework for changed tiles into the previous GeoJSON.")
+    parser.add_argument("--previous", required=True, help="GeoJSON extracted from the previous sheet version")
+    parser.add_argument("--update", required=True, help="GeoJSON re-extracted over the detect_changes ROI")
+    parser.add_argument("--changes", required=True, help="Change report JSON from detect_changes")
+    parser.add_argument("--output", required=True, help="Spliced GeoJSON output")
+    parser.add_argument("--output-report", required=True, help="JSON report of changed features")
+    parser.add_argument("--output-metrics", help="Optional JSON performance metrics output")
+    parser.add_argument("--seam-tolerance", type=float, default=1.5, help="World distance for joining lines at tile seams")
+    return parser
+
+
+def main() -> int:
+    args = build_parser().parse_args()
+    metrics = StageMetrics("splice_lines")
+    with metrics.step("decode"):
+        previous = load_features(args.previous)
+        update = load_features(args.update)
+        with open(args.changes, "r", encoding="utf-8") as handle:
+            changes = json.load(handle)
+        previous_geometries = np.array([shape(feature["geometry"]) for feature in previous], dtype=object)
+        update_geometries = np.array([shape(feature["geometry"]) for feature in update], dtype=object)
+    metrics.count("input_features", len(previous))
+    metrics.count("update_features", len(update))
+
+    with metrics.step("region"):
+        core = shapely.union_all([Polygon(ring) for ring in changes.get("core", [])])
+        shapely.prepare(core)
+    if core.is_empty:
+        touched = np.zeros(len(previous), dtype=bool)
+    else:
+        with metrics.step("select"):
+            touched = shapely.intersects(core, previous_geometries)
+
+    with metrics.step("trim"):
+        # Previous lines keep what lies outside the changed tiles, with their original properties.
+        trimmed, trimmed_source = linear_parts(shapely.difference(previous_geometries[touched], core))
+        touched_index = np.flatnonzero(touched)
+        trimmed_source = touched_index[trimmed_source]
+    with metrics.step("insert"):
+        if core.is_empty or len(update) == 0:
+            added = np.empty(0, dtype=object)
+        else:
+            added, _ = linear_parts(shapely.intersection(update_geometries, core))
+    with metrics.step("seams"):
+        anchors = np.array(
+            [point for line in trimmed for point in shapely.get_coordinates(line)[[0, -1]]]
+        ).reshape(-1, 2)
+        added, seam_joins = snap_seam_endpoints(added, anchors, shapely.boundary(core), args.seam_tolerance)
+    metrics.count("seam_joins", seam_joins)
+
+    with metrics.step("encode"):
+        features = [feature for feature, hit in zip(previous, touched) if not hit]
+        unchanged = len(features)
+        features.extend(
+            {"type": "Feature", "geometry": mapping(line), "properties": dict(previous[source].get("properties") or {})}
+            for line, source in zip(trimmed, trimmed_source)
+        )
+        features.extend({"type": "Feature", "geometry": mapping(line), "properties": {}} for line in added)
+        result = {"type": "FeatureCollection", "features": features}
+    metrics.count("output_features", len(features))
+    with metrics.step("write"):
+        with open(args.output, "w", encoding="utf-8") as handle:
+            json.dump(result, handle, ensure_ascii=False, indent=2)
+
+    report = {
+        "previous_features": len(previous),
+        "unchanged_features": unchanged,
+        # Indices into the previous GeoJSON of features that were trimmed or replaced.
+        "removed": [int(index) for index in touched_index],
+        # Indices into the output of trimmed previous features and newly extracted ones.
+        "changed": list(range(unchanged, len(features))),
+        "trimmed_features": len(trimmed),
+        "added_features": len(added),
+        "seam_joins": seam_joins,
+        "changed_tiles": len(changes.get("tiles", [])),
+    }
+    with open(args.output_report, "w", encoding="utf-8") as handle:
+        json.dump(report, handle, ensure_ascii=False, indent=2)
+    if args.output_metrics:
+        save_json(args.output_metrics, metrics.as_dict())
+
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(run_stage(main))
@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+from __future__ import annotations
+
+import argparse
+import json
+
+from extractors.line_detection.detect_lines import Bounds, detect_lines, load_image, parse_bbox, parse_hsv
+from extractors.line_detection.index.line_index import INDEX_NODE_SIZE, LineIndex
+from extractors.line_detection.pipeline_utils import StageMetrics, save_json
+from extractors.line_detection.worker import run_stage
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Build a memory-mappable spatial index over a sheet's lines.")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--image", help="Sheet image; lines are extracted once with detect_lines over the whole sheet")
+    source.add_argument("--geojson", help="Existing GeoJSON linework for the sheet (e.g. topology cleanup output)")
+    parser.add_argument("--bbox", nargs=4, metavar=("MIN_X", "MIN_Y", "MAX_X", "MAX_Y"), help="Sheet bounds (required with --image)")
+    parser.add_argument("--output", required=True, help="Line index output")
+    parser.add_argument("--output-metrics", help="Optional JSON performance metrics output")
+    parser.add_argument("--lower-hsv", default="100,50,50")
+    parser.add_argument("--upper-hsv", default="140,255,255")
+    parser.add_argument("--simplify", type=float, default=0.002)
+    parser.add_argument("--node-size", type=int, default=INDEX_NODE_SIZE)
+    return parser
+
+
+def main() -> int:
+    parser = build_parser()
+    args = parser.parse_args()
+    if args.image and not args.bbox:
+        parser.error("--image requires --bbox")
+    metrics = StageMetrics("build_line_index")
+    bounds = parse_bbox(args.bbox) if args.bbox else None
+    bbox = None if bounds is None else (bounds.min_x, bounds.min_y, bounds.max_x, bounds.max_y)
+
+    if args.image:
+        with metrics.step("decode"):
+            image = load_image(args.image)
+        metrics.count("input_pixels", image.shape[0] * image.shape[1])
+        with metrics.step("extract"):
+            # No clip polygon: the whole sheet is traced once, and queries do the clipping.
+            geojson = detect_lines(
+                image, Bounds(*bbox), None, parse_hsv(args.lower_hsv), parse_hsv(args.upper_hsv), args.simplify
+            )
+    else:
+        with metrics.step("decode"):
+            with open(args.geojson, "r", encoding="utf-8") as handle:
+                geojson = json.load(handle)
+    metrics.count("input_features", len(geojson.get("features", [])))
+
+    with metrics.step("index"):
+        index = LineIndex.from_geojson(geojson, bbox, args.node_size)
+    metrics.count("indexed_lines", len(index))
+    metrics.count("indexed_vertices", len(index.coords))
+    with metrics.step("write"):
+        index.save(args.output)
+    if args.output_metrics:
+        save_json(args.output_metrics, metrics.as_dict())
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(run_stage(main))
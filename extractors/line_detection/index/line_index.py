@@ -0,0 +1,258 @@
+from __future__ import annotations
+
+import json
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import shapely
+from shapely.geometry import MultiPolygon, Polygon, shape
+
+from extractors.line_detection.detect_lines import LINEAR_TYPES
+
+INDEX_MAGIC = b"LINEIDX1"
+INDEX_SUFFIX = ".lineidx"
+INDEX_VERSION = 1
+# Every array starts on this boundary so it can be viewed straight out of the mapped file.
+INDEX_ALIGNMENT = 64
+# Children per R-tree node; 16 keeps the tree shallow while each node test stays one small
+# vectorized comparison.
+INDEX_NODE_SIZE = 16
+INDEX_ARRAYS = (
+    ("coords", np.float64),
+    ("line_offsets", np.int64),
+    ("order", np.int64),
+    ("leaf_bounds", np.float64),
+    ("node_bounds", np.float64),
+    ("level_offsets", np.int64),
+    ("property_offsets", np.int64),
+    ("properties", np.uint8),
+)
+
+
+def align(offset: int) -> int:
+    return -(-offset // INDEX_ALIGNMENT) * INDEX_ALIGNMENT
+
+
+def str_order(boxes: np.ndarray, node_size: int) -> np.ndarray:
+    # Sort-Tile-Recursive packing: vertical slices by x centre, each slice sorted by y centre.
+    count = len(boxes)
+    if count == 0:
+        return np.zeros(0, dtype=np.int64)
+    centers_x = (boxes[:, 0] + boxes[:, 2]) / 2
+    centers_y = (boxes[:, 1] + boxes[:, 3]) / 2
+    slices = int(np.ceil(np.sqrt(-(-count // node_size))))
+    slice_size = slices * node_size
+    slice_id = np.empty(count, dtype=np.int64)
+    slice_id[np.argsort(centers_x, kind="stable")] = np.arange(count) // slice_size
+    return np.lexsort((centers_y, slice_id)).astype(np.int64)
+
+
+def group_bounds(boxes: np.ndarray, node_size: int) -> np.ndarray:
+    starts = np.arange(0, len(boxes), node_size)
+    return np.column_stack([
+        np.minimum.reduceat(boxes[:, 0], starts),
+        np.minimum.reduceat(boxes[:, 1], starts),
+        np.maximum.reduceat(boxes[:, 2], starts),
+        np.maximum.reduceat(boxes[:, 3], starts),
+    ])
+
+
+def box_hits(boxes: np.ndarray, query: Tuple[float, float, float, float]) -> np.ndarray:
+    min_x, min_y, max_x, max_y = query
+    return (boxes[:, 0] <= max_x) & (boxes[:, 2] >= min_x) & (boxes[:, 1] <= max_y) & (boxes[:, 3] >= min_y)
+
+
+@dataclass(frozen=True)
+class LineIndex:
+    # Packed R-tree over one sheet's lines, laid out so every array can be memory-mapped.
+    # Line i is coords[line_offsets[i]:line_offsets[i + 1]] in source order. Leaf j of the tree
+    # is line order[j] with box leaf_bounds[j]. Node levels are stored bottom-up in node_bounds,
+    # level k at node_bounds[level_offsets[k]:level_offsets[k + 1]] (level 0 sits on the leaves,
+    # the last level is the root), and node n covers entries n * node_size up to
+    # (n + 1) * node_size - 1 of the level below it.
+    coords: np.ndarray
+    line_offsets: np.ndarray
+    order: np.ndarray
+    leaf_bounds: np.ndarray
+    node_bounds: np.ndarray
+    level_offsets: np.ndarray
+    property_offsets: np.ndarray
+    properties: np.ndarray
+    bbox: Tuple[float, float, float, float]
+    node_size: int = INDEX_NODE_SIZE
+
+    @classmethod
+    def from_lines(
+        cls,
+        lines: Sequence[np.ndarray],
+        properties: Optional[Sequence[dict]] = None,
+        bbox: Optional[Sequence[float]] = None,
+        node_size: int = INDEX_NODE_SIZE,
+    ) -> "LineIndex":
+        if node_size < 2:
+            raise ValueError("Index node size must be at least 2.")
+        if properties is not None and len(properties) != len(lines):
+            raise ValueError("Need one properties dict per line.")
+        coords = np.concatenate(lines).astype(np.float64) if lines else np.zeros((0, 2))
+        line_offsets = np.concatenate([[0], np.cumsum([len(line) for line in lines])]).astype(np.int64)
+        if lines:
+            starts = line_offsets[:-1]
+            bounds = np.column_stack([np.minimum.reduceat(coords, starts), np.maximum.reduceat(coords, starts)])
+        else:
+            bounds = np.zeros((0, 4))
+        order = str_order(bounds, node_size)
+        leaf_bounds = bounds[order]
+        levels: List[np.ndarray] = []
+        level = leaf_bounds
+        while len(level) > 1:
+            level = group_bounds(level, node_size)
+            levels.append(level)
+        # Empty properties are stored as zero bytes, so plain linework adds nothing per line.
+        encoded = [
+            json.dumps(props, ensure_ascii=False).encode("utf-8") if props else b""
+            for props in (properties or [{}] * len(lines))
+        ]
+        if bbox is None:
+            bbox = (*coords.min(axis=0), *coords.max(axis=0)) if len(coords) else (0.0, 0.0, 0.0, 0.0)
+        return cls(
+            coords=coords.reshape(-1, 2),
+            line_offsets=line_offsets,
+            order=order,
+            leaf_bounds=leaf_bounds.reshape(-1, 4),
+            node_bounds=np.concatenate(levels).reshape(-1, 4) if levels else np.zeros((0, 4)),
+            level_offsets=np.concatenate([[0], np.cumsum([len(level) for level in levels])]).astype(np.int64),
+            property_offsets=np.concatenate([[0], np.cumsum([len(item) for item in encoded])]).astype(np.int64),
+            properties=np.frombuffer(b"".join(encoded), dtype=np.uint8),
+            bbox=tuple(float(value) for value in bbox),
+            node_size=node_size,
+        )
+
+    @classmethod
+    def from_geojson(
+        cls, geojson: dict, bbox: Optional[Sequence[float]] = None, node_size: int = INDEX_NODE_SIZE
+    ) -> "LineIndex":
+        # MultiLineStrings are split into one indexed line per part, each with the feature's properties.
+        lines: List[np.ndarray] = []
+        properties: List[dict] = []
+        for feature in geojson.get("features", []):
+            geometry = feature["geometry"]
+            if geometry["type"] == "LineString":
+                # Plain lines skip shapely: their coordinates go straight into the index.
+                parts = [np.asarray(geometry["coordinates"], dtype=np.float64)]
+            elif geometry["type"] == "MultiLineString":
+                parts = [shapely.get_coordinates(part) for part in shapely.get_parts(shape(geometry))]
+            else:
+                continue
+            for part in parts:
+                if len(part) >= 2:
+                    lines.append(part[:, :2])
+                    properties.append(feature.get("properties") or {})
+        return cls.from_lines(lines, properties, bbox, node_size)
+
+    @classmethod
+    def open(cls, path: str) -> "LineIndex":
+        # Arrays are views into a read-only memory map; pages are only read when a query touches them.
+        try:
+            raw = np.memmap(path, dtype=np.uint8, mode="r")
+            if bytes(raw[: len(INDEX_MAGIC)]) != INDEX_MAGIC:
+                raise ValueError("not a line index")
+            header_size = int(raw[8:16].view("<u8")[0])
+            header = json.loads(bytes(raw[16 : 16 + header_size]).decode("utf-8"))
+            if header.get("version") != INDEX_VERSION:
+                raise ValueError(f"unsupported version {header.get('version')}")
+            data_start = align(16 + header_size)
+            arrays: Dict[str, np.ndarray] = {}
+            for name, dtype in INDEX_ARRAYS:
+                offset, shape_ = header["arrays"][name]
+                start = data_start + offset
+                size = int(np.prod(shape_)) * np.dtype(dtype).itemsize
+                arrays[name] = raw[start : start + size].view(dtype).reshape(shape_)
+        except (KeyError, OSError, ValueError) as exc:
+            raise ValueError(f"Failed to read line index at '{path}': {exc}") from exc
+        return cls(**arrays, bbox=tuple(header["bbox"]), node_size=int(header["node_size"]))
+
+    def save(self, path: str) -> None:
+        layout: Dict[str, List] = {}
+        offset = 0
+        for name, dtype in INDEX_ARRAYS:
+            array = getattr(self, name)
+            layout[name] = [offset, list(array.shape)]
+            offset = align(offset + array.size * np.dtype(dtype).itemsize)
+        header = json.dumps({
+            "version": INDEX_VERSION,
+            "bbox": list(self.bbox),
+            "node_size": self.node_size,
+            "lines": len(self),
+            "arrays": layout,
+        }).encode("utf-8")
+        data_start = align(16 + len(header))
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        with open(path, "wb") as handle:
+            handle.write(INDEX_MAGIC)
+            handle.write(np.array([len(header)], dtype="<u8").tobytes())
+            handle.write(header)
+            for name, dtype in INDEX_ARRAYS:
+                handle.seek(data_start + layout[name][0])
+                handle.write(np.ascontiguousarray(getattr(self, name), dtype=dtype).tobytes())
+
+    def __len__(self) -> int:
+        return len(self.line_offsets) - 1
+
+    def query(self, box: Sequence[float]) -> np.ndarray:
+        # Source indices, ascending, of lines whose bounding box intersects `box`.
+        query = tuple(float(value) for value in box)
+        offsets = self.level_offsets
+        levels = len(offsets) - 1
+        candidates = np.arange(offsets[-1] - offsets[-2] if levels else len(self.leaf_bounds))
+        for level in range(levels - 1, -1, -1):
+            candidates = candidates[box_hits(self.node_bounds[offsets[level] + candidates], query)]
+            below = offsets[level] - offsets[level - 1] if level else len(self.leaf_bounds)
+            candidates = (candidates[:, None] * self.node_size + np.arange(self.node_size)).ravel()
+            candidates = candidates[candidates < below]
+        candidates = candidates[box_hits(self.leaf_bounds[candidates], query)]
+        return np.sort(self.order[candidates])
+
+    def lines(self, ids: np.ndarray) -> np.ndarray:
+        if len(ids) == 0:
+            return np.empty(0, dtype=object)
+        starts = self.line_offsets[ids]
+        counts = self.line_offsets[ids + 1] - starts
+        # One gather for all candidates, so only the mapped pages holding them are read.
+        points = np.arange(counts.sum()) + np.repeat(starts - np.cumsum(counts) + counts, counts)
+        return shapely.linestrings(self.coords[points], indices=np.repeat(np.arange(len(ids)), counts))
+
+    def line_properties(self, line: int) -> dict:
+        start, end = self.property_offsets[line], self.property_offsets[line + 1]
+        return json.loads(bytes(self.properties[start:end]).decode("utf-8")) if end > start else {}
+
+    def clip(self, polygon: Polygon | MultiPolygon) -> Tuple[np.ndarray, np.ndarray]:
+        # Same overlay as detect_lines.clip_lines over the whole sheet's lines, restricted to the
+        # tree's candidates; returns the clipped parts and the source line of each part.
+        ids = self.query(polygon.bounds)
+        candidates = self.lines(ids)
+        shapely.prepare(polygon)
+        hit = shapely.intersects(polygon, candidates)
+        ids, candidates = ids[hit], candidates[hit]
+        clipped = shapely.intersection(candidates, polygon)
+        linear = np.isin(shapely.get_type_id(clipped), LINEAR_TYPES)
+        parts, source = shapely.get_parts(clipped[linear], return_index=True)
+        keep = ~shapely.is_empty(parts)
+        return parts[keep], ids[linear][source[keep]]
+
+    def clip_geojson(self, polygon: Polygon | MultiPolygon) -> dict:
+        parts, source = self.clip(polygon)
+        coords, owner = shapely.get_coordinates(parts, return_index=True)
+        split = np.split(coords, np.flatnonzero(np.diff(owner)) + 1) if len(coords) else []
+        return {
+            "type": "FeatureCollection",
+            "features": [
+                {
+                    "type": "Feature",
+                    "geometry": {"type": "LineString", "coordinates": part.tolist()},
+                    "properties": self.line_properties(int(line)),
+                }
+                for part, line in zip(split, source)
+            ],
+        }
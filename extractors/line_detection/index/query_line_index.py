@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+from __future__ import annotations
+
+import argparse
+import json
+
+import shapely
+
+from extractors.line_detection.detect_lines import build_polygon
+from extractors.line_detection.index.line_index import LineIndex
+from extractors.line_detection.pipeline_utils import StageMetrics, save_json
+from extractors.line_detection.worker import run_stage
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Clip a sheet's indexed lines to a polygon or box.")
+    parser.add_argument("--index", required=True, help="Line index from build_line_index.py")
+    query = parser.add_mutually_exclusive_group(required=True)
+    query.add_argument("--polygon", help="Clip polygon as space-separated x,y pairs")
+    query.add_argument("--box", nargs=4, type=float, metavar=("MIN_X", "MIN_Y", "MAX_X", "MAX_Y"), help="Clip box")
+    parser.add_argument("--output", default="-", help="Output GeoJSON file (default: stdout)")
+    parser.add_argument("--output-metrics", help="Optional JSON performance metrics output")
+    return parser
+
+
+def main() -> int:
+    args = build_parser().parse_args()
+    metrics = StageMetrics("query_line_index")
+    polygon = build_polygon(args.polygon) if args.polygon else shapely.box(*args.box)
+    with metrics.step("open"):
+        index = LineIndex.open(args.index)
+    with metrics.step("clip"):
+        geojson = index.clip_geojson(polygon)
+    metrics.count("output_features", len(geojson["features"]))
+    with metrics.step("encode"):
+        output_text = json.dumps(geojson, ensure_ascii=False, indent=2)
+    if args.output == "-":
+        print(output_text)
+    else:
+        with open(args.output, "w", encoding="utf-8") as handle:
+            handle.write(output_text)
+    if args.output_metrics:
+        save_json(args.output_metrics, metrics.as_dict())
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(run_stage(main))
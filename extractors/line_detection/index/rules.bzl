@@ -0,0 +1,74 @@
+load("//extractors/line_detection:defs.bzl", "TransformationInfo", "WORKER_EXECUTION_REQUIREMENTS", "declare_profile")
+
+
+def _line_index_impl(ctx):
+    if bool(ctx.file.image) == bool(ctx.file.lines):
+        fail("line_index needs exactly one of image or lines")
+    if ctx.file.image and not ctx.attr.bbox:
+        fail("line_index needs bbox with image")
+    output = ctx.outputs.out
+    metrics = ctx.actions.declare_file(ctx.label.name + "_metrics.json")
+    profile, profile_env = declare_profile(ctx)
+    args = ctx.actions.args()
+    args.use_param_file("@%s", use_always = True)
+    args.set_param_file_format("multiline")
+    if ctx.file.image:
+        source = ctx.file.image
+        args.add("--image", source.path)
+        args.add("--lower-hsv", ctx.attr.lower_hsv)
+        args.add("--upper-hsv", ctx.attr.upper_hsv)
+        args.add("--simplify", ctx.attr.simplify)
+    else:
+        source = ctx.file.lines
+        args.add("--geojson", source.path)
+    if ctx.attr.bbox:
+        args.add("--bbox")
+        args.add_all(ctx.attr.bbox)
+    args.add("--output", output.path)
+    args.add("--output-metrics", metrics.path)
+    args.add("--node-size", ctx.attr.node_size)
+
+    ctx.actions.run(
+        inputs = [source],
+        outputs = [output, metrics] + ([profile] if profile else []),
+        executable = ctx.executable._tool,
+        arguments = [args],
+        tools = [ctx.executable._tool],
+        env = profile_env,
+        mnemonic = "LineIndex",
+        execution_requirements = WORKER_EXECUTION_REQUIREMENTS,
+        progress_message = "Indexing lines",
+    )
+
+    return [
+        DefaultInfo(files = depset([output])),
+        OutputGroupInfo(
+            metrics = depset([metrics]),
+            profile = depset([profile] if profile else []),
+        ),
+        TransformationInfo(
+            description = "Build a memory-mappable spatial index over a sheet's lines.",
+            metadata = {"source": "image" if ctx.file.image else "lines", "node_size": ctx.attr.node_size},
+        ),
+    ]
+
+
+line_index = rule(
+    implementation = _line_index_impl,
+    attrs = {
+        "image": attr.label(allow_single_file = True, doc = "Sheet image; traced once with detect_lines."),
+        "lines": attr.label(allow_single_file = [".geojson", ".json"], doc = "Existing GeoJSON linework for the sheet."),
+        "bbox": attr.string_list(doc = "Sheet bounds; required with image."),
+        "out": attr.output(mandatory = True, doc = "Index output, conventionally <sheet>.lineidx."),
+        "lower_hsv": attr.string(default = "100,50,50"),
+        "upper_hsv": attr.string(default = "140,255,255"),
+        "simplify": attr.string(default = "0.002"),
+        "node_size": attr.int(default = 16),
+        "_tool": attr.label(
+            default = Label("//extractors/line_detection/index:build_line_index"),
+            executable = True,
+            cfg = "exec",
+        ),
+    },
+    doc = "Extract-once spatial index for clipping a sheet's lines to many polygons.",
+)
@@ -1,10 +1,11 @@
 """Bazel rule for legacy single-pass line detection."""
 
-load("//extractors/line_detection:defs.bzl", "TransformationInfo")
+load("//extractors/line_detection:defs.bzl", "TransformationInfo", "declare_profile")
 
 
 def _line_detection_geojson_impl(ctx):
     output = ctx.outputs.out
+    profile, profile_env = declare_profile(ctx)
     args = ctx.actions.args()
     args.add("--image", ctx.file.image.path)
     args.add("--bbox")
@@ -17,15 +18,25 @@ def _line_detection_geojson_impl(ctx):
 
     ctx.actions.run(
         inputs = [ctx.file.image],
-        outputs = [output],
+        outputs = [output] + ([profile] if profile else []),
         executable = ctx.executable._tool,
         arguments = [args],
         tools = [ctx.executable._tool],
+        env = profile_env,
         progress_message = "Detecting colored lines",
     )
 
     overlay_script = ctx.actions.declare_file(ctx.label.name + "_overlay.sh")
-    overlay_output = ctx.label.name + "_overlay.html"
+    if ctx.attr.tiled_overlay:
+        # Tile fetches need http://, so the runner serves the directory instead of writing one file.
+        overlay_output = ctx.label.name + "_overlay"
+        output_flags = "--tiles-dir \"${output_path}\" --tile-format %s --serve %d" % (
+            ctx.attr.tile_format,
+            ctx.attr.serve_port,
+        )
+    else:
+        overlay_output = ctx.label.name + "_overlay.html"
+        output_flags = "--output \"${output_path}\""
     image_short_path = ctx.file.image.short_path
     geojson_short_path = output.short_path
     viewer_short_path = ctx.executable._viewer.short_path
@@ -40,6 +51,8 @@ def _line_detection_geojson_impl(ctx):
             "@VIEWER_SHORT_PATH@": viewer_short_path,
             "@OUTPUT_FILE@": overlay_output,
             "@BBOX@": " ".join(ctx.attr.bbox),
+            "@OUTPUT_FLAGS@": output_flags,
+            "@TILED@": str(ctx.attr.tiled_overlay),
         },
         is_executable = True,
     )
@@ -70,6 +83,7 @@ def _line_detection_geojson_impl(ctx):
                 ],
             ).merge(viewer_runfiles),
         ),
+        OutputGroupInfo(profile = depset([profile] if profile else [])),
         TransformationInfo(
             description = "Detect colored linework and export GeoJSON LineStrings.",
             metadata = metadata,
@@ -113,6 +127,19 @@ line_detection_geojson = rule(
             mandatory = True,
             doc = "Output GeoJSON file.",
         ),
+        "tiled_overlay": attr.bool(
+            default = False,
+            doc = "Write the overlay as an image pyramid plus vector tiles and serve it locally on `bazel run`.",
+        ),
+        "tile_format": attr.string(
+            default = "png",
+            values = ["png", "jpg"],
+            doc = "Image tile encoding for the tiled overlay.",
+        ),
+        "serve_port": attr.int(
+            default = 8000,
+            doc = "Local port used to serve the tiled overlay.",
+        ),
         "_tool": attr.label(
             default = Label("//extractors/line_detection:detect_lines"),
             executable = True,
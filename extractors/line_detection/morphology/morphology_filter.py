@@ -6,7 +6,17 @@ import argparse
 import cv2
 import numpy as np
 
-from extractors.line_detection.pipeline_utils import build_kernel, load_mask, save_json, save_mask
+from extractors.line_detection.pipeline_utils import (
+    AsyncWriter,
+    StageMetrics,
+    build_kernel,
+    load_mask,
+    opencv_threads,
+    paint_mask,
+    save_json,
+    set_thread_budget,
+)
+from extractors.line_detection.worker import run_stage
 
 
 def build_parser() -> argparse.ArgumentParser:
@@ -15,6 +25,7 @@ def build_parser() -> argparse.ArgumentParser:
     parser.add_argument("--output", required=True, help="Filtered mask output")
     parser.add_argument("--output-debug", required=True, help="Debug image output")
     parser.add_argument("--output-stats", required=True, help="JSON stats output")
+    parser.add_argument("--output-metrics", help="Optional JSON performance metrics output")
     parser.add_argument("--do-close", action="store_true")
     parser.add_argument("--do-open", action="store_true")
     parser.add_argument("--close-kernel", type=int, default=3)
@@ -24,42 +35,51 @@ def build_parser() -> argparse.ArgumentParser:
     parser.add_argument("--open-iterations", type=int, default=1)
     parser.add_argument("--min-area", type=int, default=20)
     parser.add_argument("--min-extent", type=int, default=10)
+    parser.add_argument("--threads", type=int, help="OpenCV threads (default: $LINE_DETECTION_THREADS or 1)")
+    parser.add_argument("--memory-budget-mb", type=int, help="Peak RSS budget to report against")
     return parser
 
 
 def main() -> int:
     args = build_parser().parse_args()
-    mask = load_mask(args.mask)
+    metrics = StageMetrics("morphology_filter")
+    metrics.count("threads", set_thread_budget(args.threads))
+    metrics.set_memory_budget(args.memory_budget_mb)
+    mask = load_mask(args.mask, metrics)
+    metrics.count("input_pixels", mask.size)
 
-    processed = mask.copy()
-    if args.do_close:
-        kernel = build_kernel(args.kernel_shape, args.close_kernel)
-        processed = cv2.morphologyEx(processed, cv2.MORPH_CLOSE, kernel, iterations=args.close_iterations)
-    if args.do_open:
-        kernel = build_kernel(args.kernel_shape, args.open_kernel)
-        processed = cv2.morphologyEx(processed, cv2.MORPH_OPEN, kernel, iterations=args.open_iterations)
+    # The decoded mask is not needed afterwards, so both operations run in place.
+    with metrics.step("morphology"), opencv_threads("morphologyEx"):
+        processed = mask
+        if args.do_close:
+            kernel = build_kernel(args.kernel_shape, args.close_kernel)
+            cv2.morphologyEx(processed, cv2.MORPH_CLOSE, kernel, dst=processed, iterations=args.close_iterations)
+        if args.do_open:
+            kernel = build_kernel(args.kernel_shape, args.open_kernel)
+            cv2.morphologyEx(processed, cv2.MORPH_OPEN, kernel, dst=processed, iterations=args.open_iterations)
 
-    num_labels, labels, stats, _ = cv2.connectedComponentsWithStats(processed, connectivity=8)
-    kept = np.zeros_like(processed)
-    removed = np.zeros_like(processed)
-    removed_count = 0
-    kept_count = 0
-    for label in range(1, num_labels):
-        x, y, w, h, area = stats[label]
-        extent = max(w, h)
-        component = labels == label
-        if area >= args.min_area and extent >= args.min_extent:
-            kept[component] = 255
-            kept_count += 1
-        else:
-            removed[component] = 255
-            removed_count += 1
+    with AsyncWriter(metrics) as writer:
+        with metrics.step("label"), opencv_threads("connectedComponents"):
+            num_labels, labels, stats, _ = cv2.connectedComponentsWithStats(processed, connectivity=8)
+            extent = np.maximum(stats[:, cv2.CC_STAT_WIDTH], stats[:, cv2.CC_STAT_HEIGHT])
+            keep = (stats[:, cv2.CC_STAT_AREA] >= args.min_area) & (extent >= args.min_extent)
+            keep[0] = False
+            kept_count = int(np.count_nonzero(keep))
+            removed_count = int(num_labels - 1 - kept_count)
+            # One lookup over the label image instead of a full-frame comparison per component.
+            kept = (keep.astype(np.uint8) * 255)[labels]
+            del labels
+        writer.save_mask(args.output, kept)
+        metrics.count("output_pixels", cv2.countNonZero(kept))
 
-    debug = cv2.cvtColor(kept, cv2.COLOR_GRAY2BGR)
-    debug[removed > 0] = (0, 0, 255)
+        with metrics.step("debug"):
+            debug = cv2.cvtColor(kept, cv2.COLOR_GRAY2BGR)
+            # Removed components are the processed pixels that were not kept.
+            removed = cv2.bitwise_xor(processed, kept, dst=processed)
+            paint_mask(debug, removed, (0, 0, 255))
+        writer.save_image(args.output_debug, debug)
+    metrics.check_memory_budget()
 
-    save_mask(args.output, kept)
-    cv2.imwrite(args.output_debug, debug)
     save_json(
         args.output_stats,
         {
@@ -70,9 +90,11 @@ def main() -> int:
             "min_extent": args.min_extent,
         },
     )
+    if args.output_metrics:
+        save_json(args.output_metrics, metrics.as_dict())
 
     return 0
 
 
 if __name__ == "__main__":
-    raise SystemExit(main())
+    raise SystemExit(run_stage(main))
@@ -1,4 +1,4 @@
-load("//extractors/line_detection:defs.bzl", "TransformationInfo")
+load("//extractors/line_detection:defs.bzl", "TransformationInfo", "declare_profile", "declare_memory_budget", "declare_threads")
 load("//tools/previewer:preview_rules.bzl", "run_preview_action")
 
 
@@ -6,12 +6,20 @@ def _morphology_impl(ctx):
     output = ctx.outputs.out
     debug = ctx.outputs.debug
     stats = ctx.outputs.stats
+    metrics = ctx.actions.declare_file(ctx.label.name + "_metrics.json")
 
+    profile, profile_env = declare_profile(ctx)
+    execution_requirements, threads_env = declare_threads(ctx)
+    env = dict(profile_env, **threads_env)
+    env.update(declare_memory_budget(ctx))
     args = ctx.actions.args()
+    args.use_param_file("@%s", use_always = True)
+    args.set_param_file_format("multiline")
     args.add("--mask", ctx.file.mask.path)
     args.add("--output", output.path)
     args.add("--output-debug", debug.path)
     args.add("--output-stats", stats.path)
+    args.add("--output-metrics", metrics.path)
     if ctx.attr.do_close:
         args.add("--do-close")
     if ctx.attr.do_open:
@@ -26,10 +34,13 @@ def _morphology_impl(ctx):
 
     ctx.actions.run(
         inputs = [ctx.file.mask],
-        outputs = [output, debug, stats],
+        outputs = [output, debug, stats, metrics] + ([profile] if profile else []),
         executable = ctx.executable._tool,
         arguments = [args],
         tools = [ctx.executable._tool],
+        env = env,
+        mnemonic = "LineMorphology",
+        execution_requirements = execution_requirements,
         progress_message = "Filtering morphology and components",
     )
 
@@ -37,6 +48,7 @@ def _morphology_impl(ctx):
         ctx,
         image = ctx.file.image,
         overlay_mask = output,
+        roi = ctx.file.roi,
         debug_images = [debug],
         title = "Morphology preview",
         parameters = {
@@ -59,6 +71,10 @@ def _morphology_impl(ctx):
 
     return [
         DefaultInfo(files = depset([output, debug, stats, preview])),
+        OutputGroupInfo(
+            metrics = depset([metrics]),
+            profile = depset([profile] if profile else []),
+        ),
         TransformationInfo(
             description = "Apply morphology cleanup and component filtering.",
             metadata = {"min_area": ctx.attr.min_area, "min_extent": ctx.attr.min_extent},
@@ -70,6 +86,7 @@ line_morphology = rule(
     implementation = _morphology_impl,
     attrs = {
         "image": attr.label(allow_single_file = True, mandatory = True),
+        "roi": attr.label(allow_single_file = True),
         "mask": attr.label(allow_single_file = True, mandatory = True),
         "out": attr.output(mandatory = True),
         "debug": attr.output(mandatory = True),
@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+from __future__ import annotations
+
+import argparse
+import json
+from dataclasses import dataclass
+from typing import Dict, List, Sequence, TextIO, Tuple
+
+import numpy as np
+import shapely
+from shapely.geometry import shape
+
+from extractors.line_detection.pipeline_utils import Bounds, StageMetrics, save_json
+from extractors.line_detection.worker import run_stage
+
+# An end is keyed by (fragment, side): side 0 is the first vertex, 1 the last.
+EndKey = Tuple[int, int]
+
+
+@dataclass(frozen=True)
+class Sheet:
+    path: str
+    bounds: Bounds
+
+
+@dataclass
+class Chain:
+    # Joined fragments; `start` and `end` are the keys of its current first and last vertex.
+    coords: np.ndarray
+    properties: dict
+    start: EndKey
+    end: EndKey
+    sheets: List[int]
+
+
+def parse_sheets(values: Sequence[Sequence[str]]) -> List[Sheet]:
+    return [Sheet(path, Bounds.from_sequence(bbox)) for path, *bbox in values]
+
+
+def streaming_order(sheets: Sequence[Sheet], order: str) -> List[Sheet]:
+    # Row by row from the north, west to east within a row, so at most about one row of
+    # border fragments waits for its neighbours.
+    if order == "input":
+        return list(sheets)
+    return sorted(
+        sheets,
+        key=lambda sheet: (-(sheet.bounds.min_y + sheet.bounds.max_y), sheet.bounds.min_x + sheet.bounds.max_x),
+    )
+
+
+def load_fragments(path: str) -> List[Tuple[np.ndarray, dict]]:
+    with open(path, "r", encoding="utf-8") as handle:
+        geojson = json.load(handle)
+    fragments: List[Tuple[np.ndarray, dict]] = []
+    for feature in geojson.get("features", []):
+        geometry = feature.get("geometry") or {}
+        if geometry.get("type") not in ("LineString", "MultiLineString"):
+            continue
+        for part in shapely.get_parts(shape(geometry)):
+            coords = shapely.get_coordinates(part)
+            if len(coords) >= 2:
+                fragments.append((coords, feature.get("properties") or {}))
+    return fragments
+
+
+def last_neighbour(points: np.ndarray, sheets: shapely.STRtree, own: int, tolerance: float) -> np.ndarray:
+    # Largest streaming index of another sheet within `tolerance` of each point, or -1.
+    result = np.full(len(points), -1, dtype=np.int64)
+    if len(points) == 0:
+        return result
+    point, sheet = sheets.query(shapely.points(points), predicate="dwithin", distance=tolerance)
+    other = sheet != own
+    np.maximum.at(result, point[other], sheet[other])
+    return result
+
+
+def join(first: Chain, first_key: EndKey, second: Chain, second_key: EndKey) -> Chain:
+    # The two ends meet at their midpoint, so neither sheet's line is favoured.
+    left = first.coords if first.end == first_key else first.coords[::-1]
+    right = second.coords if second.start == second_key else second.coords[::-1]
+    meet = (left[-1] + right[0]) / 2
+    return Chain(
+        coords=np.concatenate([left[:-1], meet[None], right[1:]]),
+        properties=first.properties,
+        start=first.start if first.end == first_key else first.end,
+        end=second.end if second.start == second_key else second.start,
+        sheets=first.sheets + second.sheets,
+    )
+
+
+class FeatureStream:
+    # Writes a FeatureCollection one feature at a time, so finished chains leave memory at once.
+    def __init__(self, handle: TextIO) -> None:
+        self.handle = handle
+        self.count = 0
+        handle.write('{"type": "FeatureCollection", "features": [')
+
+    def write(self, chain: Chain) -> None:
+        feature = {
+            "type": "Feature",
+            "geometry": {"type": "LineString", "coordinates": chain.coords.tolist()},
+            "properties": chain.properties,
+        }
+        self.handle.write(("\n" if self.count == 0 else ",\n") + json.dumps(feature, ensure_ascii=False))
+        self.count += 1
+
+    def close(self) -> None:
+        self.handle.write("\n]}\n")
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Merge per-sheet linework into one network joined across sheet edges.")
+    parser.add_argument(
+        "--sheet",
+        action="append",
+        nargs=5,
+        required=True,
+        metavar=("GEOJSON", "MIN_X", "MIN_Y", "MAX_X", "MAX_Y"),
+        help="Sheet GeoJSON (vectorize or topology output) and its world bbox; repeat per sheet",
+    )
+    parser.add_argument("--output", required=True, help="Merged GeoJSON output")
+    parser.add_argument("--output-report", required=True, help="JSON report of joins")
+    parser.add_argument("--output-metrics", help="Optional JSON performance metrics output")
+    parser.add_argument("--tolerance", type=float, default=1.5, help="World distance for joining ends across sheet edges")
+    parser.add_argument("--order", choices=["rows", "input"], default="rows", help="Sheet streaming order")
+    return parser
+
+
+def main() -> int:
+    args = build_parser().parse_args()
+    if args.tolerance < 0:
+        raise ValueError("--tolerance must be >= 0")
+    metrics = StageMetrics("mosaic_sheets")
+    sheets = streaming_order(parse_sheets(args.sheet), args.order)
+    sheet_tree = shapely.STRtree(
+        [shapely.box(s.bounds.min_x, s.bounds.min_y, s.bounds.max_x, s.bounds.max_y) for s in sheets]
+    )
+
+    chains: Dict[int, Chain] = {}
+    owner: Dict[EndKey, int] = {}
+    # For every open end: where it is and the last sheet that could still join it.
+    open_ends: Dict[EndKey, Tuple[np.ndarray, int]] = {}
+    next_fragment = 0
+    joins = 0
+    peak_pending = 0
+    sheet_reports = []
+
+    with open(args.output, "w", encoding="utf-8") as handle:
+        stream = FeatureStream(handle)
+        for index, sheet in enumerate(sheets):
+            with metrics.step("decode"):
+                fragments = load_fragments(sheet.path)
+            metrics.count("input_fragments", len(fragments))
+
+            with metrics.step("borders"):
+                ends = np.array([[coords[0], coords[-1]] for coords, _ in fragments]).reshape(-1, 2)
+                reach = last_neighbour(ends, sheet_tree, index, args.tolerance)
+                new_keys: List[EndKey] = []
+                for offset, (coords, properties) in enumerate(fragments):
+                    fragment = next_fragment + offset
+                    start, end = (fragment, 0), (fragment, 1)
+                    chains[fragment] = Chain(coords, properties, start, end, [index])
+                    owner[start] = owner[end] = fragment
+                    for side, key in enumerate((start, end)):
+                        if reach[2 * offset + side] >= 0:
+                            open_ends[key] = (ends[2 * offset + side], int(reach[2 * offset + side]))
+                            new_keys.append(key)
+                next_fragment += len(fragments)
+
+            with metrics.step("join"):
+                # Ends left open by earlier sheets, matched nearest pair first.
+                waiting = [
+                    key for key, (_, last) in open_ends.items() if last >= index and chains[owner[key]].sheets[0] < index
+                ]
+                pairs: List[Tuple[float, EndKey, EndKey]] = []
+                if waiting and new_keys:
+                    waiting_points = np.array([open_ends[key][0] for key in waiting])
+                    new_points = np.array([open_ends[key][0] for key in new_keys])
+                    tree = shapely.STRtree(shapely.points(waiting_points))
+                    new_index, waiting_index = tree.query(
+                        shapely.points(new_points), predicate="dwithin", distance=args.tolerance
+                    )
+                    distance = np.hypot(*(new_points[new_index] - waiting_points[waiting_index]).T)
+                    pairs = sorted(
+                        zip(distance.tolist(), (new_keys[i] for i in new_index), (waiting[i] for i in waiting_index))
+                    )
+                sheet_joins = 0
+                for _, new_key, waiting_key in pairs:
+                    if new_key not in open_ends or waiting_key not in open_ends:
+                        continue
+                    first_id, second_id = owner[waiting_key], owner[new_key]
+                    if first_id == second_id:
+                        continue
+                    merged = join(chains.pop(first_id), waiting_key, chains.pop(second_id), new_key)
+                    chains[first_id] = merged
+                    owner[merged.start] = owner[merged.end] = first_id
+                    for key in (new_key, waiting_key):
+                        del open_ends[key]
+                        del owner[key]
+                    sheet_joins += 1
+                joins += sheet_joins
+
+            with metrics.step("write"):
+                # A chain is final once no later sheet can reach either of its ends.
+                done = [
+                    chain_id
+                    for chain_id, chain in chains.items()
+                    if all(open_ends.get(key, (None, -1))[1] <= index for key in (chain.start, chain.end))
+                ]
+                for chain_id in done:
+                    chain = chains.pop(chain_id)
+                    for key in (chain.start, chain.end):
+                        open_ends.pop(key, None)
+                        owner.pop(key, None)
+                    stream.write(chain)
+            peak_pending = max(peak_pending, len(chains))
+            sheet_reports.append({
+                "path": sheet.path,
+                "bbox": [sheet.bounds.min_x, sheet.bounds.min_y, sheet.bounds.max_x, sheet.bounds.max_y],
+                "fragments": len(fragments),
+                "joins": sheet_joins,
+                "pending": len(chains),
+            })
+        # Only reachable when sheets overlap oddly; nothing is dropped.
+        for chain in chains.values():
+            stream.write(chain)
+        stream.close()
+
+    metrics.count("joins", joins)
+    metrics.count("output_features", stream.count)
+    metrics.count("peak_pending_chains", peak_pending)
+    save_json(
+        args.output_report,
+        {
+            "sheets": sheet_reports,
+            "order": args.order,
+            "tolerance": args.tolerance,
+            "joins": joins,
+            "output_features": stream.count,
+            "peak_pending_chains": peak_pending,
+        },
+    )
+    if args.output_metrics:
+        save_json(args.output_metrics, metrics.as_dict())
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(run_stage(main))
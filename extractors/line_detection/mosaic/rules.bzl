@@ -0,0 +1,68 @@
+load("//extractors/line_detection:defs.bzl", "TransformationInfo", "WORKER_EXECUTION_REQUIREMENTS", "declare_profile")
+
+
+def _mosaic_impl(ctx):
+    sheets = ctx.files.sheets
+    if len(sheets) != len(ctx.attr.bboxes):
+        fail("line_mosaic needs one bbox per sheet file (%d sheets, %d bboxes)" % (len(sheets), len(ctx.attr.bboxes)))
+    output = ctx.outputs.out
+    report = ctx.outputs.report
+    metrics = ctx.actions.declare_file(ctx.label.name + "_metrics.json")
+    profile, profile_env = declare_profile(ctx)
+    args = ctx.actions.args()
+    args.use_param_file("@%s", use_always = True)
+    args.set_param_file_format("multiline")
+    for sheet, bbox in zip(sheets, ctx.attr.bboxes):
+        values = bbox.split()
+        if len(values) != 4:
+            fail("line_mosaic bbox must be \"min_x min_y max_x max_y\", got %r" % bbox)
+        args.add("--sheet", sheet.path)
+        args.add_all(values)
+    args.add("--output", output.path)
+    args.add("--output-report", report.path)
+    args.add("--output-metrics", metrics.path)
+    args.add("--tolerance", ctx.attr.tolerance)
+    args.add("--order", ctx.attr.order)
+
+    ctx.actions.run(
+        inputs = sheets,
+        outputs = [output, report, metrics] + ([profile] if profile else []),
+        executable = ctx.executable._tool,
+        arguments = [args],
+        tools = [ctx.executable._tool],
+        env = profile_env,
+        mnemonic = "LineMosaic",
+        execution_requirements = WORKER_EXECUTION_REQUIREMENTS,
+        progress_message = "Merging %d sheets" % len(sheets),
+    )
+
+    return [
+        DefaultInfo(files = depset([output, report])),
+        OutputGroupInfo(
+            metrics = depset([metrics]),
+            profile = depset([profile] if profile else []),
+        ),
+        TransformationInfo(
+            description = "Merge per-sheet linework into one network joined across sheet edges.",
+            metadata = {"sheets": len(sheets), "tolerance": ctx.attr.tolerance, "order": ctx.attr.order},
+        ),
+    ]
+
+
+line_mosaic = rule(
+    implementation = _mosaic_impl,
+    attrs = {
+        "sheets": attr.label_list(allow_files = [".geojson", ".json"], mandatory = True),
+        "bboxes": attr.string_list(mandatory = True, doc = "One \"min_x min_y max_x max_y\" per sheet, in order."),
+        "out": attr.output(mandatory = True),
+        "report": attr.output(mandatory = True),
+        "tolerance": attr.string(default = "1.5"),
+        "order": attr.string(default = "rows", values = ["rows", "input"]),
+        "_tool": attr.label(
+            default = Label("//extractors/line_detection/mosaic:mosaic_sheets"),
+            executable = True,
+            cfg = "exec",
+        ),
+    },
+    doc = "Mosaic pass joining adjacent sheets' lines across their edges.",
+)
@@ -13,6 +13,9 @@ output_path="${PWD}/@OUTPUT_FILE@"
   --image "${image_path}" \
   --geojson "${geojson_path}" \
   --bbox @BBOX@ \
-  --output "${output_path}"
+  @OUTPUT_FLAGS@
 
-echo "Overlay written to ${output_path}"
+# The tiled viewer reports its directory itself, before it starts serving.
+if [[ "@TILED@" != "True" ]]; then
+  echo "Overlay written to ${output_path}"
+fi
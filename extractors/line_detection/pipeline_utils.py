@@ -1,16 +1,107 @@
 from __future__ import annotations
 
 import json
+import os
+import resource
+import sys
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import contextmanager
 from dataclasses import dataclass
+from functools import partial
 from pathlib import Path
-from typing import Iterable, Sequence, Tuple
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
 
 import cv2
 import numpy as np
 
 
-cv2.setNumThreads(0)
-cv2.setRNGSeed(0)
+WRITER_THREADS = 2
+WRITER_MAX_PENDING = 4
+# Polygon masks are grown by ROI_MARGIN pixels so lines cut at the polygon edge run past it
+# and the final vector clip trims them exactly; it should exceed vectorize's --min-path-length
+# so stubs crossing the edge are not dropped as too short. Crop windows add ROI_CONTEXT pixels
+# on top so neighbourhood filters (blur, adaptive threshold, morphology) see real pixels.
+ROI_MARGIN = 16
+ROI_CONTEXT = 32
+# Tile edge for --sparse execution; small enough to skip gaps between lines, large enough
+# that per-crop overhead stays below the work saved.
+SPARSE_TILE_SIZE = 64
+# --components packs consecutive component crops into pool tasks of about this many pixels,
+# so thousands of tiny components do not each pay a round trip to a worker process.
+COMPONENT_BATCH_PIXELS = 1 << 18
+# overlay_images blends this many rows at a time, bounding its float32 temporaries.
+OVERLAY_BAND_ROWS = 256
+# Thread budget for stages run without --threads; the Bazel rules set it from the action's
+# cpu hint (--define=line_detection_threads=N).
+THREADS_ENV = "LINE_DETECTION_THREADS"
+# OpenCV operations whose threaded kernels split the image into independent row stripes (or,
+# for labelling, merge stripe labels back in scan order), so their output is bit-identical for
+# any thread count; tools/benchmark/check_threading.py verifies each one. Float reductions such
+# as kmeans and findTransformECC are deliberately absent: their sums depend on how the work is
+# split, which would make cached outputs differ between build hosts. Integer per-pixel work
+# (bitwise ops, countNonZero) is exact however it is split and needs no entry.
+THREADED_OPERATIONS = frozenset({
+    "adaptiveThreshold",
+    "bilateralFilter",
+    "Canny",
+    "CLAHE",
+    "connectedComponents",
+    "cvtColor",
+    "dilate",
+    "distanceTransform",
+    "erode",
+    "GaussianBlur",
+    "inRange",
+    "LUT",
+    "medianBlur",
+    "morphologyEx",
+    "resize",
+    "threshold",
+})
+
+# Peak RSS budget in MiB for stages run without --memory-budget-mb; unset leaves it untracked.
+MEMORY_BUDGET_ENV = "LINE_DETECTION_MEMORY_BUDGET_MB"
+
+_thread_budget: Optional[int] = None
+
+
+def reset_peak_rss() -> None:
+    # Writing 5 to clear_refs resets the kernel's RSS high-water mark (VmHWM) to the current
+    # RSS, so a persistent worker's peak covers only the current request. Elsewhere the peak
+    # stays the process lifetime high-water mark.
+    try:
+        with open("/proc/self/clear_refs", "w", encoding="ascii") as handle:
+            handle.write("5")
+    except OSError:
+        pass
+
+
+def peak_rss_bytes() -> int:
+    try:
+        with open("/proc/self/status", "r", encoding="ascii") as handle:
+            for line in handle:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is reported in bytes on macOS and kilobytes elsewhere.
+    return int(peak if sys.platform == "darwin" else peak * 1024)
+
+
+def reset_process_state() -> None:
+    # Called again before every persistent-worker request so warm runs match one-shot runs.
+    global _thread_budget
+    cv2.setRNGSeed(0)
+    # OpenCV runs sequentially except inside opencv_threads().
+    cv2.setNumThreads(0)
+    _thread_budget = None
+    reset_peak_rss()
+
+
+reset_process_state()
 
 
 @dataclass(frozen=True)
@@ -29,6 +120,13 @@ class Bounds:
         world_y = self.max_y - y_ratio * (self.max_y - self.min_y)
         return world_x, world_y
 
+    def to_pixel(self, x: float, y: float, width: int, height: int) -> Tuple[float, float]:
+        if width <= 1 or height <= 1:
+            raise ValueError("Image dimensions must be larger than 1x1.")
+        pixel_x = (x - self.min_x) / (self.max_x - self.min_x) * (width - 1)
+        pixel_y = (self.max_y - y) / (self.max_y - self.min_y) * (height - 1)
+        return pixel_x, pixel_y
+
     @classmethod
     def from_sequence(cls, values: Sequence[str]) -> "Bounds":
         if len(values) != 4:
@@ -39,29 +137,523 @@ class Bounds:
         return cls(min_x=min_x, min_y=min_y, max_x=max_x, max_y=max_y)
 
 
-def load_image(path: str) -> np.ndarray:
-    image = cv2.imread(path, cv2.IMREAD_COLOR)
+def parse_polygon(value: str) -> List[Tuple[float, float]]:
+    points = []
+    for pair in value.split():
+        if "," not in pair:
+            raise ValueError("Polygon coordinates must be in 'x,y' format separated by spaces")
+        x_str, y_str = pair.split(",", 1)
+        points.append((float(x_str), float(y_str)))
+    if len(points) < 3:
+        raise ValueError("Polygon requires at least three points")
+    return points
+
+
+@dataclass(frozen=True)
+class RegionOfInterest:
+    # One or more world-coordinate polygons on a sheet of source_width x source_height pixels,
+    # and the pixel window [x0, x1) x [y0, y1) around all of them that raster stages crop to.
+    # Cropped rasters keep their own (0, 0) at the window origin; the offset maps them back.
+    bounds: Bounds
+    polygons: Tuple[Tuple[Tuple[float, float], ...], ...]
+    source_width: int
+    source_height: int
+    x0: int
+    y0: int
+    x1: int
+    y1: int
+    margin: int = ROI_MARGIN
+
+    @classmethod
+    def from_polygon(
+        cls,
+        bounds: Bounds,
+        polygon: Sequence[Tuple[float, float]],
+        width: int,
+        height: int,
+        margin: int = ROI_MARGIN,
+        context: int = ROI_CONTEXT,
+    ) -> "RegionOfInterest":
+        return cls.from_polygons(bounds, [polygon], width, height, margin, context)
+
+    @classmethod
+    def from_polygons(
+        cls,
+        bounds: Bounds,
+        polygons: Sequence[Sequence[Tuple[float, float]]],
+        width: int,
+        height: int,
+        margin: int = ROI_MARGIN,
+        context: int = ROI_CONTEXT,
+    ) -> "RegionOfInterest":
+        if not polygons:
+            raise ValueError("ROI requires at least one polygon.")
+        pixels = np.array(
+            [bounds.to_pixel(x, y, width, height) for polygon in polygons for x, y in polygon], dtype=np.float64
+        )
+        padding = margin + context
+        x0 = max(int(np.floor(pixels[:, 0].min())) - padding, 0)
+        y0 = max(int(np.floor(pixels[:, 1].min())) - padding, 0)
+        x1 = min(int(np.ceil(pixels[:, 0].max())) + padding + 1, width)
+        y1 = min(int(np.ceil(pixels[:, 1].max())) + padding + 1, height)
+        if x0 >= x1 or y0 >= y1:
+            raise ValueError("ROI polygon does not overlap the image.")
+        rings = tuple(tuple((float(x), float(y)) for x, y in polygon) for polygon in polygons)
+        return cls(bounds, rings, width, height, x0, y0, x1, y1, margin)
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "RegionOfInterest":
+        x0, y0 = data["offset"]
+        width, height = data["size"]
+        source_width, source_height = data["source_size"]
+        polygons = data["polygons"] if "polygons" in data else [data["polygon"]]
+        return cls(
+            Bounds(*map(float, data["bbox"])),
+            tuple(tuple((float(x), float(y)) for x, y in polygon) for polygon in polygons),
+            int(source_width),
+            int(source_height),
+            int(x0),
+            int(y0),
+            int(x0) + int(width),
+            int(y0) + int(height),
+            int(data.get("margin", ROI_MARGIN)),
+        )
+
+    @property
+    def width(self) -> int:
+        return self.x1 - self.x0
+
+    @property
+    def height(self) -> int:
+        return self.y1 - self.y0
+
+    def as_dict(self) -> dict:
+        rings = [[list(point) for point in polygon] for polygon in self.polygons]
+        return {
+            "bbox": [self.bounds.min_x, self.bounds.min_y, self.bounds.max_x, self.bounds.max_y],
+            # A single polygon keeps the original "polygon" key so older readers still work.
+            **({"polygon": rings[0]} if len(rings) == 1 else {"polygons": rings}),
+            "source_size": [self.source_width, self.source_height],
+            "offset": [self.x0, self.y0],
+            "size": [self.width, self.height],
+            "margin": self.margin,
+        }
+
+    def crop(self, array: np.ndarray) -> np.ndarray:
+        # Sheet-sized rasters are cropped; rasters already cropped by an earlier stage pass through.
+        shape = array.shape[:2]
+        if shape == (self.source_height, self.source_width):
+            return array[self.y0 : self.y1, self.x0 : self.x1]
+        if shape == (self.height, self.width):
+            return array
+        raise ValueError(
+            f"Raster of {shape[1]}x{shape[0]} matches neither the ROI sheet "
+            f"({self.source_width}x{self.source_height}) nor its window ({self.width}x{self.height})."
+        )
+
+    def mask(self) -> np.ndarray:
+        mask = np.zeros((self.height, self.width), dtype=np.uint8)
+        for polygon in self.polygons:
+            pixels = np.array(
+                [self.bounds.to_pixel(x, y, self.source_width, self.source_height) for x, y in polygon],
+                dtype=np.float64,
+            )
+            # One fillPoly call per polygon: a combined call would cut holes where polygons overlap.
+            cv2.fillPoly(mask, [np.rint(pixels - (self.x0, self.y0)).astype(np.int32)], 255)
+        if self.margin > 0:
+            size = 2 * self.margin + 1
+            mask = cv2.dilate(mask, cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (size, size)))
+        return mask
+
+    def to_world(self, x: float, y: float) -> Tuple[float, float]:
+        return self.bounds.to_world(x + self.x0, y + self.y0, self.source_width, self.source_height)
+
+
+def load_roi(path: Optional[str]) -> Optional[RegionOfInterest]:
+    if not path:
+        return None
+    try:
+        return RegionOfInterest.from_dict(json.loads(Path(path).read_text(encoding="utf-8")))
+    except (KeyError, TypeError, ValueError) as exc:
+        raise ValueError(f"Invalid ROI metadata in '{path}': {exc}") from exc
+
+
+def crop_to_roi(array: np.ndarray, roi: Optional[RegionOfInterest]) -> np.ndarray:
+    return array if roi is None else roi.crop(array)
+
+
+def resolve_threads(threads: Optional[int] = None) -> int:
+    if threads is None:
+        value = os.environ.get(THREADS_ENV, "1")
+        try:
+            threads = int(value)
+        except ValueError:
+            raise ValueError(f"{THREADS_ENV} must be an integer, got {value!r}") from None
+    if threads < 1:
+        raise ValueError("Thread budget must be at least 1.")
+    return threads
+
+
+def set_thread_budget(threads: Optional[int]) -> int:
+    # --threads wins over LINE_DETECTION_THREADS; returns the budget in effect.
+    global _thread_budget
+    _thread_budget = resolve_threads(threads)
+    return _thread_budget
+
+
+@contextmanager
+def opencv_threads(*operations: str) -> Iterator[None]:
+    # Lets the named OpenCV operations use the thread budget for the duration of the block.
+    unknown = sorted(set(operations) - THREADED_OPERATIONS)
+    if unknown:
+        raise ValueError(f"Not verified as deterministic when threaded: {', '.join(unknown)}")
+    threads = _thread_budget if _thread_budget is not None else set_thread_budget(None)
+    if threads <= 1:
+        yield
+        return
+    cv2.setNumThreads(threads)
+    try:
+        yield
+    finally:
+        cv2.setNumThreads(0)
+
+
+class StageMetrics:
+    def __init__(self, stage: str) -> None:
+        self.stage = stage
+        self.steps: Dict[str, Dict[str, float]] = {}
+        self.counts: Dict[str, int] = {}
+        self._wall_start = time.perf_counter()
+        self._cpu_start = time.process_time()
+        self.memory_budget: Optional[int] = None
+        self.set_memory_budget(None)
+        # AsyncWriter threads record encode/write steps concurrently with the stage.
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def step(self, name: str) -> Iterator[None]:
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        try:
+            yield
+        finally:
+            wall = time.perf_counter() - wall_start
+            cpu = time.process_time() - cpu_start
+            # The process high-water mark when the step ends, so the step that set the peak shows up.
+            peak = peak_rss_bytes()
+            with self._lock:
+                entry = self.steps.setdefault(
+                    name, {"wall_seconds": 0.0, "cpu_seconds": 0.0, "calls": 0, "peak_rss_bytes": 0}
+                )
+                entry["wall_seconds"] += wall
+                entry["cpu_seconds"] += cpu
+                entry["calls"] += 1
+                entry["peak_rss_bytes"] = max(entry["peak_rss_bytes"], peak)
+
+    def count(self, name: str, value: int) -> None:
+        with self._lock:
+            self.counts[name] = int(value)
+
+    def set_memory_budget(self, megabytes: Optional[int]) -> None:
+        # --memory-budget-mb wins over LINE_DETECTION_MEMORY_BUDGET_MB.
+        if megabytes is None:
+            value = os.environ.get(MEMORY_BUDGET_ENV, "")
+            if not value:
+                return
+            try:
+                megabytes = int(value)
+            except ValueError:
+                raise ValueError(f"{MEMORY_BUDGET_ENV} must be an integer, got {value!r}") from None
+        if megabytes < 1:
+            raise ValueError("Memory budget must be at least 1 MB.")
+        self.memory_budget = megabytes * 2**20
+
+    def check_memory_budget(self) -> bool:
+        # Warns rather than fails: the outputs are written and valid, the budget is for tracking.
+        if self.memory_budget is None:
+            return True
+        peak = peak_rss_bytes()
+        if peak <= self.memory_budget:
+            return True
+        print(
+            f"{self.stage}: peak RSS {peak / 2**20:.1f} MB is over the {self.memory_budget / 2**20:.0f} MB budget",
+            file=sys.stderr,
+        )
+        return False
+
+    def as_dict(self) -> dict:
+        with self._lock:
+            return self._snapshot()
+
+    def _snapshot(self) -> dict:
+        peak = peak_rss_bytes()
+        snapshot = {
+            "stage": self.stage,
+            "wall_seconds": round(time.perf_counter() - self._wall_start, 6),
+            "cpu_seconds": round(time.process_time() - self._cpu_start, 6),
+            "peak_rss_bytes": peak,
+            "steps": [
+                {
+                    "name": name,
+                    "wall_seconds": round(entry["wall_seconds"], 6),
+                    "cpu_seconds": round(entry["cpu_seconds"], 6),
+                    "calls": int(entry["calls"]),
+                    "peak_rss_bytes": int(entry["peak_rss_bytes"]),
+                }
+                for name, entry in self.steps.items()
+            ],
+            "counts": dict(self.counts),
+        }
+        if self.memory_budget is not None:
+            snapshot["memory_budget_bytes"] = self.memory_budget
+            snapshot["within_memory_budget"] = peak <= self.memory_budget
+        return snapshot
+
+
+@contextmanager
+def optional_step(metrics: Optional[StageMetrics], name: str) -> Iterator[None]:
+    if metrics is None:
+        yield
+    else:
+        with metrics.step(name):
+            yield
+
+
+def load_image(path: str, metrics: Optional[StageMetrics] = None) -> np.ndarray:
+    with optional_step(metrics, "decode"):
+        image = cv2.imread(path, cv2.IMREAD_COLOR)
     if image is None:
         raise ValueError(f"Failed to read image at '{path}'.")
     return image
 
 
-def load_mask(path: str) -> np.ndarray:
-    mask = cv2.imread(path, cv2.IMREAD_GRAYSCALE)
+def load_mask(path: str, metrics: Optional[StageMetrics] = None) -> np.ndarray:
+    with optional_step(metrics, "decode"):
+        mask = cv2.imread(path, cv2.IMREAD_GRAYSCALE)
     if mask is None:
         raise ValueError(f"Failed to read mask at '{path}'.")
     _, binary = cv2.threshold(mask, 0, 255, cv2.THRESH_BINARY)
     return binary
 
 
-def save_mask(path: str, mask: np.ndarray) -> None:
-    Path(path).parent.mkdir(parents=True, exist_ok=True)
-    cv2.imwrite(path, mask)
+def save_image(path: str, image: np.ndarray, metrics: Optional[StageMetrics] = None) -> None:
+    with optional_step(metrics, "encode"):
+        success, encoded = cv2.imencode(Path(path).suffix or ".png", image)
+    if not success:
+        raise ValueError(f"Failed to encode image for '{path}'.")
+    with optional_step(metrics, "write"):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        Path(path).write_bytes(encoded.tobytes())
+
 
+def save_mask(path: str, mask: np.ndarray, metrics: Optional[StageMetrics] = None) -> None:
+    save_image(path, mask, metrics)
 
-def save_json(path: str, payload: dict) -> None:
-    Path(path).parent.mkdir(parents=True, exist_ok=True)
-    Path(path).write_text(json.dumps(payload, ensure_ascii=False, indent=2), encoding="utf-8")
+
+def save_json(path: str, payload: dict, metrics: Optional[StageMetrics] = None) -> None:
+    with optional_step(metrics, "write"):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        Path(path).write_text(json.dumps(payload, ensure_ascii=False, indent=2), encoding="utf-8")
+
+
+@dataclass(frozen=True)
+class LineGraph:
+    # Path graph handed from vectorize to topology cleanup. Nodes are the distinct path end
+    # pixels, edge i runs between nodes edges[i] along paths[path_offsets[i]:path_offsets[i + 1]],
+    # and degree counts edge ends per node. All pixels are on the full sheet (ROI offset applied).
+    nodes: np.ndarray
+    degree: np.ndarray
+    edges: np.ndarray
+    path_offsets: np.ndarray
+    paths: np.ndarray
+    bounds: Bounds
+    width: int
+    height: int
+
+    @classmethod
+    def from_paths(
+        cls,
+        paths: Sequence[Sequence[Tuple[int, int]]],
+        bounds: Bounds,
+        width: int,
+        height: int,
+        offset: Tuple[int, int] = (0, 0),
+    ) -> "LineGraph":
+        node_ids: Dict[Tuple[int, int], int] = {}
+        edges = [
+            [node_ids.setdefault(tuple(path[0]), len(node_ids)), node_ids.setdefault(tuple(path[-1]), len(node_ids))]
+            for path in paths
+        ]
+        edges_array = np.array(edges, dtype=np.int32).reshape(-1, 2)
+        shift = np.array(offset, dtype=np.int32)
+        return cls(
+            nodes=np.array(list(node_ids), dtype=np.int32).reshape(-1, 2) + shift,
+            degree=np.bincount(edges_array.ravel(), minlength=len(node_ids)).astype(np.int32),
+            edges=edges_array,
+            path_offsets=np.concatenate([[0], np.cumsum([len(path) for path in paths])]).astype(np.int64),
+            paths=np.array([point for path in paths for point in path], dtype=np.int32).reshape(-1, 2) + shift,
+            bounds=bounds,
+            width=width,
+            height=height,
+        )
+
+    def edge_path(self, index: int) -> np.ndarray:
+        return self.paths[self.path_offsets[index] : self.path_offsets[index + 1]]
+
+    def to_world(self, pixels: np.ndarray) -> np.ndarray:
+        # Same arithmetic as Bounds.to_world, so coordinates match the GeoJSON output exactly.
+        if self.width <= 1 or self.height <= 1:
+            raise ValueError("Image dimensions must be larger than 1x1.")
+        pixels = pixels.astype(np.float64)
+        world_x = self.bounds.min_x + pixels[:, 0] / (self.width - 1) * (self.bounds.max_x - self.bounds.min_x)
+        world_y = self.bounds.max_y - pixels[:, 1] / (self.height - 1) * (self.bounds.max_y - self.bounds.min_y)
+        return np.column_stack([world_x, world_y])
+
+
+def save_graph(path: str, graph: LineGraph, metrics: Optional[StageMetrics] = None) -> None:
+    with optional_step(metrics, "write"):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        with open(path, "wb") as handle:
+            np.savez_compressed(
+                handle,
+                nodes=graph.nodes,
+                degree=graph.degree,
+                edges=graph.edges,
+                path_offsets=graph.path_offsets,
+                paths=graph.paths,
+                bbox=np.array([graph.bounds.min_x, graph.bounds.min_y, graph.bounds.max_x, graph.bounds.max_y]),
+                sheet_size=np.array([graph.width, graph.height], dtype=np.int64),
+            )
+
+
+def load_graph(path: str, metrics: Optional[StageMetrics] = None) -> LineGraph:
+    with optional_step(metrics, "decode"):
+        try:
+            with np.load(path) as data:
+                width, height = (int(value) for value in data["sheet_size"])
+                return LineGraph(
+                    nodes=data["nodes"],
+                    degree=data["degree"],
+                    edges=data["edges"],
+                    path_offsets=data["path_offsets"],
+                    paths=data["paths"],
+                    bounds=Bounds(*(float(value) for value in data["bbox"])),
+                    width=width,
+                    height=height,
+                )
+        except (KeyError, OSError, ValueError) as exc:
+            raise ValueError(f"Failed to read line graph at '{path}': {exc}") from exc
+
+
+class AsyncWriter:
+    # Encodes and writes outputs on background threads (cv2.imencode releases the GIL) so a
+    # stage can keep computing. Submitted arrays must not be modified afterwards. At most
+    # max_pending outputs are in flight; further submits block. Errors are re-raised on the
+    # next submit or on flush(), and leaving the `with` block flushes.
+    def __init__(
+        self,
+        metrics: Optional[StageMetrics] = None,
+        max_workers: int = WRITER_THREADS,
+        max_pending: int = WRITER_MAX_PENDING,
+    ) -> None:
+        if max_workers < 1 or max_pending < 1:
+            raise ValueError("AsyncWriter needs at least one worker and one pending slot.")
+        self.metrics = metrics
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="pipeline-writer")
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._futures: List[Future] = []
+
+    def _submit(self, function: Callable[..., None], *args: object) -> None:
+        self._raise_failures(wait=False)
+        self._slots.acquire()
+        try:
+            future = self._executor.submit(function, *args)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        self._futures.append(future)
+
+    def _raise_failures(self, wait: bool) -> None:
+        pending: List[Future] = []
+        for future in self._futures:
+            if wait or future.done():
+                future.result()
+            else:
+                pending.append(future)
+        self._futures = pending
+
+    def save_image(self, path: str, image: np.ndarray) -> None:
+        self._submit(save_image, path, image, self.metrics)
+
+    def save_mask(self, path: str, mask: np.ndarray) -> None:
+        self._submit(save_mask, path, mask, self.metrics)
+
+    def save_json(self, path: str, payload: dict) -> None:
+        self._submit(save_json, path, payload, self.metrics)
+
+    def save_graph(self, path: str, graph: LineGraph) -> None:
+        self._submit(save_graph, path, graph, self.metrics)
+
+    def flush(self) -> None:
+        self._raise_failures(wait=True)
+
+    def close(self) -> None:
+        try:
+            self.flush()
+        finally:
+            self._executor.shutdown(wait=True)
+
+    def __enter__(self) -> "AsyncWriter":
+        return self
+
+    def __exit__(self, exc_type, exc, traceback) -> None:
+        if exc_type is None:
+            self.close()
+            return
+        # The stage already failed; finish in-flight writes but keep the original error.
+        self._executor.shutdown(wait=True)
+
+
+class ScratchArena:
+    # Named scratch buffers for --lean runs. take() hands back the same memory for a name
+    # whenever it is still large enough, so repeated temporaries are allocated once and hot
+    # operations can write into them with dst=. Contents are undefined until written, and a
+    # buffer passed to AsyncWriter must not be taken again before the writer flushes.
+    def __init__(self) -> None:
+        self._buffers: Dict[str, np.ndarray] = {}
+
+    def take(self, name: str, shape: Sequence[int], dtype: Any = np.uint8) -> np.ndarray:
+        dtype = np.dtype(dtype)
+        size = int(np.prod(shape)) * dtype.itemsize
+        buffer = self._buffers.get(name)
+        if buffer is None or buffer.size < size:
+            # Drop the old buffer first so growing never holds both.
+            self._buffers.pop(name, None)
+            buffer = np.empty(size, dtype=np.uint8)
+            self._buffers[name] = buffer
+        return buffer[:size].view(dtype).reshape(tuple(shape))
+
+    def adopt(self, name: str, array: np.ndarray) -> None:
+        # Hands a dead frame (typically the decoded input) to the arena, so the first take()
+        # of `name` reuses its memory instead of allocating another full frame.
+        self._buffers[name] = np.ascontiguousarray(array).reshape(-1).view(np.uint8)
+
+    def zeros(self, name: str, shape: Sequence[int], dtype: Any = np.uint8) -> np.ndarray:
+        buffer = self.take(name, shape, dtype)
+        buffer.fill(0)
+        return buffer
+
+    def clear(self) -> None:
+        self._buffers.clear()
+
+    @property
+    def nbytes(self) -> int:
+        return sum(buffer.size for buffer in self._buffers.values())
+
+
+def scratch(arena: Optional[ScratchArena], name: str, shape: Sequence[int], dtype: Any = np.uint8) -> np.ndarray:
+    return np.empty(tuple(shape), dtype=dtype) if arena is None else arena.take(name, shape, dtype)
 
 
 def ensure_odd(value: int) -> int:
@@ -80,6 +672,147 @@ def build_kernel(shape: str, size: int) -> np.ndarray:
     raise ValueError(f"Unsupported kernel shape: {shape}")
 
 
+@dataclass(frozen=True)
+class SparseWindow:
+    # Output rectangle [y0, y1) x [x0, x1) and the larger crop [cy0, cy1) x [cx0, cx1) a
+    # neighbourhood operator must read to reproduce its full-frame result there exactly.
+    y0: int
+    y1: int
+    x0: int
+    x1: int
+    cy0: int
+    cy1: int
+    cx0: int
+    cx1: int
+
+    @property
+    def area(self) -> Tuple[slice, slice]:
+        return slice(self.y0, self.y1), slice(self.x0, self.x1)
+
+    @property
+    def crop(self) -> Tuple[slice, slice]:
+        return slice(self.cy0, self.cy1), slice(self.cx0, self.cx1)
+
+    @property
+    def inner(self) -> Tuple[slice, slice]:
+        return slice(self.y0 - self.cy0, self.y1 - self.cy0), slice(self.x0 - self.cx0, self.x1 - self.cx0)
+
+
+def occupancy_grid(mask: np.ndarray, tile_size: int) -> np.ndarray:
+    height, width = mask.shape[:2]
+    rows = -(-height // tile_size)
+    cols = -(-width // tile_size)
+    padded = np.zeros((rows * tile_size, cols * tile_size), dtype=np.uint8)
+    padded[:height, :width] = mask
+    return padded.reshape(rows, tile_size, cols, tile_size).max(axis=(1, 3)) > 0
+
+
+def sparse_windows(mask: np.ndarray, tile_size: int, reach: int, halo: int) -> List[SparseWindow]:
+    # Covers every pixel within `reach` of a nonzero mask pixel: occupied tiles are dilated by
+    # enough whole tiles, each tile row is split into runs, and a run continues the window above
+    # it when it spans the same columns, so blocks of tiles share one crop. Every crop adds `halo`
+    # pixels, clamped to the frame, so frame borders still see the operator's own border handling.
+    if tile_size <= 0:
+        raise ValueError("Sparse tile size must be positive.")
+    height, width = mask.shape[:2]
+    grid = occupancy_grid(mask, tile_size)
+    steps = -(-reach // tile_size)
+    if steps > 0:
+        grid = cv2.dilate(grid.astype(np.uint8), np.ones((2 * steps + 1, 2 * steps + 1), np.uint8)) > 0
+    blocks: List[List[int]] = []
+    open_blocks: Dict[Tuple[int, int], List[int]] = {}
+    for row in range(grid.shape[0]):
+        active = np.concatenate(([0], grid[row].astype(np.int8), [0]))
+        changes = np.flatnonzero(np.diff(active))
+        runs = {(int(start), int(end)) for start, end in zip(changes[::2], changes[1::2])}
+        following: Dict[Tuple[int, int], List[int]] = {}
+        for run in sorted(runs):
+            block = open_blocks.get(run)
+            if block is None:
+                block = [row, row + 1, run[0], run[1]]
+                blocks.append(block)
+            else:
+                block[1] = row + 1
+            following[run] = block
+        open_blocks = following
+    windows: List[SparseWindow] = []
+    for row0, row1, col0, col1 in blocks:
+        y0, y1 = row0 * tile_size, min(row1 * tile_size, height)
+        x0, x1 = col0 * tile_size, min(col1 * tile_size, width)
+        windows.append(
+            SparseWindow(
+                y0, y1, x0, x1,
+                max(y0 - halo, 0), min(y1 + halo, height), max(x0 - halo, 0), min(x1 + halo, width),
+            )
+        )
+    return windows
+
+
+def sparse_apply(
+    image: np.ndarray, windows: Sequence[SparseWindow], operator: Callable[[np.ndarray], np.ndarray]
+) -> np.ndarray:
+    # For operators that map an all-zero neighbourhood to 0; pixels outside the windows stay 0.
+    output = np.zeros_like(image)
+    for window in windows:
+        output[window.area] = operator(image[window.crop])[window.inner]
+    return output
+
+
+def component_windows(mask: np.ndarray, border: int = 1) -> Tuple[np.ndarray, List[SparseWindow]]:
+    # One window per 8-connected component, in label order: the area is its bounding box and the
+    # crop adds `border` background pixels, clamped so frame edges keep their own border handling.
+    count, labels, stats, _ = cv2.connectedComponentsWithStats(
+        (mask > 0).astype(np.uint8), connectivity=8, ltype=cv2.CV_32S
+    )
+    height, width = mask.shape[:2]
+    windows: List[SparseWindow] = []
+    for x, y, w, h in stats[1:count, :4].tolist():
+        windows.append(
+            SparseWindow(
+                y, y + h, x, x + w,
+                max(y - border, 0), min(y + h + border, height), max(x - border, 0), min(x + w + border, width),
+            )
+        )
+    return labels, windows
+
+
+def component_crops(mask: np.ndarray, labels: np.ndarray, windows: Sequence[SparseWindow]) -> List[np.ndarray]:
+    # Parts of other components reaching into a bounding box are cleared from its crop.
+    return [
+        np.where(labels[window.crop] == label, mask[window.crop], 0).astype(mask.dtype)
+        for label, window in enumerate(windows, start=1)
+    ]
+
+
+def _apply_batch(operator: Callable[[np.ndarray], Any], crops: Sequence[np.ndarray]) -> List[Any]:
+    return [operator(crop) for crop in crops]
+
+
+def map_components(
+    operator: Callable[[np.ndarray], Any],
+    crops: Sequence[np.ndarray],
+    workers: int,
+    batch_pixels: int = COMPONENT_BATCH_PIXELS,
+) -> List[Any]:
+    # Results come back in crop order. The operator must be a module-level function (or a
+    # partial of one) so it pickles into the worker processes.
+    batches: List[List[np.ndarray]] = []
+    pixels = batch_pixels
+    for crop in crops:
+        if pixels + crop.size > batch_pixels:
+            batches.append([])
+            pixels = 0
+        batches[-1].append(crop)
+        pixels += crop.size
+    task = partial(_apply_batch, operator)
+    if workers <= 1 or len(batches) <= 1:
+        results = [task(batch) for batch in batches]
+    else:
+        with ProcessPoolExecutor(max_workers=min(workers, len(batches))) as executor:
+            results = list(executor.map(task, batches))
+    return [result for batch in results for result in batch]
+
+
 def apply_clahe(gray: np.ndarray, clip_limit: float, tile_size: int) -> np.ndarray:
     clahe = cv2.createCLAHE(clipLimit=clip_limit, tileGridSize=(tile_size, tile_size))
     return clahe.apply(gray)
@@ -91,18 +824,32 @@ def mask_to_rgba(mask: np.ndarray, color: Tuple[int, int, int], alpha: int = 200
     rgba = np.zeros((mask.shape[0], mask.shape[1], 4), dtype=np.uint8)
     for idx, channel in enumerate(color):
         rgba[..., idx] = channel
-    rgba[..., 3] = (mask > 0).astype(np.uint8) * alpha
+    np.copyto(rgba[..., 3], np.uint8(alpha), where=mask > 0)
     return rgba
 
 
-def overlay_images(base: np.ndarray, overlay: np.ndarray) -> np.ndarray:
+def paint_mask(image: np.ndarray, mask: np.ndarray, color: Sequence[int]) -> None:
+    # Same as image[mask > 0] = color, but boolean indexing first builds int64 coordinates
+    # for every selected pixel (16 bytes each), which dominated debug-image memory on dense masks.
+    np.copyto(image, np.asarray(color, dtype=image.dtype), where=(mask > 0)[..., np.newaxis])
+
+
+def overlay_images(base: np.ndarray, overlay: np.ndarray, out: Optional[np.ndarray] = None) -> np.ndarray:
+    # Blends band by band, so the float32 temporaries cover OVERLAY_BAND_ROWS rows rather than
+    # the whole frame; `out` may be `base` itself.
     if overlay.shape[2] != 4:
         raise ValueError("Overlay must be RGBA.")
-    overlay_rgb = overlay[..., :3].astype(np.float32)
-    overlay_alpha = overlay[..., 3:4].astype(np.float32) / 255.0
-    base_rgb = base.astype(np.float32)
-    blended = base_rgb * (1 - overlay_alpha) + overlay_rgb * overlay_alpha
-    return np.clip(blended, 0, 255).astype(np.uint8)
+    if out is None:
+        out = np.empty(base.shape, dtype=np.uint8)
+    for start in range(0, base.shape[0], OVERLAY_BAND_ROWS):
+        rows = slice(start, start + OVERLAY_BAND_ROWS)
+        overlay_alpha = overlay[rows, :, 3:4].astype(np.float32) / 255.0
+        blended = base[rows].astype(np.float32)
+        blended *= 1 - overlay_alpha
+        blended += overlay[rows, :, :3] * overlay_alpha
+        np.clip(blended, 0, 255, out=blended)
+        out[rows] = blended
+    return out
 
 
 def skeleton_neighbors(skeleton: np.ndarray, x: int, y: int) -> Iterable[Tuple[int, int]]:
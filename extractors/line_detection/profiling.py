@@ -0,0 +1,75 @@
+from __future__ import annotations
+
+import os
+import sys
+import threading
+from collections import Counter
+from pathlib import Path
+from types import FrameType
+from typing import Callable, List, Optional
+
+PROFILE_ENV = "LINE_DETECTION_PROFILE"
+PROFILE_INTERVAL_ENV = "LINE_DETECTION_PROFILE_INTERVAL"
+DEFAULT_INTERVAL = 0.005
+
+
+def frame_label(frame: FrameType) -> str:
+    code = frame.f_code
+    return f"{Path(code.co_filename).stem}:{code.co_name}"
+
+
+class SamplingProfiler:
+    def __init__(self, interval: float = DEFAULT_INTERVAL) -> None:
+        if interval <= 0:
+            raise ValueError("Profile interval must be positive.")
+        self.interval = interval
+        self.samples: Counter = Counter()
+        self._target = threading.get_ident()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="line-detection-profiler", daemon=True)
+
+    def _run(self) -> None:
+        # Samples the main thread's Python stack; time spent inside OpenCV/NumPy
+        # calls is attributed to the Python frame that made the call.
+        while not self._stop.wait(self.interval):
+            frame: Optional[FrameType] = sys._current_frames().get(self._target)
+            stack: List[str] = []
+            while frame is not None:
+                stack.append(frame_label(frame))
+                frame = frame.f_back
+            if stack:
+                self.samples[";".join(reversed(stack))] += 1
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join()
+
+    def write(self, path: Path) -> None:
+        # Brendan Gregg's collapsed-stack format, consumable by flamegraph.pl or speedscope.
+        path.parent.mkdir(parents=True, exist_ok=True)
+        lines = [f"{stack} {count}" for stack, count in sorted(self.samples.items())]
+        path.write_text("\n".join(lines) + ("\n" if lines else ""), encoding="utf-8")
+
+
+def profile_path(target: str) -> Path:
+    path = Path(target)
+    if path.is_dir() or target.endswith(os.sep):
+        return path / f"{Path(sys.argv[0]).stem}.folded"
+    return path
+
+
+def run_profiled(main: Callable[[], int]) -> int:
+    # LINE_DETECTION_PROFILE names the output file, or a directory for <script>.folded.
+    target = os.environ.get(PROFILE_ENV)
+    if not target:
+        return main()
+    profiler = SamplingProfiler(float(os.environ.get(PROFILE_INTERVAL_ENV, DEFAULT_INTERVAL)))
+    profiler.start()
+    try:
+        return main()
+    finally:
+        profiler.stop()
+        profiler.write(profile_path(target))
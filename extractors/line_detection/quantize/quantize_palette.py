@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+from __future__ import annotations
+
+import argparse
+from typing import List, Tuple
+
+import cv2
+import numpy as np
+
+from extractors.line_detection.pipeline_utils import (
+    AsyncWriter,
+    StageMetrics,
+    crop_to_roi,
+    load_image,
+    load_roi,
+    save_json,
+)
+from extractors.line_detection.worker import run_stage
+
+
+MAX_PALETTE_SIZE = 256
+ASSIGN_CHUNK_PIXELS = 1 << 20
+
+
+def convert_colorspace(image: np.ndarray, colorspace: str) -> np.ndarray:
+    if colorspace == "bgr":
+        return image
+    if colorspace == "lab":
+        return cv2.cvtColor(image, cv2.COLOR_BGR2LAB)
+    raise ValueError(f"Unsupported colorspace: {colorspace}")
+
+
+def sample_pixels(pixels: np.ndarray, sample_size: int, seed: int) -> np.ndarray:
+    if sample_size <= 0 or pixels.shape[0] <= sample_size:
+        return pixels
+    rng = np.random.default_rng(seed)
+    indices = np.sort(rng.choice(pixels.shape[0], size=sample_size, replace=False))
+    return pixels[indices]
+
+
+def median_cut(samples: np.ndarray, colors: int) -> np.ndarray:
+    boxes: List[np.ndarray] = [samples]
+    while len(boxes) < colors:
+        spans = [
+            (box.max(axis=0).astype(np.int32) - box.min(axis=0).astype(np.int32)).max() if box.shape[0] > 1 else -1
+            for box in boxes
+        ]
+        target = int(np.argmax(spans))
+        if spans[target] <= 0:
+            break
+        box = boxes.pop(target)
+        channel = int(np.argmax(box.max(axis=0).astype(np.int32) - box.min(axis=0).astype(np.int32)))
+        order = np.argsort(box[:, channel], kind="stable")
+        half = box.shape[0] // 2
+        boxes.extend([box[order[:half]], box[order[half:]]])
+    return np.array([box.mean(axis=0) for box in boxes], dtype=np.float32)
+
+
+def kmeans_palette(samples: np.ndarray, colors: int, seed: int, iterations: int) -> np.ndarray:
+    initial = median_cut(samples, colors)
+    if initial.shape[0] < colors:
+        return initial
+    cv2.setRNGSeed(seed)
+    criteria = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, iterations, 0.5)
+    labels = assign_palette(samples[np.newaxis, ...], initial)[0].reshape(-1, 1).astype(np.int32)
+    _, _, centers = cv2.kmeans(
+        samples.astype(np.float32),
+        colors,
+        labels,
+        criteria,
+        1,
+        cv2.KMEANS_USE_INITIAL_LABELS,
+    )
+    return centers.astype(np.float32)
+
+
+def sort_palette(palette: np.ndarray) -> np.ndarray:
+    # Stable, content-derived ordering so indices do not depend on clustering order.
+    keys = tuple(palette[:, channel] for channel in reversed(range(palette.shape[1])))
+    return palette[np.lexsort(keys)]
+
+
+def assign_palette(pixels: np.ndarray, palette: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    height, width = pixels.shape[:2]
+    flat = pixels.reshape(-1, pixels.shape[-1])
+    indices = np.empty(flat.shape[0], dtype=np.uint8)
+    distances = np.empty(flat.shape[0], dtype=np.float32)
+    palette = palette.astype(np.float32)
+    palette_norm = np.einsum("kc,kc->k", palette, palette)
+    for start in range(0, flat.shape[0], ASSIGN_CHUNK_PIXELS):
+        chunk = flat[start : start + ASSIGN_CHUNK_PIXELS].astype(np.float32)
+        chunk_norm = np.einsum("nc,nc->n", chunk, chunk)
+        squared = chunk_norm[:, np.newaxis] - 2.0 * (chunk @ palette.T) + palette_norm[np.newaxis, :]
+        nearest = np.argmin(squared, axis=1)
+        indices[start : start + chunk.shape[0]] = nearest
+        best = np.take_along_axis(squared, nearest[:, np.newaxis], axis=1)[:, 0]
+        distances[start : start + chunk.shape[0]] = np.sqrt(np.maximum(best, 0.0))
+    return indices.reshape(height, width), distances.reshape(height, width)
+
+
+def palette_to_bgr(palette: np.ndarray, colorspace: str) -> np.ndarray:
+    rounded = np.clip(np.rint(palette), 0, 255).astype(np.uint8)
+    if colorspace == "bgr":
+        return rounded
+    return cv2.cvtColor(rounded[np.newaxis, ...], cv2.COLOR_LAB2BGR)[0]
+
+
+def build_palette_payload(
+    palette_bgr: np.ndarray,
+    indexed: np.ndarray,
+    args: argparse.Namespace,
+) -> dict:
+    counts = np.bincount(indexed.ravel(), minlength=palette_bgr.shape[0])
+    palette_hsv = cv2.cvtColor(palette_bgr[np.newaxis, ...], cv2.COLOR_BGR2HSV)[0]
+    return {
+        "method": args.method,
+        "colorspace": args.colorspace,
+        "colors": int(palette_bgr.shape[0]),
+        "sample_size": args.sample_size,
+        "seed": args.seed,
+        "palette": [
+            {
+                "index": index,
+                "bgr": [int(value) for value in palette_bgr[index]],
+                "hsv": [int(value) for value in palette_hsv[index]],
+                "pixels": int(counts[index]),
+            }
+            for index in range(palette_bgr.shape[0])
+        ],
+    }
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Quantize a map image into a palette-indexed raster.")
+    parser.add_argument("--image", required=True, help="Input map image")
+    parser.add_argument("--output", required=True, help="Palette index raster output (uint8)")
+    parser.add_argument("--output-palette", required=True, help="Palette JSON output")
+    parser.add_argument("--output-distance", required=True, help="Distance-to-palette raster output (uint8)")
+    parser.add_argument("--output-debug", required=True, help="Palette reconstruction output")
+    parser.add_argument("--output-metrics", help="Optional JSON performance metrics output")
+    parser.add_argument("--roi", help="ROI metadata JSON from the roi pass; rasters are cropped to its window")
+    parser.add_argument("--method", choices=["kmeans", "median-cut"], default="kmeans")
+    parser.add_argument("--colorspace", choices=["lab", "bgr"], default="lab")
+    parser.add_argument("--colors", type=int, default=16)
+    parser.add_argument("--sample-size", type=int, default=200000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--kmeans-iterations", type=int, default=20)
+    return parser
+
+
+def main() -> int:
+    args = build_parser().parse_args()
+    if not 2 <= args.colors <= MAX_PALETTE_SIZE:
+        raise ValueError(f"--colors must be between 2 and {MAX_PALETTE_SIZE}")
+    metrics = StageMetrics("quantize_palette")
+
+    image = crop_to_roi(load_image(args.image, metrics), load_roi(args.roi))
+    metrics.count("input_pixels", image.shape[0] * image.shape[1])
+    with metrics.step("convert"):
+        converted = convert_colorspace(image, args.colorspace)
+    with metrics.step("palette"):
+        samples = sample_pixels(converted.reshape(-1, 3), args.sample_size, args.seed)
+        if args.method == "kmeans":
+            palette = kmeans_palette(samples, args.colors, args.seed, args.kmeans_iterations)
+        else:
+            palette = median_cut(samples, args.colors)
+        palette = sort_palette(palette)
+
+    with AsyncWriter(metrics) as writer:
+        with metrics.step("assign"):
+            indexed, distances = assign_palette(converted, palette)
+            distance_map = np.clip(np.rint(distances), 0, 255).astype(np.uint8)
+        writer.save_mask(args.output, indexed)
+        writer.save_mask(args.output_distance, distance_map)
+        metrics.count("output_pixels", indexed.size)
+        with metrics.step("debug"):
+            palette_bgr = palette_to_bgr(palette, args.colorspace)
+            debug = palette_bgr[indexed]
+        writer.save_image(args.output_debug, debug)
+        writer.save_json(args.output_palette, build_palette_payload(palette_bgr, indexed, args))
+    if args.output_metrics:
+        save_json(args.output_metrics, metrics.as_dict())
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(run_stage(main))
@@ -0,0 +1,106 @@
+load("//extractors/line_detection:defs.bzl", "TransformationInfo", "WORKER_EXECUTION_REQUIREMENTS", "declare_profile")
+load("//tools/previewer:preview_rules.bzl", "run_preview_action")
+
+
+def _quantize_impl(ctx):
+    output = ctx.outputs.out
+    palette = ctx.outputs.palette
+    distance = ctx.outputs.distance
+    debug = ctx.outputs.debug
+    metrics = ctx.actions.declare_file(ctx.label.name + "_metrics.json")
+
+    profile, profile_env = declare_profile(ctx)
+    args = ctx.actions.args()
+    args.use_param_file("@%s", use_always = True)
+    args.set_param_file_format("multiline")
+    args.add("--image", ctx.file.image.path)
+    args.add("--output", output.path)
+    args.add("--output-palette", palette.path)
+    args.add("--output-distance", distance.path)
+    args.add("--output-debug", debug.path)
+    args.add("--output-metrics", metrics.path)
+    args.add("--method", ctx.attr.method)
+    args.add("--colorspace", ctx.attr.colorspace)
+    args.add("--colors", ctx.attr.colors)
+    args.add("--sample-size", ctx.attr.sample_size)
+    args.add("--seed", ctx.attr.seed)
+    args.add("--kmeans-iterations", ctx.attr.kmeans_iterations)
+    if ctx.file.roi:
+        args.add("--roi", ctx.file.roi.path)
+
+    ctx.actions.run(
+        inputs = [ctx.file.image] + ([ctx.file.roi] if ctx.file.roi else []),
+        outputs = [output, palette, distance, debug, metrics] + ([profile] if profile else []),
+        executable = ctx.executable._tool,
+        arguments = [args],
+        tools = [ctx.executable._tool],
+        env = profile_env,
+        mnemonic = "LineQuantize",
+        execution_requirements = WORKER_EXECUTION_REQUIREMENTS,
+        progress_message = "Quantizing map palette",
+    )
+
+    preview = run_preview_action(
+        ctx,
+        image = ctx.file.image,
+        overlay_mask = distance,
+        roi = ctx.file.roi,
+        debug_images = [debug],
+        title = "Palette quantization preview",
+        parameters = {
+            "method": ctx.attr.method,
+            "colorspace": ctx.attr.colorspace,
+            "colors": str(ctx.attr.colors),
+            "sample_size": str(ctx.attr.sample_size),
+            "seed": str(ctx.attr.seed),
+            "kmeans_iterations": str(ctx.attr.kmeans_iterations),
+        },
+        assets = [
+            {"label": "indexed", "path": output.short_path},
+            {"label": "palette", "path": palette.short_path},
+            {"label": "palette_distance", "path": distance.short_path},
+            {"label": "debug_reconstruction", "path": debug.short_path},
+        ],
+    )
+
+    return [
+        DefaultInfo(files = depset([output, palette, distance, debug, preview])),
+        OutputGroupInfo(
+            metrics = depset([metrics]),
+            profile = depset([profile] if profile else []),
+        ),
+        TransformationInfo(
+            description = "Quantize the source image into a palette-indexed raster.",
+            metadata = {"method": ctx.attr.method, "colors": ctx.attr.colors},
+        ),
+    ]
+
+
+line_quantize = rule(
+    implementation = _quantize_impl,
+    attrs = {
+        "image": attr.label(allow_single_file = True, mandatory = True),
+        "roi": attr.label(allow_single_file = True),
+        "out": attr.output(mandatory = True),
+        "palette": attr.output(mandatory = True),
+        "distance": attr.output(mandatory = True),
+        "debug": attr.output(mandatory = True),
+        "method": attr.string(default = "kmeans"),
+        "colorspace": attr.string(default = "lab"),
+        "colors": attr.int(default = 16),
+        "sample_size": attr.int(default = 200000),
+        "seed": attr.int(default = 0),
+        "kmeans_iterations": attr.int(default = 20),
+        "_tool": attr.label(
+            default = Label("//extractors/line_detection/quantize:quantize_palette"),
+            executable = True,
+            cfg = "exec",
+        ),
+        "_preview_tool": attr.label(
+            default = Label("//tools/previewer:preview_pass"),
+            executable = True,
+            cfg = "exec",
+        ),
+    },
+    doc = "Palette quantization pass.",
+)
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+from __future__ import annotations
+
+import argparse
+
+import cv2
+
+from extractors.line_detection.pipeline_utils import (
+    ROI_CONTEXT,
+    ROI_MARGIN,
+    AsyncWriter,
+    Bounds,
+    RegionOfInterest,
+    StageMetrics,
+    load_image,
+    parse_polygon,
+    save_json,
+)
+from extractors.line_detection.worker import run_stage
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Resolve a world-coordinate polygon into a pixel ROI for the staged pipeline.")
+    parser.add_argument("--image", required=True, help="Input map image (sets the sheet size)")
+    parser.add_argument("--bbox", required=True, nargs=4, metavar=("MIN_X", "MIN_Y", "MAX_X", "MAX_Y"))
+    parser.add_argument("--polygon", required=True, help="ROI polygon as space-separated x,y pairs in world coordinates")
+    parser.add_argument("--output", required=True, help="ROI metadata JSON output")
+    parser.add_argument("--output-mask", required=True, help="Rasterized ROI mask output (crop-window size)")
+    parser.add_argument("--output-debug", required=True, help="Debug image output")
+    parser.add_argument("--output-metrics", help="Optional JSON performance metrics output")
+    parser.add_argument("--margin", type=int, default=ROI_MARGIN, help="Grow the rasterized polygon by this many pixels")
+    parser.add_argument("--context", type=int, default=ROI_CONTEXT, help="Extra pixels kept around the polygon for neighbourhood filters")
+    return parser
+
+
+def main() -> int:
+    args = build_parser().parse_args()
+    if args.margin < 0 or args.context < 0:
+        raise ValueError("--margin and --context must be >= 0")
+    metrics = StageMetrics("region_of_interest")
+    image = load_image(args.image, metrics)
+    height, width = image.shape[:2]
+    metrics.count("input_pixels", width * height)
+
+    with metrics.step("rasterize"):
+        roi = RegionOfInterest.from_polygon(
+            Bounds.from_sequence(args.bbox),
+            parse_polygon(args.polygon),
+            width,
+            height,
+            margin=args.margin,
+            context=args.context,
+        )
+        mask = roi.mask()
+    metrics.count("output_pixels", roi.width * roi.height)
+
+    with AsyncWriter(metrics) as writer:
+        writer.save_json(args.output, roi.as_dict())
+        writer.save_mask(args.output_mask, mask)
+        with metrics.step("debug"):
+            debug = roi.crop(image).copy()
+            debug[mask == 0] //= 3
+            contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+            cv2.drawContours(debug, contours, -1, (0, 255, 255), 1)
+        writer.save_image(args.output_debug, debug)
+    if args.output_metrics:
+        save_json(args.output_metrics, metrics.as_dict())
+
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(run_stage(main))
@@ -0,0 +1,92 @@
+load("//extractors/line_detection:defs.bzl", "TransformationInfo", "WORKER_EXECUTION_REQUIREMENTS", "declare_profile")
+load("//tools/previewer:preview_rules.bzl", "run_preview_action")
+
+
+def _region_of_interest_impl(ctx):
+    output = ctx.outputs.out
+    mask = ctx.outputs.mask
+    debug = ctx.outputs.debug
+    metrics = ctx.actions.declare_file(ctx.label.name + "_metrics.json")
+    profile, profile_env = declare_profile(ctx)
+    args = ctx.actions.args()
+    args.use_param_file("@%s", use_always = True)
+    args.set_param_file_format("multiline")
+    args.add("--image", ctx.file.image.path)
+    args.add("--bbox")
+    args.add_all(ctx.attr.bbox)
+    args.add("--polygon", ctx.attr.polygon)
+    args.add("--output", output.path)
+    args.add("--output-mask", mask.path)
+    args.add("--output-debug", debug.path)
+    args.add("--output-metrics", metrics.path)
+    args.add("--margin", ctx.attr.margin)
+    args.add("--context", ctx.attr.context)
+
+    ctx.actions.run(
+        inputs = [ctx.file.image],
+        outputs = [output, mask, debug, metrics] + ([profile] if profile else []),
+        executable = ctx.executable._tool,
+        arguments = [args],
+        tools = [ctx.executable._tool],
+        env = profile_env,
+        mnemonic = "LineRegionOfInterest",
+        execution_requirements = WORKER_EXECUTION_REQUIREMENTS,
+        progress_message = "Rasterizing region of interest",
+    )
+
+    preview = run_preview_action(
+        ctx,
+        image = ctx.file.image,
+        overlay_mask = mask,
+        roi = output,
+        debug_images = [debug],
+        title = "Region of interest preview",
+        parameters = {
+            "polygon": ctx.attr.polygon,
+            "margin": str(ctx.attr.margin),
+            "context": str(ctx.attr.context),
+        },
+        assets = [
+            {"label": "roi_metadata", "path": output.short_path},
+            {"label": "roi_mask", "path": mask.short_path},
+            {"label": "debug_overlay", "path": debug.short_path},
+        ],
+    )
+
+    return [
+        DefaultInfo(files = depset([output, mask, debug, preview])),
+        OutputGroupInfo(
+            metrics = depset([metrics]),
+            profile = depset([profile] if profile else []),
+        ),
+        TransformationInfo(
+            description = "Resolve a world-coordinate polygon into the pixel window shared by later stages.",
+            metadata = {"polygon": ctx.attr.polygon, "margin": ctx.attr.margin, "context": ctx.attr.context},
+        ),
+    ]
+
+
+line_region_of_interest = rule(
+    implementation = _region_of_interest_impl,
+    attrs = {
+        "image": attr.label(allow_single_file = True, mandatory = True),
+        "bbox": attr.string_list(mandatory = True),
+        "polygon": attr.string(mandatory = True),
+        "out": attr.output(mandatory = True),
+        "mask": attr.output(mandatory = True),
+        "debug": attr.output(mandatory = True),
+        "margin": attr.int(default = 16),
+        "context": attr.int(default = 32),
+        "_tool": attr.label(
+            default = Label("//extractors/line_detection/roi:region_of_interest"),
+            executable = True,
+            cfg = "exec",
+        ),
+        "_preview_tool": attr.label(
+            default = Label("//tools/previewer:preview_pass"),
+            executable = True,
+            cfg = "exec",
+        ),
+    },
+    doc = "Region-of-interest pass: crop window and polygon mask for the staged pipeline.",
+)
@@ -1,4 +1,4 @@
-load("//extractors/line_detection:defs.bzl", "TransformationInfo")
+load("//extractors/line_detection:defs.bzl", "TransformationInfo", "declare_profile", "declare_memory_budget", "declare_threads")
 load("//tools/previewer:preview_rules.bzl", "run_preview_action")
 
 
@@ -7,34 +7,66 @@ def _segment_lines_impl(ctx):
     aggressive = ctx.outputs.aggressive
     merged = ctx.outputs.merged
     debug = ctx.outputs.debug
+    metrics = ctx.actions.declare_file(ctx.label.name + "_metrics.json")
 
+    profile, profile_env = declare_profile(ctx)
+    execution_requirements, threads_env = declare_threads(ctx)
+    env = dict(profile_env, **threads_env)
+    env.update(declare_memory_budget(ctx))
     args = ctx.actions.args()
-    args.add("--image", ctx.file.image.path)
+    args.use_param_file("@%s", use_always = True)
+    args.set_param_file_format("multiline")
+    inputs = []
+    if ctx.file.indexed:
+        args.add("--indexed", ctx.file.indexed.path)
+        args.add("--palette-indices", ctx.attr.palette_indices)
+        if ctx.attr.aggressive_palette_indices:
+            args.add("--aggressive-palette-indices", ctx.attr.aggressive_palette_indices)
+        inputs.append(ctx.file.indexed)
+        if ctx.file.palette_distance:
+            args.add("--palette-distance", ctx.file.palette_distance.path)
+            args.add("--max-palette-distance", ctx.attr.max_palette_distance)
+            inputs.append(ctx.file.palette_distance)
+    else:
+        args.add("--image", ctx.file.image.path)
+        inputs.append(ctx.file.image)
     args.add("--output-conservative", conservative.path)
     args.add("--output-aggressive", aggressive.path)
     args.add("--output-merged", merged.path)
     args.add("--output-debug", debug.path)
+    args.add("--output-metrics", metrics.path)
     args.add("--colorspace", ctx.attr.colorspace)
     args.add("--channels", ctx.attr.channels)
-    args.add("--lower", ctx.attr.lower)
-    args.add("--upper", ctx.attr.upper)
+    if ctx.attr.lower:
+        args.add("--lower", ctx.attr.lower)
+    if ctx.attr.upper:
+        args.add("--upper", ctx.attr.upper)
     if ctx.attr.aggressive_lower:
         args.add("--aggressive-lower", ctx.attr.aggressive_lower)
     if ctx.attr.aggressive_upper:
         args.add("--aggressive-upper", ctx.attr.aggressive_upper)
     args.add("--merge-strategy", ctx.attr.merge_strategy)
     args.add("--merge-radius", ctx.attr.merge_radius)
+    args.add("--geodesic-radius", ctx.attr.geodesic_radius)
     if ctx.attr.clahe:
         args.add("--clahe")
     args.add("--clahe-clip", ctx.attr.clahe_clip)
     args.add("--clahe-tile", ctx.attr.clahe_tile)
+    if ctx.attr.lean:
+        args.add("--lean")
+    if ctx.file.roi:
+        args.add("--roi", ctx.file.roi.path)
+        inputs.append(ctx.file.roi)
 
     ctx.actions.run(
-        inputs = [ctx.file.image],
-        outputs = [conservative, aggressive, merged, debug],
+        inputs = inputs,
+        outputs = [conservative, aggressive, merged, debug, metrics] + ([profile] if profile else []),
         executable = ctx.executable._tool,
         arguments = [args],
         tools = [ctx.executable._tool],
+        env = env,
+        mnemonic = "LineSegment",
+        execution_requirements = execution_requirements,
         progress_message = "Segmenting candidate line pixels",
     )
 
@@ -42,6 +74,7 @@ def _segment_lines_impl(ctx):
         ctx,
         image = ctx.file.image,
         overlay_mask = merged,
+        roi = ctx.file.roi,
         debug_images = [debug],
         title = "Segmentation preview",
         parameters = {
@@ -53,9 +86,13 @@ def _segment_lines_impl(ctx):
             "aggressive_upper": ctx.attr.aggressive_upper,
             "merge_strategy": ctx.attr.merge_strategy,
             "merge_radius": str(ctx.attr.merge_radius),
+            "geodesic_radius": str(ctx.attr.geodesic_radius),
             "clahe": str(ctx.attr.clahe),
             "clahe_clip": ctx.attr.clahe_clip,
             "clahe_tile": str(ctx.attr.clahe_tile),
+            "palette_indices": ctx.attr.palette_indices,
+            "aggressive_palette_indices": ctx.attr.aggressive_palette_indices,
+            "max_palette_distance": str(ctx.attr.max_palette_distance),
         },
         assets = [
             {"label": "conservative_mask", "path": conservative.short_path},
@@ -67,6 +104,10 @@ def _segment_lines_impl(ctx):
 
     return [
         DefaultInfo(files = depset([conservative, aggressive, merged, debug, preview])),
+        OutputGroupInfo(
+            metrics = depset([metrics]),
+            profile = depset([profile] if profile else []),
+        ),
         TransformationInfo(
             description = "Segment candidate pixels into conservative/aggressive masks.",
             metadata = {
@@ -75,6 +116,7 @@ def _segment_lines_impl(ctx):
                 "lower": ctx.attr.lower,
                 "upper": ctx.attr.upper,
                 "merge_strategy": ctx.attr.merge_strategy,
+                "palette_indices": ctx.attr.palette_indices,
             },
         ),
     ]
@@ -84,21 +126,29 @@ line_segmentation = rule(
     implementation = _segment_lines_impl,
     attrs = {
         "image": attr.label(allow_single_file = True, mandatory = True),
+        "roi": attr.label(allow_single_file = True),
         "conservative": attr.output(mandatory = True),
         "aggressive": attr.output(mandatory = True),
         "merged": attr.output(mandatory = True),
         "debug": attr.output(mandatory = True),
         "colorspace": attr.string(default = "hsv"),
         "channels": attr.string(default = "0,1,2"),
-        "lower": attr.string(mandatory = True),
-        "upper": attr.string(mandatory = True),
+        "lower": attr.string(default = ""),
+        "upper": attr.string(default = ""),
         "aggressive_lower": attr.string(default = ""),
         "aggressive_upper": attr.string(default = ""),
-        "merge_strategy": attr.string(default = "seed_proximity"),
+        "merge_strategy": attr.string(default = "seed_proximity", values = ["seed_proximity", "seed_connected", "union"]),
         "merge_radius": attr.int(default = 4),
+        "geodesic_radius": attr.int(default = 0),
         "clahe": attr.bool(default = False),
         "clahe_clip": attr.string(default = "2.0"),
         "clahe_tile": attr.int(default = 8),
+        "lean": attr.bool(default = False),
+        "indexed": attr.label(allow_single_file = True),
+        "palette_indices": attr.string(default = ""),
+        "aggressive_palette_indices": attr.string(default = ""),
+        "palette_distance": attr.label(allow_single_file = True),
+        "max_palette_distance": attr.int(default = 255),
         "_tool": attr.label(
             default = Label("//extractors/line_detection/segment:segment_lines"),
             executable = True,
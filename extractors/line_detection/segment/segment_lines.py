@@ -2,12 +2,35 @@
 from __future__ import annotations
 
 import argparse
-from typing import Iterable, Tuple
+from typing import Iterable, List, Optional, Tuple
 
 import cv2
 import numpy as np
 
-from extractors.line_detection.pipeline_utils import apply_clahe, load_image, save_mask
+from extractors.line_detection.pipeline_utils import (
+    AsyncWriter,
+    RegionOfInterest,
+    StageMetrics,
+    apply_clahe,
+    crop_to_roi,
+    load_image,
+    load_roi,
+    opencv_threads,
+    paint_mask,
+    save_json,
+    set_thread_budget,
+)
+from extractors.line_detection.worker import run_stage
+
+
+def parse_indices(value: str) -> List[int]:
+    indices = [int(item) for item in value.split(",") if item.strip() != ""]
+    if not indices:
+        raise ValueError("Palette indices must be a comma-separated list of integers")
+    for index in indices:
+        if not 0 <= index <= 255:
+            raise ValueError(f"Palette index out of range: {index}")
+    return indices
 
 
 def parse_tuple(value: str) -> Tuple[int, int, int]:
@@ -19,7 +42,8 @@ def parse_tuple(value: str) -> Tuple[int, int, int]:
 
 def select_channels(image: np.ndarray, channels: Iterable[int]) -> np.ndarray:
     channel_list = list(channels)
-    if not channel_list:
+    # Selecting every channel in order would only copy the frame.
+    if not channel_list or channel_list == list(range(image.shape[-1])):
         return image
     return image[..., channel_list]
 
@@ -30,79 +54,195 @@ def threshold_mask(image: np.ndarray, lower: Tuple[int, int, int], upper: Tuple[
     return cv2.inRange(image, lower_array, upper_array)
 
 
-def merge_masks(conservative: np.ndarray, aggressive: np.ndarray, strategy: str, radius: int) -> np.ndarray:
+def palette_mask(indexed: np.ndarray, indices: Iterable[int]) -> np.ndarray:
+    lut = np.zeros(256, dtype=np.uint8)
+    lut[list(indices)] = 255
+    return cv2.LUT(indexed, lut)
+
+
+def seed_connected(conservative: np.ndarray, aggressive: np.ndarray, geodesic_radius: int) -> np.ndarray:
+    # One 8-connected labelling of everything either mask accepts; a lookup table then keeps the
+    # labels that contain a conservative pixel, so faint continuations stay attached to their line.
+    candidates = cv2.bitwise_or(conservative, aggressive)
+    count, labels = cv2.connectedComponents(candidates, connectivity=8, ltype=cv2.CV_32S)
+    del candidates
+    keep = np.zeros(count, dtype=np.uint8)
+    keep[labels[conservative > 0]] = 255
+    keep[0] = 0
+    merged = keep[labels]
+    if geodesic_radius <= 0:
+        return merged
+    # Grow from the seeds through the kept components only, one pixel step per iteration.
+    kernel = np.ones((3, 3), dtype=np.uint8)
+    grown = conservative.copy()
+    for _ in range(geodesic_radius):
+        cv2.dilate(grown, kernel, dst=grown)
+        cv2.bitwise_and(grown, merged, dst=grown)
+    return grown
+
+
+def merge_masks(
+    conservative: np.ndarray, aggressive: np.ndarray, strategy: str, radius: int, geodesic_radius: int = 0
+) -> np.ndarray:
     if strategy == "union":
         return cv2.bitwise_or(conservative, aggressive)
     if strategy == "seed_proximity":
         if radius <= 0:
             return conservative
         dist = cv2.distanceTransform(255 - conservative, cv2.DIST_L2, 3)
-        near = (dist <= radius).astype(np.uint8) * 255
-        gated_aggressive = cv2.bitwise_and(aggressive, near)
-        return cv2.bitwise_or(conservative, gated_aggressive)
+        near = cv2.compare(dist, radius, cv2.CMP_LE)
+        del dist
+        cv2.bitwise_and(aggressive, near, dst=near)
+        return cv2.bitwise_or(conservative, near, dst=near)
+    if strategy == "seed_connected":
+        return seed_connected(conservative, aggressive, geodesic_radius)
     raise ValueError(f"Unsupported merge strategy: {strategy}")
 
 
+def segment_palette(
+    args: argparse.Namespace, metrics: StageMetrics, roi: Optional[RegionOfInterest]
+) -> Tuple[np.ndarray, np.ndarray]:
+    with metrics.step("decode"):
+        indexed = cv2.imread(args.indexed, cv2.IMREAD_GRAYSCALE)
+    if indexed is None:
+        raise ValueError(f"Failed to read indexed raster at '{args.indexed}'.")
+    indexed = crop_to_roi(indexed, roi)
+    metrics.count("input_pixels", indexed.size)
+    indices = parse_indices(args.palette_indices)
+    aggressive_indices = parse_indices(args.aggressive_palette_indices) if args.aggressive_palette_indices else indices
+    with metrics.step("threshold"), opencv_threads("LUT"):
+        conservative = palette_mask(indexed, indices)
+    if args.palette_distance:
+        with metrics.step("decode"):
+            distance = cv2.imread(args.palette_distance, cv2.IMREAD_GRAYSCALE)
+        if distance is None:
+            raise ValueError(f"Failed to read palette distance raster at '{args.palette_distance}'.")
+        distance = crop_to_roi(distance, roi)
+        if distance.shape != indexed.shape:
+            raise ValueError("Palette distance raster must match the indexed raster size.")
+        with metrics.step("threshold"), opencv_threads("threshold"):
+            _, confident = cv2.threshold(distance, args.max_palette_distance, 255, cv2.THRESH_BINARY_INV)
+            conservative = cv2.bitwise_and(conservative, confident)
+    with metrics.step("threshold"), opencv_threads("LUT"):
+        aggressive = palette_mask(indexed, aggressive_indices)
+    return conservative, aggressive
+
+
+def segment_color(
+    args: argparse.Namespace, metrics: StageMetrics, roi: Optional[RegionOfInterest]
+) -> Tuple[np.ndarray, np.ndarray]:
+    if not args.lower or not args.upper:
+        raise ValueError("--lower and --upper are required for color thresholding")
+    image = crop_to_roi(load_image(args.image, metrics), roi)
+    metrics.count("input_pixels", image.shape[0] * image.shape[1])
+    # --lean converts into the decoded image's own buffer; the colour conversions are per pixel,
+    # so writing over the source is safe and saves a three-channel frame.
+    out = image if args.lean else None
+    with metrics.step("convert"), opencv_threads("cvtColor", "CLAHE"):
+        if args.colorspace == "hsv":
+            converted = cv2.cvtColor(image, cv2.COLOR_BGR2HSV, dst=out)
+        elif args.colorspace == "lab":
+            converted = cv2.cvtColor(image, cv2.COLOR_BGR2LAB, dst=out)
+        else:
+            gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+            if args.clahe:
+                gray = apply_clahe(gray, args.clahe_clip, args.clahe_tile)
+            converted = cv2.cvtColor(gray, cv2.COLOR_GRAY2BGR, dst=out)
+        del image
+
+        channels = [int(item) for item in args.channels.split(",") if item.strip() != ""]
+        converted = select_channels(converted, channels)
+
+    lower = parse_tuple(args.lower)
+    upper = parse_tuple(args.upper)
+    aggressive_lower = parse_tuple(args.aggressive_lower) if args.aggressive_lower else lower
+    aggressive_upper = parse_tuple(args.aggressive_upper) if args.aggressive_upper else upper
+    with metrics.step("threshold"), opencv_threads("inRange"):
+        conservative = threshold_mask(converted, lower, upper)
+        aggressive = threshold_mask(converted, aggressive_lower, aggressive_upper)
+    return conservative, aggressive
+
+
 def build_parser() -> argparse.ArgumentParser:
     parser = argparse.ArgumentParser(description="Segment candidate line pixels from a map image.")
-    parser.add_argument("--image", required=True, help="Input map image")
+    parser.add_argument("--image", help="Input map image")
+    parser.add_argument("--indexed", help="Palette-indexed raster from the quantize pass (replaces --image)")
+    parser.add_argument("--palette-indices", help="Comma-separated palette indices for the conservative mask")
+    parser.add_argument("--aggressive-palette-indices", help="Comma-separated palette indices for the aggressive mask")
+    parser.add_argument("--palette-distance", help="Distance-to-palette raster gating the conservative mask")
+    parser.add_argument("--max-palette-distance", type=int, default=255)
     parser.add_argument("--output-conservative", required=True, help="Conservative mask output")
     parser.add_argument("--output-aggressive", required=True, help="Aggressive mask output")
     parser.add_argument("--output-merged", required=True, help="Merged mask output")
     parser.add_argument("--output-debug", required=True, help="Debug overlay output")
+    parser.add_argument("--output-metrics", help="Optional JSON performance metrics output")
+    parser.add_argument("--roi", help="ROI metadata JSON from the roi pass; rasters are cropped to its window")
     parser.add_argument("--colorspace", choices=["hsv", "lab", "gray"], default="hsv")
     parser.add_argument("--channels", default="0,1,2", help="Comma-separated channel indices")
-    parser.add_argument("--lower", required=True, help="Lower threshold (v1,v2,v3)")
-    parser.add_argument("--upper", required=True, help="Upper threshold (v1,v2,v3)")
+    parser.add_argument("--lower", help="Lower threshold (v1,v2,v3)")
+    parser.add_argument("--upper", help="Upper threshold (v1,v2,v3)")
     parser.add_argument("--aggressive-lower", help="Aggressive lower threshold (v1,v2,v3)")
     parser.add_argument("--aggressive-upper", help="Aggressive upper threshold (v1,v2,v3)")
-    parser.add_argument("--merge-strategy", choices=["seed_proximity", "union"], default="seed_proximity")
+    parser.add_argument("--merge-strategy", choices=["seed_proximity", "seed_connected", "union"], default="seed_proximity")
     parser.add_argument("--merge-radius", type=int, default=4)
+    parser.add_argument(
+        "--geodesic-radius",
+        type=int,
+        default=0,
+        help="seed_connected: only grow this many pixels from the seeds along the mask (0 keeps whole components)",
+    )
     parser.add_argument("--clahe", action="store_true", help="Enable CLAHE contrast normalization")
     parser.add_argument("--clahe-clip", type=float, default=2.0)
     parser.add_argument("--clahe-tile", type=int, default=8)
+    parser.add_argument("--threads", type=int, help="OpenCV threads (default: $LINE_DETECTION_THREADS or 1)")
+    parser.add_argument("--lean", action="store_true", help="Overwrite dead inputs in place to lower peak memory (same output)")
+    parser.add_argument("--memory-budget-mb", type=int, help="Peak RSS budget to report against")
     return parser
 
 
 def main() -> int:
-    args = build_parser().parse_args()
-
-    image = load_image(args.image)
-    if args.colorspace == "hsv":
-        converted = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
-    elif args.colorspace == "lab":
-        converted = cv2.cvtColor(image, cv2.COLOR_BGR2LAB)
-    else:
-        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-        if args.clahe:
-            gray = apply_clahe(gray, args.clahe_clip, args.clahe_tile)
-        converted = cv2.cvtColor(gray, cv2.COLOR_GRAY2BGR)
-
-    channels = [int(item) for item in args.channels.split(",") if item.strip() != ""]
-    converted = select_channels(converted, channels)
-
-    lower = parse_tuple(args.lower)
-    upper = parse_tuple(args.upper)
-    conservative = threshold_mask(converted, lower, upper)
-
-    aggressive_lower = parse_tuple(args.aggressive_lower) if args.aggressive_lower else lower
-    aggressive_upper = parse_tuple(args.aggressive_upper) if args.aggressive_upper else upper
-    aggressive = threshold_mask(converted, aggressive_lower, aggressive_upper)
-
-    merged = merge_masks(conservative, aggressive, args.merge_strategy, args.merge_radius)
-
-    debug = np.zeros((merged.shape[0], merged.shape[1], 3), dtype=np.uint8)
-    debug[aggressive > 0] = (255, 0, 0)
-    debug[conservative > 0] = (0, 255, 0)
-    debug[merged > 0] = (0, 0, 255)
-
-    save_mask(args.output_conservative, conservative)
-    save_mask(args.output_aggressive, aggressive)
-    save_mask(args.output_merged, merged)
-    cv2.imwrite(args.output_debug, debug)
+    parser = build_parser()
+    args = parser.parse_args()
+    if bool(args.image) == bool(args.indexed):
+        parser.error("Provide exactly one of --image or --indexed")
+    if args.indexed and not args.palette_indices:
+        parser.error("--indexed requires --palette-indices")
+
+    metrics = StageMetrics("segment_lines")
+    metrics.count("threads", set_thread_budget(args.threads))
+    metrics.set_memory_budget(args.memory_budget_mb)
+    roi = load_roi(args.roi)
+    with AsyncWriter(metrics) as writer:
+        if args.indexed:
+            conservative, aggressive = segment_palette(args, metrics, roi)
+        else:
+            conservative, aggressive = segment_color(args, metrics, roi)
+        if roi is not None:
+            # Later stages only ever see candidates inside the (slightly grown) polygon.
+            with metrics.step("roi"):
+                inside = roi.mask()
+                cv2.bitwise_and(conservative, inside, dst=conservative)
+                cv2.bitwise_and(aggressive, inside, dst=aggressive)
+        writer.save_mask(args.output_conservative, conservative)
+        writer.save_mask(args.output_aggressive, aggressive)
+
+        with metrics.step("merge"), opencv_threads("connectedComponents", "dilate", "distanceTransform"):
+            merged = merge_masks(conservative, aggressive, args.merge_strategy, args.merge_radius, args.geodesic_radius)
+        writer.save_mask(args.output_merged, merged)
+        metrics.count("output_pixels", cv2.countNonZero(merged))
+
+        with metrics.step("debug"):
+            debug = np.zeros((merged.shape[0], merged.shape[1], 3), dtype=np.uint8)
+            paint_mask(debug, aggressive, (255, 0, 0))
+            paint_mask(debug, conservative, (0, 255, 0))
+            paint_mask(debug, merged, (0, 0, 255))
+        writer.save_image(args.output_debug, debug)
+    metrics.check_memory_budget()
+    if args.output_metrics:
+        save_json(args.output_metrics, metrics.as_dict())
 
     return 0
 
 
 if __name__ == "__main__":
-    raise SystemExit(main())
+    raise SystemExit(run_stage(main))
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""Send a map image to a running detect_lines server and save the GeoJSON.
+
+Example:
+  python extractors/line_detection/service/detect_lines_client.py \
+    --url http://127.0.0.1:8765 --image map.png --bbox 0 0 1200 958 --output lines.geojson
+"""
+from __future__ import annotations
+
+import argparse
+import http.client
+import json
+import socket
+import sys
+from pathlib import Path
+from typing import Optional, Sequence, Tuple
+from urllib.parse import urlencode, urlsplit
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, socket_path: str, timeout: float) -> None:
+        super().__init__("localhost", timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self) -> None:
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+
+class DetectLinesClient:
+    def __init__(self, url: Optional[str] = None, unix_socket: Optional[str] = None, timeout: float = 300.0) -> None:
+        if bool(url) == bool(unix_socket):
+            raise ValueError("Provide exactly one of url or unix_socket.")
+        self.url = urlsplit(url) if url else None
+        self.unix_socket = unix_socket
+        self.timeout = timeout
+
+    def connect(self) -> http.client.HTTPConnection:
+        if self.unix_socket:
+            return UnixHTTPConnection(self.unix_socket, self.timeout)
+        return http.client.HTTPConnection(self.url.hostname, self.url.port or 80, timeout=self.timeout)
+
+    def request(self, method: str, path: str, body: Optional[bytes] = None) -> Tuple[int, bytes]:
+        connection = self.connect()
+        try:
+            headers = {"Content-Type": "application/octet-stream"} if body is not None else {}
+            connection.request(method, path, body=body, headers=headers)
+            response = connection.getresponse()
+            return response.status, response.read()
+        finally:
+            connection.close()
+
+    def detect(
+        self,
+        image: bytes,
+        bbox: Sequence[float],
+        polygon: Optional[str] = None,
+        lower_hsv: Optional[str] = None,
+        upper_hsv: Optional[str] = None,
+        simplify: Optional[float] = None,
+    ) -> Tuple[int, bytes]:
+        query = {"bbox": ",".join(str(value) for value in bbox)}
+        for name, value in (("polygon", polygon), ("lower_hsv", lower_hsv), ("upper_hsv", upper_hsv), ("simplify", simplify)):
+            if value is not None:
+                query[name] = str(value)
+        return self.request("POST", "/detect?" + urlencode(query), image)
+
+    def lines(self, sheet: str, polygon: Optional[str] = None, box: Optional[Sequence[float]] = None) -> Tuple[int, bytes]:
+        query = {"sheet": sheet}
+        if polygon is not None:
+            query["polygon"] = polygon
+        if box is not None:
+            query["box"] = ",".join(str(value) for value in box)
+        return self.request("GET", "/lines?" + urlencode(query))
+
+    def metrics(self) -> dict:
+        status, body = self.request("GET", "/metrics")
+        if status != 200:
+            raise ValueError(f"Metrics request failed with HTTP {status}")
+        return json.loads(body)
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Client for the detect_lines server.")
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument("--url", help="Server URL, e.g. http://127.0.0.1:8765")
+    target.add_argument("--unix-socket", help="Server Unix socket path")
+    parser.add_argument("--image", required=True)
+    parser.add_argument("--bbox", required=True, nargs=4, type=float, metavar=("MIN_X", "MIN_Y", "MAX_X", "MAX_Y"))
+    parser.add_argument("--polygon")
+    parser.add_argument("--lower-hsv")
+    parser.add_argument("--upper-hsv")
+    parser.add_argument("--simplify", type=float)
+    parser.add_argument("--output", default="-", help="Output GeoJSON file (default: stdout)")
+    return parser
+
+
+def main() -> int:
+    args = build_parser().parse_args()
+    client = DetectLinesClient(url=args.url, unix_socket=args.unix_socket)
+    status, body = client.detect(
+        Path(args.image).read_bytes(),
+        args.bbox,
+        polygon=args.polygon,
+        lower_hsv=args.lower_hsv,
+        upper_hsv=args.upper_hsv,
+        simplify=args.simplify,
+    )
+    if status != 200:
+        print(f"HTTP {status}: {body.decode('utf-8', errors='replace')}", file=sys.stderr)
+        return 1
+    if args.output == "-":
+        sys.stdout.write(body.decode("utf-8") + "\n")
+    else:
+        Path(args.output).write_bytes(body)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
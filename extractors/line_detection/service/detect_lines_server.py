@@ -0,0 +1,375 @@
+#!/usr/bin/env python3
+"""Serve detect_lines over HTTP with warm imports and a bounded worker pool.
+
+Example:
+  python extractors/line_detection/service/detect_lines_server.py --port 8765 --workers 4 --queue-depth 16
+  curl --data-binary @map.png \
+    "http://127.0.0.1:8765/detect?bbox=0,0,1200,958&lower_hsv=100,50,50&upper_hsv=140,255,255"
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import re
+import signal
+import socketserver
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Deque, Dict, Iterator, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+import cv2
+import numpy as np
+import shapely
+
+from extractors.line_detection.detect_lines import build_polygon, detect_lines, parse_bbox, parse_hsv
+from extractors.line_detection.index.line_index import INDEX_SUFFIX, LineIndex
+
+DEFAULT_LOWER_HSV = "100,50,50"
+DEFAULT_UPPER_HSV = "140,255,255"
+DEFAULT_SIMPLIFY = 0.002
+LATENCY_WINDOW = 2048
+THROUGHPUT_WINDOW_SECONDS = 60.0
+# Each open index holds a file descriptor and a mapping; least recently used ones are closed.
+INDEX_CACHE_SIZE = 256
+SHEET_NAME = re.compile(r"[A-Za-z0-9_.-]+")
+
+
+def parse_request_options(query: Dict[str, list]) -> dict:
+    def single(name: str, default: Optional[str] = None) -> Optional[str]:
+        values = query.get(name)
+        return values[-1] if values else default
+
+    bbox = single("bbox")
+    if bbox is None:
+        raise ValueError("Missing required query parameter: bbox=min_x,min_y,max_x,max_y")
+    bounds = parse_bbox(bbox.replace(",", " ").split())
+    polygon = single("polygon")
+    if polygon is None:
+        polygon = (
+            f"{bounds.min_x},{bounds.min_y} {bounds.max_x},{bounds.min_y} "
+            f"{bounds.max_x},{bounds.max_y} {bounds.min_x},{bounds.max_y}"
+        )
+    return {
+        "bbox": [bounds.min_x, bounds.min_y, bounds.max_x, bounds.max_y],
+        "polygon": polygon,
+        "lower_hsv": parse_hsv(single("lower_hsv", DEFAULT_LOWER_HSV)),
+        "upper_hsv": parse_hsv(single("upper_hsv", DEFAULT_UPPER_HSV)),
+        "simplify": float(single("simplify", str(DEFAULT_SIMPLIFY))),
+    }
+
+
+def run_detection(payload: bytes, options: dict) -> bytes:
+    # Runs inside the pool; returns encoded GeoJSON so process workers ship bytes, not objects.
+    image = cv2.imdecode(np.frombuffer(payload, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if image is None:
+        raise ValueError("Request body is not a decodable image.")
+    geojson = detect_lines(
+        image,
+        parse_bbox([str(value) for value in options["bbox"]]),
+        build_polygon(options["polygon"]),
+        options["lower_hsv"],
+        options["upper_hsv"],
+        options["simplify"],
+    )
+    return json.dumps(geojson, ensure_ascii=False).encode("utf-8")
+
+
+def parse_clip_region(query: Dict[str, list]) -> shapely.Geometry:
+    polygon = query.get("polygon")
+    box = query.get("box")
+    if bool(polygon) == bool(box):
+        raise ValueError("Provide exactly one of polygon=x,y x,y ... or box=min_x,min_y,max_x,max_y")
+    if polygon:
+        return build_polygon(polygon[-1])
+    values = [float(value) for value in box[-1].split(",")]
+    if len(values) != 4 or values[0] >= values[2] or values[1] >= values[3]:
+        raise ValueError("box must be min_x,min_y,max_x,max_y")
+    return shapely.box(*values)
+
+
+class IndexStore:
+    # Serves sheets from <root>/<sheet>.lineidx. Indexes are memory-mapped, so an open sheet
+    # costs address space rather than resident memory until queries touch its pages.
+    def __init__(self, root: Path, capacity: int = INDEX_CACHE_SIZE) -> None:
+        self.root = root
+        self.capacity = capacity
+        self._lock = threading.Lock()
+        self._open: "OrderedDict[str, LineIndex]" = OrderedDict()
+
+    def get(self, sheet: str) -> Optional[LineIndex]:
+        if not SHEET_NAME.fullmatch(sheet) or sheet.startswith("."):
+            raise ValueError(f"Invalid sheet name: {sheet!r}")
+        with self._lock:
+            index = self._open.get(sheet)
+            if index is not None:
+                self._open.move_to_end(sheet)
+                return index
+        path = self.root / f"{sheet}{INDEX_SUFFIX}"
+        if not path.is_file():
+            return None
+        index = LineIndex.open(str(path))
+        with self._lock:
+            self._open[sheet] = index
+            while len(self._open) > self.capacity:
+                self._open.popitem(last=False)
+        return index
+
+
+def interrupt(signum: int, frame: object) -> None:
+    raise KeyboardInterrupt
+
+
+def warm_worker() -> None:
+    # Pool workers already hold cv2/shapely; one OpenCV thread each avoids oversubscription.
+    cv2.setNumThreads(1)
+
+
+class ServiceStats:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.started = time.monotonic()
+        self.counts = {"accepted": 0, "completed": 0, "failed": 0, "rejected": 0, "in_flight": 0}
+        self._latencies: Deque[Tuple[float, float]] = deque(maxlen=LATENCY_WINDOW)
+
+    def add(self, name: str, value: int = 1) -> None:
+        with self._lock:
+            self.counts[name] += value
+
+    def finish(self, latency: float, ok: bool) -> None:
+        with self._lock:
+            self.counts["in_flight"] -= 1
+            self.counts["completed" if ok else "failed"] += 1
+            if ok:
+                self._latencies.append((time.monotonic(), latency))
+
+    def snapshot(self, capacity: int, workers: int) -> dict:
+        with self._lock:
+            now = time.monotonic()
+            latencies = np.array([latency for _, latency in self._latencies], dtype=np.float64)
+            recent = sum(1 for finished, _ in self._latencies if now - finished <= THROUGHPUT_WINDOW_SECONDS)
+            uptime = now - self.started
+            percentiles = (
+                dict(zip(("p50", "p90", "p99", "max"), np.percentile(latencies, [50, 90, 99, 100]).round(4).tolist()))
+                if latencies.size
+                else {}
+            )
+            return {
+                **self.counts,
+                "queued": max(self.counts["in_flight"] - workers, 0),
+                "capacity": capacity,
+                "workers": workers,
+                "uptime_seconds": round(uptime, 3),
+                "throughput_per_second": round(self.counts["completed"] / uptime, 4) if uptime > 0 else 0.0,
+                "recent_throughput_per_second": round(recent / min(uptime, THROUGHPUT_WINDOW_SECONDS), 4)
+                if uptime > 0
+                else 0.0,
+                "latency_seconds": percentiles,
+            }
+
+
+class DetectionService:
+    def __init__(
+        self,
+        executor: Executor,
+        workers: int,
+        queue_depth: int,
+        max_body_bytes: int,
+        indexes: Optional[IndexStore] = None,
+    ) -> None:
+        self.executor = executor
+        self.indexes = indexes
+        self.workers = workers
+        # Running plus waiting requests; anything beyond this is turned away with 503.
+        self.capacity = workers + queue_depth
+        self.max_body_bytes = max_body_bytes
+        self.slots = threading.BoundedSemaphore(self.capacity)
+        self.stats = ServiceStats()
+
+    @contextmanager
+    def reserve(self) -> Iterator[bool]:
+        # Taken before the request body is read and held until the result is ready, so at most
+        # `capacity` uploads are buffered however many connections the server has accepted.
+        if not self.slots.acquire(blocking=False):
+            self.stats.add("rejected")
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            self.slots.release()
+
+    def run(self, payload: bytes, options: dict) -> bytes:
+        # Callers must hold a slot from reserve().
+        self.stats.add("accepted")
+        self.stats.add("in_flight")
+        start = time.perf_counter()
+        ok = False
+        try:
+            result = self.executor.submit(run_detection, payload, options).result()
+            ok = True
+            return result
+        finally:
+            self.stats.finish(time.perf_counter() - start, ok)
+
+
+class DetectionHandler(BaseHTTPRequestHandler):
+    server_version = "DetectLines/1.0"
+    service: DetectionService
+
+    def address_string(self) -> str:
+        # Unix-socket peers have no host/port tuple.
+        return self.client_address[0] if isinstance(self.client_address, tuple) else "unix"
+
+    def send_payload(self, status: int, body: bytes, content_type: str, headers: Optional[dict] = None) -> None:
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_error_json(self, status: int, message: str, headers: Optional[dict] = None) -> None:
+        self.send_payload(status, json.dumps({"error": message}).encode("utf-8"), "application/json", headers)
+
+    def do_GET(self) -> None:
+        path = urlsplit(self.path).path
+        if path == "/healthz":
+            self.send_payload(200, b"ok\n", "text/plain")
+        elif path == "/metrics":
+            snapshot = self.service.stats.snapshot(self.service.capacity, self.service.workers)
+            self.send_payload(200, json.dumps(snapshot, indent=2).encode("utf-8"), "application/json")
+        elif path == "/lines":
+            self.query_lines(parse_qs(urlsplit(self.path).query))
+        else:
+            self.send_error_json(404, f"Unknown path: {path}")
+
+    def query_lines(self, query: Dict[str, list]) -> None:
+        # Index queries take milliseconds, so they run on the handler thread instead of the pool.
+        if self.service.indexes is None:
+            self.send_error_json(404, "Server was started without --index-dir.")
+            return
+        try:
+            sheet = (query.get("sheet") or [""])[-1]
+            region = parse_clip_region(query)
+            index = self.service.indexes.get(sheet)
+            if index is None:
+                self.send_error_json(404, f"Unknown sheet: {sheet}")
+                return
+            body = json.dumps(index.clip_geojson(region), ensure_ascii=False).encode("utf-8")
+        except ValueError as exc:
+            self.send_error_json(400, str(exc))
+            return
+        self.send_payload(200, body, "application/geo+json")
+
+    def do_POST(self) -> None:
+        url = urlsplit(self.path)
+        if url.path != "/detect":
+            self.send_error_json(404, f"Unknown path: {url.path}")
+            return
+        length = int(self.headers.get("Content-Length") or 0)
+        if length <= 0:
+            self.send_error_json(411, "Request body with Content-Length is required.")
+            return
+        if length > self.service.max_body_bytes:
+            self.send_error_json(413, f"Request body exceeds {self.service.max_body_bytes} bytes.")
+            return
+        # Everything that can turn the request away is checked before the upload is buffered.
+        try:
+            options = parse_request_options(parse_qs(url.query))
+        except ValueError as exc:
+            self.close_connection = True
+            self.send_error_json(400, str(exc))
+            return
+        with self.service.reserve() as reserved:
+            if not reserved:
+                # The unread body would be parsed as the next request, so the connection is closed.
+                self.close_connection = True
+                self.send_error_json(503, "Server is at capacity; retry later.", {"Retry-After": "1", "Connection": "close"})
+                return
+            payload = self.rfile.read(length)
+            if len(payload) != length:
+                self.close_connection = True
+                self.send_error_json(400, "Request body ended before Content-Length bytes.")
+                return
+            try:
+                result = self.service.run(payload, options)
+            except ValueError as exc:
+                self.send_error_json(400, str(exc))
+                return
+            except Exception as exc:  # surface worker failures to the caller
+                self.send_error_json(500, f"{type(exc).__name__}: {exc}")
+                return
+            del payload
+        self.send_payload(200, result, "application/geo+json")
+
+    def log_message(self, format: str, *args) -> None:
+        if not self.server.quiet:  # type: ignore[attr-defined]
+            super().log_message(format, *args)
+
+
+class UnixHTTPServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Serve detect_lines over HTTP.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--unix-socket", help="Listen on this Unix socket path instead of TCP")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--executor", choices=["process", "thread"], default="process")
+    parser.add_argument("--queue-depth", type=int, default=16, help="Requests allowed to wait for a worker")
+    parser.add_argument("--max-body-bytes", type=int, default=256 * 1024 * 1024)
+    parser.add_argument("--quiet", action="store_true", help="Disable per-request access logs")
+    parser.add_argument("--index-dir", help="Directory of <sheet>.lineidx files served on GET /lines")
+    return parser
+
+
+def main() -> int:
+    args = build_parser().parse_args()
+    if args.workers < 1 or args.queue_depth < 0:
+        raise ValueError("--workers must be >= 1 and --queue-depth >= 0")
+    if args.executor == "process":
+        executor: Executor = ProcessPoolExecutor(max_workers=args.workers, initializer=warm_worker)
+    else:
+        executor = ThreadPoolExecutor(max_workers=args.workers)
+    indexes = IndexStore(Path(args.index_dir)) if args.index_dir else None
+    service = DetectionService(executor, args.workers, args.queue_depth, args.max_body_bytes, indexes)
+    handler = type("BoundDetectionHandler", (DetectionHandler,), {"service": service})
+
+    if args.unix_socket:
+        socket_path = Path(args.unix_socket)
+        if socket_path.exists():
+            socket_path.unlink()
+        server = UnixHTTPServer(str(socket_path), handler)
+        where = f"unix:{socket_path}"
+    else:
+        server = ThreadingHTTPServer((args.host, args.port), handler)
+        server.daemon_threads = True
+        where = f"http://{args.host}:{server.server_address[1]}"
+    server.quiet = args.quiet  # type: ignore[attr-defined]
+
+    signal.signal(signal.SIGTERM, interrupt)
+    print(f"Serving detect_lines on {where} ({args.workers} {args.executor} workers, queue depth {args.queue_depth})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        executor.shutdown(wait=True, cancel_futures=True)
+        if args.unix_socket:
+            Path(args.unix_socket).unlink(missing_ok=True)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
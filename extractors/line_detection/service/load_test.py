@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""Load-test a running detect_lines server with concurrent clients.
+
+Example:
+  python extractors/line_detection/service/load_test.py --url http://127.0.0.1:8765 \
+    --image map.png --bbox 0 0 1200 958 --requests 200 --concurrency 8
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import List
+
+from extractors.line_detection.service.detect_lines_client import DetectLinesClient
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(int(round(fraction * (len(ordered) - 1))), len(ordered) - 1)
+    return ordered[index]
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Load-test the detect_lines server.")
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument("--url")
+    target.add_argument("--unix-socket")
+    parser.add_argument("--image", required=True)
+    parser.add_argument("--bbox", required=True, nargs=4, type=float, metavar=("MIN_X", "MIN_Y", "MAX_X", "MAX_Y"))
+    parser.add_argument("--polygon")
+    parser.add_argument("--requests", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--retry-rejected", action="store_true", help="Retry 503 responses after Retry-After")
+    parser.add_argument("--output-json", help="Write the summary as JSON")
+    return parser
+
+
+def main() -> int:
+    args = build_parser().parse_args()
+    client = DetectLinesClient(url=args.url, unix_socket=args.unix_socket)
+    image = Path(args.image).read_bytes()
+    statuses: Counter = Counter()
+    latencies: List[float] = []
+    lock = threading.Lock()
+
+    def one_request(_: int) -> None:
+        while True:
+            start = time.perf_counter()
+            status, _ = client.detect(image, args.bbox, polygon=args.polygon)
+            elapsed = time.perf_counter() - start
+            with lock:
+                statuses[status] += 1
+                if status == 200:
+                    latencies.append(elapsed)
+            if status != 503 or not args.retry_rejected:
+                return
+            time.sleep(1.0)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        list(pool.map(one_request, range(args.requests)))
+    duration = time.perf_counter() - start
+
+    summary = {
+        "requests": args.requests,
+        "concurrency": args.concurrency,
+        "duration_seconds": round(duration, 3),
+        "throughput_per_second": round(len(latencies) / duration, 3) if duration > 0 else 0.0,
+        "statuses": {str(status): count for status, count in sorted(statuses.items())},
+        "latency_seconds": {
+            "p50": round(percentile(latencies, 0.5), 4),
+            "p90": round(percentile(latencies, 0.9), 4),
+            "p99": round(percentile(latencies, 0.99), 4),
+            "max": round(max(latencies, default=0.0), 4),
+        },
+        "server": client.metrics(),
+    }
+    print(json.dumps(summary, indent=2))
+    if args.output_json:
+        Path(args.output_json).write_text(json.dumps(summary, indent=2), encoding="utf-8")
+    return 0 if statuses.get(200, 0) else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -1,23 +1,39 @@
-load("//extractors/line_detection:defs.bzl", "TransformationInfo")
+load("//extractors/line_detection:defs.bzl", "TransformationInfo", "declare_profile", "declare_memory_budget", "declare_threads", "declare_workers")
 load("//tools/previewer:preview_rules.bzl", "run_preview_action")
 
 
 def _skeleton_impl(ctx):
     output = ctx.outputs.out
     debug = ctx.outputs.debug
+    metrics = ctx.actions.declare_file(ctx.label.name + "_metrics.json")
+    profile, profile_env = declare_profile(ctx)
+    execution_requirements, threads_env = declare_threads(ctx)
+    env = dict(profile_env, **threads_env)
+    env.update(declare_memory_budget(ctx))
     args = ctx.actions.args()
+    args.use_param_file("@%s", use_always = True)
+    args.set_param_file_format("multiline")
     args.add("--mask", ctx.file.mask.path)
     args.add("--output", output.path)
     args.add("--output-debug", debug.path)
+    args.add("--output-metrics", metrics.path)
     args.add("--method", ctx.attr.method)
     args.add("--prune-spurs", ctx.attr.prune_spurs)
+    if ctx.attr.components:
+        args.add("--components")
+        args.add("--workers", ctx.attr.workers)
+    if ctx.attr.lean:
+        args.add("--lean")
 
     ctx.actions.run(
         inputs = [ctx.file.mask],
-        outputs = [output, debug],
+        outputs = [output, debug, metrics] + ([profile] if profile else []),
         executable = ctx.executable._tool,
         arguments = [args],
         tools = [ctx.executable._tool],
+        env = env,
+        mnemonic = "LineSkeleton",
+        execution_requirements = declare_workers(ctx, execution_requirements),
         progress_message = "Skeletonizing mask",
     )
 
@@ -25,6 +41,7 @@ def _skeleton_impl(ctx):
         ctx,
         image = ctx.file.image,
         overlay_mask = output,
+        roi = ctx.file.roi,
         debug_images = [debug],
         title = "Skeleton preview",
         parameters = {
@@ -39,9 +56,13 @@ def _skeleton_impl(ctx):
 
     return [
         DefaultInfo(files = depset([output, debug, preview])),
+        OutputGroupInfo(
+            metrics = depset([metrics]),
+            profile = depset([profile] if profile else []),
+        ),
         TransformationInfo(
             description = "Skeletonize mask to centerline.",
-            metadata = {"method": ctx.attr.method, "prune_spurs": ctx.attr.prune_spurs},
+            metadata = {"method": ctx.attr.method, "prune_spurs": ctx.attr.prune_spurs, "components": ctx.attr.components},
         ),
     ]
 
@@ -50,11 +71,15 @@ line_skeleton = rule(
     implementation = _skeleton_impl,
     attrs = {
         "image": attr.label(allow_single_file = True, mandatory = True),
+        "roi": attr.label(allow_single_file = True),
         "mask": attr.label(allow_single_file = True, mandatory = True),
         "out": attr.output(mandatory = True),
         "debug": attr.output(mandatory = True),
         "method": attr.string(default = "morphological"),
         "prune_spurs": attr.int(default = 0),
+        "components": attr.bool(default = False),
+        "workers": attr.int(default = 1),
+        "lean": attr.bool(default = False),
         "_tool": attr.label(
             default = Label("//extractors/line_detection/skeleton:skeletonize_mask"),
             executable = True,
@@ -2,23 +2,42 @@
 from __future__ import annotations
 
 import argparse
-from typing import List, Tuple
+from functools import partial
+from typing import List, Optional, Tuple
 
 import cv2
 import numpy as np
 
-from extractors.line_detection.pipeline_utils import load_mask, save_mask, skeleton_neighbors
-
-
-def morphological_skeleton(mask: np.ndarray) -> np.ndarray:
+from extractors.line_detection.pipeline_utils import (
+    AsyncWriter,
+    ScratchArena,
+    StageMetrics,
+    component_crops,
+    component_windows,
+    load_mask,
+    map_components,
+    opencv_threads,
+    save_json,
+    scratch,
+    set_thread_budget,
+    skeleton_neighbors,
+)
+from extractors.line_detection.worker import run_stage
+
+
+def morphological_skeleton(mask: np.ndarray, arena: Optional[ScratchArena] = None) -> np.ndarray:
+    # Every step writes into the same two scratch frames with dst=, so the loop allocates
+    # nothing per iteration.
     skeleton = np.zeros_like(mask)
     kernel = cv2.getStructuringElement(cv2.MORPH_CROSS, (3, 3))
-    working = mask.copy()
+    working = scratch(arena, "working", mask.shape)
+    np.copyto(working, mask)
+    opened = scratch(arena, "opened", mask.shape)
     while True:
-        opened = cv2.morphologyEx(working, cv2.MORPH_OPEN, kernel)
-        temp = cv2.subtract(working, opened)
-        skeleton = cv2.bitwise_or(skeleton, temp)
-        working = cv2.erode(working, kernel)
+        cv2.morphologyEx(working, cv2.MORPH_OPEN, kernel, dst=opened)
+        cv2.subtract(working, opened, dst=opened)
+        cv2.bitwise_or(skeleton, opened, dst=skeleton)
+        cv2.erode(working, kernel, dst=working)
         if cv2.countNonZero(working) == 0:
             break
     return skeleton
@@ -38,9 +57,10 @@ def find_endpoints_and_junctions(skeleton: np.ndarray) -> Tuple[List[Tuple[int,
 
 
 def prune_spurs(skeleton: np.ndarray, max_length: int) -> np.ndarray:
+    # Prunes in place; every caller hands over a skeleton it no longer needs unpruned.
     if max_length <= 0:
         return skeleton
-    pruned = skeleton.copy()
+    pruned = skeleton
     endpoints, _ = find_endpoints_and_junctions(pruned)
     for endpoint in endpoints:
         path = [endpoint]
@@ -64,39 +84,109 @@ def prune_spurs(skeleton: np.ndarray, max_length: int) -> np.ndarray:
     return pruned
 
 
+def skeletonize(mask: np.ndarray, method: str, arena: Optional[ScratchArena] = None) -> np.ndarray:
+    if method == "morphological":
+        return morphological_skeleton(mask, arena)
+    raise ValueError(f"Unsupported method: {method}")
+
+
+def skeletonize_component(
+    crop: np.ndarray, method: str, max_length: int, arena: Optional[ScratchArena] = None
+) -> np.ndarray:
+    return prune_spurs(skeletonize(crop, method, arena), max_length)
+
+
+def skeletonize_components(
+    mask: np.ndarray,
+    method: str,
+    max_length: int,
+    workers: int,
+    metrics: StageMetrics,
+    arena: Optional[ScratchArena] = None,
+) -> np.ndarray:
+    # The cross-kernel erode/open only reads 4-neighbours and spur walks only follow skeleton
+    # pixels, and neither crosses between 8-connected components, so each component can be
+    # skeletonized and pruned in its own crop for the same result as the full frame.
+    with metrics.step("components"):
+        labels, windows = component_windows(mask)
+        crops = component_crops(mask, labels, windows)
+    metrics.count("components", len(windows))
+    metrics.count("component_pixels", sum(crop.size for crop in crops))
+    with metrics.step("skeletonize"):
+        results = map_components(
+            partial(skeletonize_component, method=method, max_length=max_length, arena=arena), crops, workers
+        )
+    skeleton = np.zeros_like(mask)
+    with metrics.step("merge"):
+        for window, result in zip(windows, results):
+            region = skeleton[window.crop]
+            cv2.bitwise_or(region, result, dst=region)
+    return skeleton
+
+
 def build_parser() -> argparse.ArgumentParser:
     parser = argparse.ArgumentParser(description="Extract a 1-pixel skeleton from a binary mask.")
     parser.add_argument("--mask", required=True, help="Input binary mask")
     parser.add_argument("--output", required=True, help="Skeleton output")
     parser.add_argument("--output-debug", required=True, help="Debug visualization output")
+    parser.add_argument("--output-metrics", help="Optional JSON performance metrics output")
     parser.add_argument("--method", choices=["morphological"], default="morphological")
     parser.add_argument("--prune-spurs", type=int, default=0)
+    parser.add_argument("--components", action="store_true", help="Skeletonize each connected component in its own crop")
+    parser.add_argument("--workers", type=int, default=1, help="Processes for --components")
+    parser.add_argument("--threads", type=int, help="OpenCV threads (default: $LINE_DETECTION_THREADS or 1)")
+    parser.add_argument("--lean", action="store_true", help="Reuse scratch buffers to lower peak memory (same output)")
+    parser.add_argument("--memory-budget-mb", type=int, help="Peak RSS budget to report against")
     return parser
 
 
 def main() -> int:
     args = build_parser().parse_args()
-    mask = load_mask(args.mask)
-
-    if args.method == "morphological":
-        skeleton = morphological_skeleton(mask)
+    if args.workers < 1:
+        raise ValueError("--workers must be >= 1")
+    metrics = StageMetrics("skeletonize_mask")
+    metrics.count("threads", set_thread_budget(args.threads))
+    metrics.set_memory_budget(args.memory_budget_mb)
+    # Each component batch gets its own copy of the (empty) arena and reuses it crop after crop.
+    arena = ScratchArena() if args.lean else None
+    mask = load_mask(args.mask, metrics)
+    metrics.count("input_pixels", mask.size)
+
+    if args.components:
+        skeleton = skeletonize_components(mask, args.method, args.prune_spurs, args.workers, metrics, arena)
     else:
-        raise ValueError(f"Unsupported method: {args.method}")
-
-    skeleton = prune_spurs(skeleton, args.prune_spurs)
-
-    endpoints, junctions = find_endpoints_and_junctions(skeleton)
-    debug = cv2.cvtColor(skeleton, cv2.COLOR_GRAY2BGR)
-    for x, y in endpoints:
-        cv2.circle(debug, (x, y), 2, (0, 0, 255), -1)
-    for x, y in junctions:
-        cv2.circle(debug, (x, y), 2, (0, 255, 255), -1)
-
-    save_mask(args.output, skeleton)
-    cv2.imwrite(args.output_debug, debug)
+        if arena is not None:
+            # The skeleton's working frame starts as a copy of the mask, so it can be the mask.
+            arena.adopt("working", mask)
+        # Component crops run in worker processes and stay single-threaded there.
+        with metrics.step("skeletonize"), opencv_threads("morphologyEx", "erode"):
+            skeleton = skeletonize(mask, args.method, arena)
+    del mask
+    if arena is not None:
+        metrics.count("scratch_bytes", arena.nbytes)
+        arena.clear()
+
+    with AsyncWriter(metrics) as writer:
+        if not args.components:
+            with metrics.step("prune"):
+                skeleton = prune_spurs(skeleton, args.prune_spurs)
+        writer.save_mask(args.output, skeleton)
+        metrics.count("output_pixels", cv2.countNonZero(skeleton))
+
+        with metrics.step("debug"):
+            endpoints, junctions = find_endpoints_and_junctions(skeleton)
+            debug = cv2.cvtColor(skeleton, cv2.COLOR_GRAY2BGR)
+            for x, y in endpoints:
+                cv2.circle(debug, (x, y), 2, (0, 0, 255), -1)
+            for x, y in junctions:
+                cv2.circle(debug, (x, y), 2, (0, 255, 255), -1)
+        writer.save_image(args.output_debug, debug)
+    metrics.check_memory_budget()
+    if args.output_metrics:
+        save_json(args.output_metrics, metrics.as_dict())
 
     return 0
 
 
 if __name__ == "__main__":
-    raise SystemExit(main())
+    raise SystemExit(run_stage(main))
@@ -1,25 +1,47 @@
-load("//extractors/line_detection:defs.bzl", "TransformationInfo")
+load("//extractors/line_detection:defs.bzl", "TransformationInfo", "WORKER_EXECUTION_REQUIREMENTS", "declare_profile")
 load("//tools/previewer:preview_rules.bzl", "run_preview_action")
 
 
 def _topology_impl(ctx):
     output = ctx.outputs.out
     debug = ctx.outputs.debug
+    metrics = ctx.actions.declare_file(ctx.label.name + "_metrics.json")
+    if bool(ctx.file.input_geojson) == bool(ctx.file.graph):
+        fail("line_topology_cleanup needs exactly one of input_geojson or graph")
+    if ctx.attr.merge_chains and not ctx.file.graph:
+        fail("merge_chains requires graph")
+    source = ctx.file.graph or ctx.file.input_geojson
+    profile, profile_env = declare_profile(ctx)
     args = ctx.actions.args()
-    args.add("--input", ctx.file.input_geojson.path)
+    args.use_param_file("@%s", use_always = True)
+    args.set_param_file_format("multiline")
+    if ctx.file.graph:
+        args.add("--graph", source.path)
+    else:
+        args.add("--input", source.path)
     args.add("--output", output.path)
     args.add("--output-debug", debug.path)
+    args.add("--output-metrics", metrics.path)
     args.add("--spur-length", ctx.attr.spur_length)
     args.add("--snap-tolerance", ctx.attr.snap_tolerance)
+    if ctx.attr.node:
+        args.add("--node")
+    if ctx.attr.merge_chains:
+        args.add("--merge-chains")
     args.add("--simplify", ctx.attr.simplify)
     args.add("--smooth-iterations", ctx.attr.smooth_iterations)
+    if ctx.file.roi:
+        args.add("--roi", ctx.file.roi.path)
 
     ctx.actions.run(
-        inputs = [ctx.file.input_geojson],
-        outputs = [output, debug],
+        inputs = [source] + ([ctx.file.roi] if ctx.file.roi else []),
+        outputs = [output, debug, metrics] + ([profile] if profile else []),
         executable = ctx.executable._tool,
         arguments = [args],
         tools = [ctx.executable._tool],
+        env = profile_env,
+        mnemonic = "LineTopology",
+        execution_requirements = WORKER_EXECUTION_REQUIREMENTS,
         progress_message = "Cleaning vector topology",
     )
 
@@ -33,6 +55,8 @@ def _topology_impl(ctx):
         parameters = {
             "spur_length": ctx.attr.spur_length,
             "snap_tolerance": ctx.attr.snap_tolerance,
+            "merge_chains": str(ctx.attr.merge_chains),
+            "node": str(ctx.attr.node),
             "simplify": ctx.attr.simplify,
             "smooth_iterations": str(ctx.attr.smooth_iterations),
         },
@@ -44,6 +68,10 @@ def _topology_impl(ctx):
 
     return [
         DefaultInfo(files = depset([output, debug, preview])),
+        OutputGroupInfo(
+            metrics = depset([metrics]),
+            profile = depset([profile] if profile else []),
+        ),
         TransformationInfo(
             description = "Cleanup and simplify line topology.",
             metadata = {"spur_length": ctx.attr.spur_length},
@@ -55,12 +83,16 @@ line_topology_cleanup = rule(
     implementation = _topology_impl,
     attrs = {
         "image": attr.label(allow_single_file = True, mandatory = True),
-        "input_geojson": attr.label(allow_single_file = True, mandatory = True),
+        "roi": attr.label(allow_single_file = True),
+        "input_geojson": attr.label(allow_single_file = True),
+        "graph": attr.label(allow_single_file = [".npz"]),
         "bbox": attr.string_list(mandatory = True),
         "out": attr.output(mandatory = True),
         "debug": attr.output(mandatory = True),
         "spur_length": attr.string(default = "0.0"),
         "snap_tolerance": attr.string(default = "0.0"),
+        "merge_chains": attr.bool(default = False),
+        "node": attr.bool(default = False),
         "simplify": attr.string(default = "0.0"),
         "smooth_iterations": attr.int(default = 0),
         "_tool": attr.label(
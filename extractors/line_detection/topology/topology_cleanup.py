@@ -6,7 +6,23 @@ import json
 from collections import defaultdict
 from typing import Dict, List, Tuple
 
-from shapely.geometry import LineString, MultiLineString, mapping, shape
+import numpy as np
+import shapely
+from shapely.geometry import LineString, MultiLineString, Polygon, mapping, shape
+
+from extractors.line_detection.pipeline_utils import (
+    LineGraph,
+    RegionOfInterest,
+    StageMetrics,
+    load_graph,
+    load_roi,
+    save_json,
+)
+from extractors.line_detection.worker import run_stage
+
+LINEAR_TYPES = (shapely.GeometryType.LINESTRING, shapely.GeometryType.MULTILINESTRING)
+# Relative tolerance for treating segments as parallel and split positions as line ends.
+NODE_EPSILON = 1e-9
 
 
 def collect_lines(geojson: dict) -> List[LineString]:
@@ -76,6 +92,230 @@ def apply_snapping(lines: List[LineString], snapped: Dict[Tuple[float, float], T
     return output
 
 
+def graph_edge_coords(graph: LineGraph) -> List[np.ndarray]:
+    world = graph.to_world(graph.paths)
+    return np.split(world, graph.path_offsets[1:-1])
+
+
+def prune_graph_edges(coords: List[np.ndarray], min_length: float) -> np.ndarray:
+    if min_length <= 0 or not coords:
+        return np.ones(len(coords), dtype=bool)
+    lengths = np.array([np.hypot(*np.diff(edge, axis=0).T).sum() for edge in coords])
+    return lengths >= min_length
+
+
+def snap_graph_nodes(graph: LineGraph, edges: np.ndarray, tolerance: float) -> Tuple[np.ndarray, np.ndarray]:
+    """Cluster the nodes used by `edges` within `tolerance` (world units).
+
+    Returns a cluster label per graph node and the world position of each node after snapping
+    (its cluster centroid). Clusters are transitive: nodes chained within tolerance merge.
+    """
+    labels = np.arange(len(graph.nodes))
+    positions = graph.to_world(graph.nodes)
+    used = np.unique(edges)
+    if tolerance <= 0 or used.size < 2:
+        return labels, positions
+    points = shapely.points(positions[used])
+    left, right = shapely.STRtree(points).query(points, predicate="dwithin", distance=tolerance)
+    left, right = used[left], used[right]
+    # Min-label propagation with pointer jumping: a union-find over node IDs in numpy.
+    while True:
+        previous = labels.copy()
+        np.minimum.at(labels, left, labels[right])
+        np.minimum.at(labels, right, labels[left])
+        labels = labels[labels]
+        if np.array_equal(labels, previous):
+            break
+    counts = np.bincount(labels[used], minlength=len(labels)).astype(np.float64)
+    sums_x = np.bincount(labels[used], weights=positions[used, 0], minlength=len(labels))
+    sums_y = np.bincount(labels[used], weights=positions[used, 1], minlength=len(labels))
+    centroids = np.column_stack([sums_x, sums_y]) / np.maximum(counts, 1)[:, None]
+    snapped = positions.copy()
+    snapped[used] = centroids[labels[used]]
+    return labels, snapped
+
+
+def merge_chains(coords: List[np.ndarray], ends: np.ndarray) -> List[np.ndarray]:
+    """Join edges through nodes of degree two; ends holds the (snapped) node label of each edge end."""
+    incident: Dict[int, List[Tuple[int, int]]] = defaultdict(list)
+    for index, (start, end) in enumerate(ends.tolist()):
+        incident[start].append((index, 0))
+        incident[end].append((index, 1))
+    visited = np.zeros(len(coords), dtype=bool)
+
+    def walk(node: int) -> List[np.ndarray]:
+        # Follow unvisited edges out of `node` while it joins exactly two edge ends.
+        pieces: List[np.ndarray] = []
+        while len(incident[node]) == 2:
+            following = [(edge, side) for edge, side in incident[node] if not visited[edge]]
+            if not following:
+                break
+            edge, side = following[0]
+            visited[edge] = True
+            pieces.append(coords[edge] if side == 0 else coords[edge][::-1])
+            node = int(ends[edge, 1 - side])
+        return pieces
+
+    chains: List[np.ndarray] = []
+    for index in range(len(coords)):
+        if visited[index]:
+            continue
+        visited[index] = True
+        forward = walk(int(ends[index, 1]))
+        backward = walk(int(ends[index, 0]))
+        parts = [piece[::-1] for piece in reversed(backward)] + [coords[index]] + forward
+        chains.append(np.concatenate([parts[0]] + [part[1:] for part in parts[1:]]))
+    return chains
+
+
+def graph_lines(
+    graph: LineGraph,
+    metrics: StageMetrics,
+    spur_length: float,
+    snap_tolerance: float,
+    merge: bool,
+) -> List[LineString]:
+    coords = graph_edge_coords(graph)
+    with metrics.step("prune"):
+        keep = prune_graph_edges(coords, spur_length)
+        coords = [edge for edge, kept in zip(coords, keep) if kept]
+        edges = graph.edges[keep]
+    with metrics.step("snap"):
+        labels, positions = snap_graph_nodes(graph, edges, snap_tolerance)
+        for edge, (start, end) in zip(coords, edges.tolist()):
+            edge[0] = positions[start]
+            edge[-1] = positions[end]
+    if merge:
+        with metrics.step("merge"):
+            coords = merge_chains(coords, labels[edges])
+        metrics.count("merged_chains", len(coords))
+    return [LineString(edge) for edge in coords]
+
+
+def cross(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    return a[:, 0] * b[:, 1] - a[:, 1] * b[:, 0]
+
+
+def segment_arrays(lines: List[LineString]) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    # Every consecutive vertex pair becomes a segment tagged with its line and its index on that line.
+    coords, owner = shapely.get_coordinates(lines, return_index=True)
+    same_line = owner[:-1] == owner[1:]
+    first_vertex = np.searchsorted(owner, owner)
+    index = np.arange(len(owner) - 1)[same_line]
+    return coords[index], coords[index + 1], owner[index], index - first_vertex[index]
+
+
+def crossing_events(
+    starts: np.ndarray,
+    ends: np.ndarray,
+    owners: np.ndarray,
+    positions: np.ndarray,
+    left: np.ndarray,
+    right: np.ndarray,
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Return (line, position along line, point) for every place a candidate pair touches.
+
+    Positions are segment index plus the fraction along that segment. Both lines of a pair
+    get the same point so the split lines share the node exactly.
+    """
+    p, r_end, q, s_end = starts[left], ends[left], starts[right], ends[right]
+    r, s, qp = r_end - p, s_end - q, q - p
+    denominator = cross(r, s)
+    scale = np.hypot(r[:, 0], r[:, 1]) * np.hypot(s[:, 0], s[:, 1])
+    crossing = np.abs(denominator) > NODE_EPSILON * scale
+
+    lines, where, points = [], [], []
+    if crossing.any():
+        d = denominator[crossing]
+        t = np.clip(cross(qp[crossing], s[crossing]) / d, 0.0, 1.0)
+        u = np.clip(cross(qp[crossing], r[crossing]) / d, 0.0, 1.0)
+        point = p[crossing] + t[:, None] * r[crossing]
+        # Prefer existing vertices so endpoints touching a segment keep their exact coordinates.
+        for fraction, start, end in ((t, p[crossing], r_end[crossing]), (u, q[crossing], s_end[crossing])):
+            point = np.where((fraction == 0.0)[:, None], start, point)
+            point = np.where((fraction == 1.0)[:, None], end, point)
+        lines += [owners[left][crossing], owners[right][crossing]]
+        where += [positions[left][crossing] + t, positions[right][crossing] + u]
+        points += [point, point]
+
+    # Parallel pairs that intersect overlap: each segment is split where the other one ends.
+    overlap = ~crossing
+    for a, a_end, b, b_end, pair_a in (
+        (p, r_end, q, s_end, left),
+        (q, s_end, p, r_end, right),
+    ):
+        direction = a_end[overlap] - a[overlap]
+        length = np.einsum("ij,ij->i", direction, direction)
+        for endpoint in (b[overlap], b_end[overlap]):
+            fraction = np.einsum("ij,ij->i", endpoint - a[overlap], direction) / np.where(length > 0, length, 1.0)
+            inside = (length > 0) & (fraction >= 0.0) & (fraction <= 1.0)
+            lines.append(owners[pair_a][overlap][inside])
+            where.append(positions[pair_a][overlap][inside] + fraction[inside])
+            points.append(endpoint[inside])
+
+    if not lines:
+        return np.empty(0, dtype=np.int64), np.empty(0), np.empty((0, 2))
+    return np.concatenate(lines), np.concatenate(where), np.concatenate(points)
+
+
+def split_coords(coords: np.ndarray, where: np.ndarray, points: np.ndarray) -> List[np.ndarray]:
+    last = len(coords) - 1
+    inner = (where > NODE_EPSILON) & (where < last - NODE_EPSILON)
+    where, first = np.unique(where[inner], return_index=True)
+    if where.size == 0:
+        return [coords]
+    points = points[inner][first]
+    # A split landing on a vertex replaces it; the rest are inserted between vertices.
+    vertex_positions = np.arange(len(coords), dtype=np.float64)
+    keep = ~np.isin(vertex_positions, where)
+    merged_positions = np.concatenate([vertex_positions[keep], where])
+    merged_points = np.concatenate([coords[keep], points])
+    is_split = np.concatenate([np.zeros(int(keep.sum()), dtype=bool), np.ones(where.size, dtype=bool)])
+    order = np.argsort(merged_positions, kind="stable")
+    merged_points, is_split = merged_points[order], is_split[order]
+
+    pieces = []
+    start = 0
+    for cut in np.flatnonzero(is_split):
+        pieces.append(merged_points[start : cut + 1])
+        start = cut
+    pieces.append(merged_points[start:])
+    return pieces
+
+
+def node_lines(lines: List[LineString]) -> Tuple[List[LineString], int]:
+    """Split lines wherever they cross or touch, including T-junctions mid-segment.
+
+    Candidate segment pairs come from one bulk STRtree query, so the cost grows with the
+    number of segments and actual crossings rather than with all pairs.
+    """
+    if not lines:
+        return lines, 0
+    starts, ends, owners, positions = segment_arrays(lines)
+    segments = shapely.linestrings(np.stack([starts, ends], axis=1))
+    left, right = shapely.STRtree(segments).query(segments, predicate="intersects")
+    # Each pair once; neighbouring segments of one line always share their vertex.
+    distinct = (left < right) & ~((owners[left] == owners[right]) & (np.abs(positions[left] - positions[right]) == 1))
+    line_ids, where, points = crossing_events(starts, ends, owners, positions, left[distinct], right[distinct])
+
+    order = np.argsort(line_ids, kind="stable")
+    line_ids, where, points = line_ids[order], where[order], points[order]
+    touched, first = np.unique(line_ids, return_index=True)
+    ranges = dict(zip(touched.tolist(), zip(first.tolist(), np.append(first[1:], len(line_ids)).tolist())))
+
+    output: List[LineString] = []
+    splits = 0
+    for index, line in enumerate(lines):
+        if index not in ranges:
+            output.append(line)
+            continue
+        lo, hi = ranges[index]
+        pieces = split_coords(np.asarray(line.coords)[:, :2], where[lo:hi], points[lo:hi])
+        splits += len(pieces) - 1
+        output.extend(LineString(piece) for piece in pieces if len(piece) >= 2)
+    return output, splits
+
+
 def simplify_lines(lines: List[LineString], epsilon: float) -> List[LineString]:
     if epsilon <= 0:
         return lines
@@ -105,6 +345,20 @@ def smooth_lines(lines: List[LineString], iterations: int) -> List[LineString]:
     return [smooth_line(line, iterations) for line in lines]
 
 
+def clip_to_roi(lines: List[LineString], roi: RegionOfInterest) -> List[LineString]:
+    if not lines:
+        return lines
+    polygons = [Polygon(ring) for ring in roi.polygons]
+    polygons = [polygon if polygon.is_valid else polygon.buffer(0) for polygon in polygons]
+    polygon = polygons[0] if len(polygons) == 1 else shapely.union_all(polygons)
+    shapely.prepare(polygon)
+    geometries = np.array(lines, dtype=object)
+    geometries = geometries[shapely.intersects(polygon, geometries)]
+    clipped = shapely.intersection(geometries, polygon)
+    parts = shapely.get_parts(clipped[np.isin(shapely.get_type_id(clipped), LINEAR_TYPES)])
+    return list(parts[~shapely.is_empty(parts)])
+
+
 def build_geojson(lines: List[LineString]) -> dict:
     return {
         "type": "FeatureCollection",
@@ -117,45 +371,91 @@ def build_geojson(lines: List[LineString]) -> dict:
 
 def build_parser() -> argparse.ArgumentParser:
     parser = argparse.ArgumentParser(description="Cleanup line topology after vectorization.")
-    parser.add_argument("--input", required=True, help="Input GeoJSON")
+    parser.add_argument("--input", help="Input GeoJSON")
+    parser.add_argument("--graph", help="Path graph (.npz) from vectorize --output-graph, instead of --input")
     parser.add_argument("--output", required=True, help="Cleaned GeoJSON")
     parser.add_argument("--output-debug", required=True, help="Debug stats JSON")
+    parser.add_argument("--output-metrics", help="Optional JSON performance metrics output")
     parser.add_argument("--spur-length", type=float, default=0.0)
     parser.add_argument("--snap-tolerance", type=float, default=0.0)
+    parser.add_argument("--merge-chains", action="store_true", help="With --graph, join edges through degree-2 nodes")
+    parser.add_argument("--node", action="store_true", help="Split lines at crossings and T-junctions")
     parser.add_argument("--simplify", type=float, default=0.0)
     parser.add_argument("--smooth-iterations", type=int, default=0)
+    parser.add_argument("--roi", help="ROI metadata JSON; output is clipped exactly to its polygon")
     return parser
 
 
 def main() -> int:
-    args = build_parser().parse_args()
-    data = json.loads(open(args.input, "r", encoding="utf-8").read())
-    lines = collect_lines(data)
-    original_count = len(lines)
+    parser = build_parser()
+    args = parser.parse_args()
+    if bool(args.input) == bool(args.graph):
+        parser.error("Provide exactly one of --input or --graph")
+    if args.merge_chains and not args.graph:
+        parser.error("--merge-chains requires --graph")
+    metrics = StageMetrics("topology_cleanup")
+    if args.graph:
+        # Connectivity comes from node IDs: snapping clusters nodes, not float endpoint keys.
+        graph = load_graph(args.graph, metrics)
+        original_count = len(graph.edges)
+        metrics.count("input_features", original_count)
+        metrics.count("input_vertices", len(graph.paths))
+        lines = graph_lines(graph, metrics, args.spur_length, args.snap_tolerance, args.merge_chains)
+    else:
+        with metrics.step("decode"):
+            data = json.loads(open(args.input, "r", encoding="utf-8").read())
+            lines = collect_lines(data)
+        original_count = len(lines)
+        metrics.count("input_features", original_count)
+        metrics.count("input_vertices", sum(len(line.coords) for line in lines))
 
-    lines = prune_spurs(lines, args.spur_length)
-    snapped = cluster_endpoints(lines, args.snap_tolerance)
-    lines = apply_snapping(lines, snapped)
-    lines = simplify_lines(lines, args.simplify)
-    lines = smooth_lines(lines, args.smooth_iterations)
+        with metrics.step("prune"):
+            lines = prune_spurs(lines, args.spur_length)
+        with metrics.step("snap"):
+            snapped = cluster_endpoints(lines, args.snap_tolerance)
+            lines = apply_snapping(lines, snapped)
+    splits = 0
+    if args.node:
+        with metrics.step("node"):
+            lines, splits = node_lines(lines)
+        metrics.count("node_splits", splits)
+    with metrics.step("simplify"):
+        lines = simplify_lines(lines, args.simplify)
+    with metrics.step("smooth"):
+        lines = smooth_lines(lines, args.smooth_iterations)
+    roi = load_roi(args.roi)
+    if roi is not None:
+        with metrics.step("clip"):
+            lines = clip_to_roi(lines, roi)
+    metrics.count("output_features", len(lines))
+    metrics.count("output_vertices", sum(len(line.coords) for line in lines))
 
-    result = build_geojson(lines)
-    with open(args.output, "w", encoding="utf-8") as handle:
-        json.dump(result, handle, ensure_ascii=False, indent=2)
+    with metrics.step("encode"):
+        result = build_geojson(lines)
+    with metrics.step("write"):
+        with open(args.output, "w", encoding="utf-8") as handle:
+            json.dump(result, handle, ensure_ascii=False, indent=2)
 
     debug = {
         "input_lines": original_count,
         "output_lines": len(lines),
         "spur_length": args.spur_length,
         "snap_tolerance": args.snap_tolerance,
+        "graph": bool(args.graph),
+        "merge_chains": args.merge_chains,
+        "node": args.node,
+        "node_splits": splits,
         "simplify": args.simplify,
         "smooth_iterations": args.smooth_iterations,
+        "roi": roi.as_dict() if roi is not None else None,
     }
     with open(args.output_debug, "w", encoding="utf-8") as handle:
         json.dump(debug, handle, ensure_ascii=False, indent=2)
+    if args.output_metrics:
+        save_json(args.output_metrics, metrics.as_dict())
 
     return 0
 
 
 if __name__ == "__main__":
-    raise SystemExit(main())
+    raise SystemExit(run_stage(main))
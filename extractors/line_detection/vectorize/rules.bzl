@@ -1,4 +1,4 @@
-load("//extractors/line_detection:defs.bzl", "TransformationInfo")
+load("//extractors/line_detection:defs.bzl", "TransformationInfo", "WORKER_EXECUTION_REQUIREMENTS", "declare_profile", "declare_workers")
 load("//tools/previewer:preview_rules.bzl", "run_preview_action")
 
 
@@ -6,23 +6,39 @@ def _vectorize_impl(ctx):
     output = ctx.outputs.out
     debug = ctx.outputs.debug
     stats = ctx.outputs.stats
+    metrics = ctx.actions.declare_file(ctx.label.name + "_metrics.json")
+    graph = ctx.outputs.graph
 
+    profile, profile_env = declare_profile(ctx)
     args = ctx.actions.args()
+    args.use_param_file("@%s", use_always = True)
+    args.set_param_file_format("multiline")
     args.add("--mask", ctx.file.mask.path)
     args.add("--bbox")
     args.add_all(ctx.attr.bbox)
     args.add("--output", output.path)
     args.add("--output-debug", debug.path)
     args.add("--output-stats", stats.path)
+    args.add("--output-metrics", metrics.path)
+    if graph:
+        args.add("--output-graph", graph.path)
     args.add("--min-path-length", ctx.attr.min_path_length)
     args.add("--gap-bridge", ctx.attr.gap_bridge)
+    if ctx.attr.components:
+        args.add("--components")
+        args.add("--workers", ctx.attr.workers)
+    if ctx.file.roi:
+        args.add("--roi", ctx.file.roi.path)
 
     ctx.actions.run(
-        inputs = [ctx.file.mask],
-        outputs = [output, debug, stats],
+        inputs = [ctx.file.mask] + ([ctx.file.roi] if ctx.file.roi else []),
+        outputs = [output, debug, stats, metrics] + ([graph] if graph else []) + ([profile] if profile else []),
         executable = ctx.executable._tool,
         arguments = [args],
         tools = [ctx.executable._tool],
+        env = profile_env,
+        mnemonic = "LineVectorize",
+        execution_requirements = declare_workers(ctx, WORKER_EXECUTION_REQUIREMENTS),
         progress_message = "Vectorizing skeleton",
     )
 
@@ -45,7 +61,11 @@ def _vectorize_impl(ctx):
     )
 
     return [
-        DefaultInfo(files = depset([output, debug, stats, preview])),
+        DefaultInfo(files = depset([output, debug, stats, preview] + ([graph] if graph else []))),
+        OutputGroupInfo(
+            metrics = depset([metrics]),
+            profile = depset([profile] if profile else []),
+        ),
         TransformationInfo(
             description = "Vectorize skeleton into GeoJSON lines.",
             metadata = {"min_path_length": ctx.attr.min_path_length},
@@ -57,13 +77,17 @@ line_vectorize = rule(
     implementation = _vectorize_impl,
     attrs = {
         "image": attr.label(allow_single_file = True, mandatory = True),
+        "roi": attr.label(allow_single_file = True),
         "mask": attr.label(allow_single_file = True, mandatory = True),
         "bbox": attr.string_list(mandatory = True),
         "out": attr.output(mandatory = True),
         "debug": attr.output(mandatory = True),
         "stats": attr.output(mandatory = True),
+        "graph": attr.output(doc = "Optional .npz path graph for line_topology_cleanup."),
         "min_path_length": attr.int(default = 10),
         "gap_bridge": attr.string(default = "0.0"),
+        "components": attr.bool(default = False),
+        "workers": attr.int(default = 1),
         "_tool": attr.label(
             default = Label("//extractors/line_detection/vectorize:vectorize_skeleton"),
             executable = True,
@@ -2,14 +2,27 @@
 from __future__ import annotations
 
 import argparse
-import json
 from collections import defaultdict
 from typing import Dict, List, Sequence, Tuple
 
 import cv2
 import numpy as np
 
-from extractors.line_detection.pipeline_utils import Bounds, load_mask, save_json, skeleton_neighbors
+from extractors.line_detection.pipeline_utils import (
+    AsyncWriter,
+    Bounds,
+    LineGraph,
+    StageMetrics,
+    component_crops,
+    component_windows,
+    crop_to_roi,
+    load_mask,
+    load_roi,
+    map_components,
+    save_json,
+    skeleton_neighbors,
+)
+from extractors.line_detection.worker import run_stage
 
 
 def build_graph(skeleton: np.ndarray) -> Tuple[List[Tuple[int, int]], Dict[Tuple[int, int], List[Tuple[int, int]]]]:
@@ -63,6 +76,33 @@ def trace_paths(
     return paths
 
 
+def trace_component(crop: np.ndarray) -> Tuple[List[Tuple[int, int]], List[List[Tuple[int, int]]]]:
+    nodes, adjacency = build_graph(crop)
+    return nodes, trace_paths(nodes, adjacency)
+
+
+def trace_components(
+    skeleton: np.ndarray, workers: int, metrics: StageMetrics
+) -> Tuple[List[Tuple[int, int]], List[List[Tuple[int, int]]]]:
+    # Tracing never leaves an 8-connected component, so components are traced in their own crops.
+    # Paths are then stably sorted by start node in row-major order, which is the order the
+    # full-frame trace emits them in, so gap bridging sees the same input either way.
+    with metrics.step("components"):
+        labels, windows = component_windows(skeleton)
+        crops = component_crops(skeleton, labels, windows)
+    metrics.count("components", len(windows))
+    with metrics.step("trace"):
+        results = map_components(trace_component, crops, workers)
+    nodes: List[Tuple[int, int]] = []
+    paths: List[List[Tuple[int, int]]] = []
+    with metrics.step("merge"):
+        for window, (crop_nodes, crop_paths) in zip(windows, results):
+            nodes.extend((x + window.cx0, y + window.cy0) for x, y in crop_nodes)
+            paths.extend([(x + window.cx0, y + window.cy0) for x, y in path] for path in crop_paths)
+        paths.sort(key=lambda path: (path[0][1], path[0][0]))
+    return nodes, paths
+
+
 def bridge_gaps(paths: List[List[Tuple[int, int]]], tolerance: float) -> List[List[Tuple[int, int]]]:
     if tolerance <= 0:
         return paths
@@ -95,10 +135,18 @@ def bridge_gaps(paths: List[List[Tuple[int, int]]], tolerance: float) -> List[Li
     return [path for path in merged if path]
 
 
-def to_geojson(paths: Sequence[Sequence[Tuple[int, int]]], bounds: Bounds, width: int, height: int) -> dict:
+def to_geojson(
+    paths: Sequence[Sequence[Tuple[int, int]]],
+    bounds: Bounds,
+    width: int,
+    height: int,
+    offset: Tuple[int, int] = (0, 0),
+) -> dict:
+    # width/height are the full sheet's; offset places ROI-cropped paths back on the sheet.
+    offset_x, offset_y = offset
     features = []
     for path in paths:
-        coords = [bounds.to_world(float(x), float(y), width, height) for x, y in path]
+        coords = [bounds.to_world(float(x + offset_x), float(y + offset_y), width, height) for x, y in path]
         if len(coords) < 2:
             continue
         features.append({
@@ -113,33 +161,63 @@ def build_parser() -> argparse.ArgumentParser:
     parser = argparse.ArgumentParser(description="Vectorize a skeleton mask into GeoJSON LineStrings.")
     parser.add_argument("--mask", required=True, help="Skeleton mask input")
     parser.add_argument("--bbox", required=True, nargs=4, metavar=("MIN_X", "MIN_Y", "MAX_X", "MAX_Y"))
+    parser.add_argument("--roi", help="ROI metadata JSON; the mask is in its crop-window pixels")
     parser.add_argument("--output", required=True, help="GeoJSON output")
     parser.add_argument("--output-debug", required=True, help="Debug image output")
     parser.add_argument("--output-stats", required=True, help="JSON stats output")
+    parser.add_argument("--output-metrics", help="Optional JSON performance metrics output")
+    parser.add_argument("--output-graph", help="Optional path graph (.npz) for topology cleanup --graph")
     parser.add_argument("--min-path-length", type=int, default=10)
     parser.add_argument("--gap-bridge", type=float, default=0.0)
+    parser.add_argument("--components", action="store_true", help="Trace each connected component in its own crop")
+    parser.add_argument("--workers", type=int, default=1, help="Processes for --components")
     return parser
 
 
 def main() -> int:
     args = build_parser().parse_args()
-    skeleton = load_mask(args.mask)
+    if args.workers < 1:
+        raise ValueError("--workers must be >= 1")
+    metrics = StageMetrics("vectorize_skeleton")
+    roi = load_roi(args.roi)
+    skeleton = crop_to_roi(load_mask(args.mask, metrics), roi)
     height, width = skeleton.shape[:2]
     bounds = Bounds.from_sequence(args.bbox)
-
-    nodes, adjacency = build_graph(skeleton)
-    raw_paths = trace_paths(nodes, adjacency)
-    bridged_paths = bridge_gaps(raw_paths, args.gap_bridge)
-    filtered_paths = [path for path in bridged_paths if len(path) >= args.min_path_length]
-
-    geojson = to_geojson(filtered_paths, bounds, width, height)
-    with open(args.output, "w", encoding="utf-8") as handle:
-        json.dump(geojson, handle, ensure_ascii=False, indent=2)
-
-    debug = cv2.cvtColor(skeleton, cv2.COLOR_GRAY2BGR)
-    for x, y in nodes:
-        cv2.circle(debug, (x, y), 2, (0, 255, 255), -1)
-    cv2.imwrite(args.output_debug, debug)
+    offset = (0, 0)
+    if roi is not None:
+        if roi.bounds != bounds:
+            raise ValueError("--bbox does not match the bbox recorded in the ROI metadata.")
+        width, height, offset = roi.source_width, roi.source_height, (roi.x0, roi.y0)
+    metrics.count("input_pixels", skeleton.size)
+
+    if args.components:
+        nodes, raw_paths = trace_components(skeleton, args.workers, metrics)
+    else:
+        with metrics.step("graph"):
+            nodes, adjacency = build_graph(skeleton)
+        with metrics.step("trace"):
+            raw_paths = trace_paths(nodes, adjacency)
+    with metrics.step("bridge"):
+        bridged_paths = bridge_gaps(raw_paths, args.gap_bridge)
+        filtered_paths = [path for path in bridged_paths if len(path) >= args.min_path_length]
+    metrics.count("output_features", len(filtered_paths))
+    metrics.count("output_vertices", sum(len(path) for path in filtered_paths))
+
+    with AsyncWriter(metrics) as writer:
+        with metrics.step("encode"):
+            geojson = to_geojson(filtered_paths, bounds, width, height, offset)
+        writer.save_json(args.output, geojson)
+        if args.output_graph:
+            with metrics.step("graph_encode"):
+                graph = LineGraph.from_paths(filtered_paths, bounds, width, height, offset)
+            writer.save_graph(args.output_graph, graph)
+            metrics.count("graph_nodes", len(graph.nodes))
+
+        with metrics.step("debug"):
+            debug = cv2.cvtColor(skeleton, cv2.COLOR_GRAY2BGR)
+            for x, y in nodes:
+                cv2.circle(debug, (x, y), 2, (0, 255, 255), -1)
+        writer.save_image(args.output_debug, debug)
 
     save_json(
         args.output_stats,
@@ -149,11 +227,14 @@ def main() -> int:
             "paths_filtered": len(filtered_paths),
             "min_path_length": args.min_path_length,
             "gap_bridge": args.gap_bridge,
+            "components": args.components,
         },
     )
+    if args.output_metrics:
+        save_json(args.output_metrics, metrics.as_dict())
 
     return 0
 
 
 if __name__ == "__main__":
-    raise SystemExit(main())
+    raise SystemExit(run_stage(main))
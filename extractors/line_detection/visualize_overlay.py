@@ -7,16 +7,35 @@ Example:
     --geojson cam_waterlines.geojson \
     --bbox 0 0 1200 958 \
     --output cam_waterlines_overlay.html
+
+Large sheets can be written as a tiled viewer instead (XYZ image pyramid plus
+per-zoom simplified vector tiles) and served locally:
+  python extractors/line_detection/visualize_overlay.py \
+    --image cam_waterlines_map.png \
+    --geojson cam_waterlines.geojson \
+    --bbox 0 0 1200 958 \
+    --tiles-dir cam_waterlines_overlay \
+    --serve 8000
 """
 from __future__ import annotations
 
 import argparse
 import base64
+import functools
 import json
+import math
+import shutil
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
 from pathlib import Path
 from typing import Sequence, Tuple
 
 import cv2
+import numpy as np
+import shapely
+from shapely.geometry import mapping, shape
+
+
+TILE_SIZE = 256
 
 
 def parse_bbox(values: Sequence[str]) -> Tuple[float, float, float, float]:
@@ -35,6 +54,281 @@ def encode_png(image) -> str:
     return base64.b64encode(encoded.tobytes()).decode("utf-8")
 
 
+def native_zoom(width: int, height: int, tile_size: int) -> int:
+    return max(0, int(math.ceil(math.log2(max(width, height) / float(tile_size)))))
+
+
+def write_image_pyramid(image: np.ndarray, out_dir: Path, max_zoom: int, tile_size: int, tile_format: str) -> None:
+    if tile_format == "png":
+        level = cv2.cvtColor(image, cv2.COLOR_BGR2BGRA)
+        padding = (0, 0, 0, 0)
+        params = [cv2.IMWRITE_PNG_COMPRESSION, 1]
+    else:
+        level = image
+        padding = (255, 255, 255)
+        params = [cv2.IMWRITE_JPEG_QUALITY, 85]
+    for zoom in range(max_zoom, -1, -1):
+        height, width = level.shape[:2]
+        for ty in range(0, int(math.ceil(height / tile_size))):
+            for tx in range(0, int(math.ceil(width / tile_size))):
+                tile = level[ty * tile_size : (ty + 1) * tile_size, tx * tile_size : (tx + 1) * tile_size]
+                if tile.shape[0] != tile_size or tile.shape[1] != tile_size:
+                    tile = cv2.copyMakeBorder(
+                        tile,
+                        0,
+                        tile_size - tile.shape[0],
+                        0,
+                        tile_size - tile.shape[1],
+                        cv2.BORDER_CONSTANT,
+                        value=padding,
+                    )
+                path = out_dir / "tiles" / str(zoom) / str(tx) / f"{ty}.{tile_format}"
+                path.parent.mkdir(parents=True, exist_ok=True)
+                cv2.imwrite(str(path), tile, params)
+        if zoom > 0:
+            size = (max(1, int(math.ceil(width / 2))), max(1, int(math.ceil(height / 2))))
+            level = cv2.resize(level, size, interpolation=cv2.INTER_AREA)
+
+
+def collect_geometries(geojson: dict) -> np.ndarray:
+    geometries = [
+        shape(feature["geometry"])
+        for feature in geojson.get("features", [])
+        if feature.get("geometry")
+    ]
+    return np.array(geometries, dtype=object)
+
+
+def write_vector_tiles(
+    geojson: dict,
+    bbox: Tuple[float, float, float, float],
+    width: int,
+    height: int,
+    out_dir: Path,
+    max_zoom: int,
+    tile_size: int,
+) -> None:
+    min_x, min_y, max_x, max_y = bbox
+    geometries = collect_geometries(geojson)
+    if geometries.size == 0:
+        return
+    # World units covered by one pixel at the native zoom.
+    unit_x = (max_x - min_x) / width
+    unit_y = (max_y - min_y) / height
+    for zoom in range(max_zoom, -1, -1):
+        factor = 2 ** (max_zoom - zoom)
+        tile_w = tile_size * factor * unit_x
+        tile_h = tile_size * factor * unit_y
+        # One screen pixel at this zoom is the simplification budget.
+        simplified = shapely.simplify(geometries, factor * min(unit_x, unit_y), preserve_topology=False)
+        simplified = simplified[~shapely.is_empty(simplified)]
+        if simplified.size == 0:
+            continue
+        tree = shapely.STRtree(simplified)
+        columns = int(math.ceil(width / float(tile_size * factor)))
+        rows = int(math.ceil(height / float(tile_size * factor)))
+        for ty in range(rows):
+            for tx in range(columns):
+                x0 = min_x + tx * tile_w
+                y1 = max_y - ty * tile_h
+                x1, y0 = x0 + tile_w, y1 - tile_h
+                # A pixel of padding keeps strokes continuous across tile seams.
+                pad_x, pad_y = factor * unit_x, factor * unit_y
+                candidates = tree.query(shapely.box(x0 - pad_x, y0 - pad_y, x1 + pad_x, y1 + pad_y))
+                if candidates.size == 0:
+                    continue
+                clipped = shapely.clip_by_rect(simplified[candidates], x0 - pad_x, y0 - pad_y, x1 + pad_x, y1 + pad_y)
+                clipped = clipped[~shapely.is_empty(clipped)]
+                if clipped.size == 0:
+                    continue
+                payload = {
+                    "type": "FeatureCollection",
+                    "features": [
+                        {"type": "Feature", "geometry": mapping(geometry), "properties": {}}
+                        for geometry in clipped
+                    ],
+                }
+                path = out_dir / "vector" / str(zoom) / str(tx) / f"{ty}.json"
+                path.parent.mkdir(parents=True, exist_ok=True)
+                path.write_text(json.dumps(payload, separators=(",", ":")), encoding="utf-8")
+
+
+def build_tiled_html(
+    bbox: Tuple[float, float, float, float],
+    width: int,
+    height: int,
+    max_zoom: int,
+    tile_size: int,
+    tile_format: str,
+    title: str,
+    opacity: float,
+) -> str:
+    min_x, min_y, max_x, max_y = bbox
+    scale = 2 ** max_zoom
+    # Leaflet CRS.Simple with a transformation that maps the bbox onto the native-zoom pixel grid.
+    a = width / (max_x - min_x) / scale
+    c = height / (max_y - min_y) / scale
+    return f"""<!doctype html>
+<html lang=\"en\">
+<head>
+  <meta charset=\"utf-8\">
+  <title>{title}</title>
+  <meta name=\"viewport\" content=\"width=device-width, initial-scale=1\">
+  <link
+    rel=\"stylesheet\"
+    href=\"https://unpkg.com/leaflet@1.9.4/dist/leaflet.css\"
+    integrity=\"sha256-p4NxAoJBhIIN+hmNHrzRCf9tD/miZyoHS5obTRR9BMY=\"
+    crossorigin=\"\"
+  />
+  <style>
+    html, body {{
+      height: 100%;
+      margin: 0;
+      font-family: "Inter", system-ui, -apple-system, sans-serif;
+    }}
+    #map {{
+      height: 100%;
+    }}
+    .controls {{
+      position: absolute;
+      top: 12px;
+      left: 12px;
+      z-index: 1000;
+      background: rgba(255, 255, 255, 0.9);
+      padding: 12px 14px;
+      border-radius: 10px;
+      box-shadow: 0 2px 10px rgba(0, 0, 0, 0.15);
+      display: grid;
+      gap: 6px;
+      min-width: 220px;
+    }}
+    .controls label {{
+      font-size: 14px;
+      color: #1d1d1f;
+    }}
+    .controls input[type=\"range\"] {{
+      width: 100%;
+    }}
+    .legend {{
+      font-size: 12px;
+      color: #444;
+    }}
+  </style>
+</head>
+<body>
+  <div class=\"controls\">
+    <label for=\"opacity\">Image opacity: <span id=\"opacity-value\">{opacity:.2f}</span></label>
+    <input id=\"opacity\" type=\"range\" min=\"0\" max=\"1\" step=\"0.05\" value=\"{opacity:.2f}\">
+    <div class=\"legend\">GeoJSON overlay is shown in red.</div>
+  </div>
+  <div id=\"map\"></div>
+  <script
+    src=\"https://unpkg.com/leaflet@1.9.4/dist/leaflet.js\"
+    integrity=\"sha256-20nQCchB9co0qIjJZRGuk2/Z9VM+kNiyxNV1lvTlZBo=\"
+    crossorigin=\"\"
+  ></script>
+  <script>
+    const nativeZoom = {max_zoom};
+    const tileSize = {tile_size};
+    const bounds = L.latLngBounds([[{min_y}, {min_x}], [{max_y}, {max_x}]]);
+    const crs = L.extend({{}}, L.CRS.Simple, {{
+      transformation: new L.Transformation({a!r}, {-min_x * a!r}, {-c!r}, {max_y * c!r}),
+    }});
+
+    const map = L.map('map', {{
+      crs,
+      minZoom: 0,
+      maxZoom: nativeZoom + 3,
+    }});
+
+    const imageLayer = L.tileLayer('tiles/{{z}}/{{x}}/{{y}}.{tile_format}', {{
+      tileSize,
+      bounds,
+      noWrap: true,
+      minZoom: 0,
+      maxZoom: nativeZoom + 3,
+      maxNativeZoom: nativeZoom,
+      opacity: {opacity:.2f},
+    }}).addTo(map);
+
+    const VectorTiles = L.GridLayer.extend({{
+      createTile(coords, done) {{
+        const tile = document.createElement('canvas');
+        const size = this.getTileSize();
+        tile.width = size.x;
+        tile.height = size.y;
+        const z = Math.min(coords.z, nativeZoom);
+        const factor = 2 ** (coords.z - z);
+        const url = `vector/${{z}}/${{Math.floor(coords.x / factor)}}/${{Math.floor(coords.y / factor)}}.json`;
+        const origin = coords.scaleBy(size);
+        fetch(url)
+          .then((response) => (response.ok ? response.json() : {{ features: [] }}))
+          .catch(() => ({{ features: [] }}))
+          .then((data) => {{
+            const ctx = tile.getContext('2d');
+            ctx.strokeStyle = 'rgba(255, 59, 48, 0.9)';
+            ctx.lineWidth = 2;
+            ctx.lineJoin = 'round';
+            const drawLine = (line) => {{
+              ctx.beginPath();
+              line.forEach(([x, y], index) => {{
+                const point = map.project([y, x], coords.z).subtract(origin);
+                if (index === 0) {{
+                  ctx.moveTo(point.x, point.y);
+                }} else {{
+                  ctx.lineTo(point.x, point.y);
+                }}
+              }});
+              ctx.stroke();
+            }};
+            for (const feature of data.features) {{
+              const geometry = feature.geometry;
+              if (geometry.type === 'LineString') {{
+                drawLine(geometry.coordinates);
+              }} else if (geometry.type === 'MultiLineString') {{
+                geometry.coordinates.forEach(drawLine);
+              }}
+            }}
+            done(null, tile);
+          }});
+        return tile;
+      }},
+    }});
+
+    const lineLayer = new VectorTiles({{ tileSize, bounds, noWrap: true }}).addTo(map);
+
+    map.fitBounds(bounds, {{ padding: [20, 20] }});
+
+    L.control.layers(
+      {{ 'Source image': imageLayer }},
+      {{ 'GeoJSON lines': lineLayer }},
+      {{ collapsed: false }}
+    ).addTo(map);
+
+    const opacityInput = document.getElementById('opacity');
+    const opacityValue = document.getElementById('opacity-value');
+
+    opacityInput.addEventListener('input', (event) => {{
+      const value = Number(event.target.value);
+      imageLayer.setOpacity(value);
+      opacityValue.textContent = value.toFixed(2);
+    }});
+  </script>
+</body>
+</html>
+"""
+
+
+def serve_directory(directory: Path, port: int) -> None:
+    handler = functools.partial(SimpleHTTPRequestHandler, directory=str(directory))
+    with ThreadingHTTPServer(("127.0.0.1", port), handler) as server:
+        print(f"Serving {directory} at http://127.0.0.1:{server.server_address[1]}/", flush=True)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+
+
 def build_html(
     image_data_url: str,
     geojson: dict,
@@ -174,6 +468,28 @@ def build_parser() -> argparse.ArgumentParser:
         default=0.65,
         help="Initial opacity for the image overlay (default: 0.65)",
     )
+    parser.add_argument(
+        "--tiles-dir",
+        help="Write a tiled viewer (index.html, image pyramid, vector tiles) into this directory instead of --output",
+    )
+    parser.add_argument(
+        "--tile-size",
+        type=int,
+        default=TILE_SIZE,
+        help=f"Tile size in pixels for --tiles-dir (default: {TILE_SIZE})",
+    )
+    parser.add_argument(
+        "--tile-format",
+        choices=["png", "jpg"],
+        default="png",
+        help="Image tile encoding for --tiles-dir; jpg is faster and smaller but has no transparency (default: png)",
+    )
+    parser.add_argument(
+        "--serve",
+        type=int,
+        metavar="PORT",
+        help="Serve the tiled viewer on 127.0.0.1:PORT after writing it",
+    )
     parser.add_argument(
         "--crs",
         choices=["simple", "epsg4326", "epsg3857"],
@@ -201,6 +517,29 @@ def main() -> int:
     image = cv2.imread(str(image_path), cv2.IMREAD_COLOR)
     if image is None:
         raise ValueError(f"Failed to read image at '{image_path}'.")
+
+    if args.tiles_dir:
+        if args.crs != "simple":
+            raise ValueError("--tiles-dir only supports --crs simple")
+        tiles_dir = Path(args.tiles_dir)
+        # Empty tiles are skipped rather than written, so a previous run's tiles would otherwise survive.
+        for layer in ("tiles", "vector"):
+            shutil.rmtree(tiles_dir / layer, ignore_errors=True)
+        height, width = image.shape[:2]
+        max_zoom = native_zoom(width, height, args.tile_size)
+        write_image_pyramid(image, tiles_dir, max_zoom, args.tile_size, args.tile_format)
+        write_vector_tiles(geojson, bbox, width, height, tiles_dir, max_zoom, args.tile_size)
+        html = build_tiled_html(
+            bbox, width, height, max_zoom, args.tile_size, args.tile_format, args.title, args.opacity
+        )
+        (tiles_dir / "index.html").write_text(html, encoding="utf-8")
+        print(f"Overlay written to {tiles_dir}", flush=True)
+        if args.serve is not None:
+            serve_directory(tiles_dir, args.serve)
+        return 0
+
+    if args.serve is not None:
+        raise ValueError("--serve requires --tiles-dir")
     image_data_url = f"data:image/png;base64,{encode_png(image)}"
     html = build_html(image_data_url, geojson, bbox, args.title, args.opacity, args.crs)
 
@@ -0,0 +1,71 @@
+from __future__ import annotations
+
+import io
+import json
+import os
+import sys
+import traceback
+from contextlib import redirect_stderr, redirect_stdout
+from pathlib import Path
+from typing import Callable, List, Sequence, Tuple
+
+from extractors.line_detection.pipeline_utils import reset_process_state
+from extractors.line_detection.profiling import run_profiled
+
+WORKER_FLAG = "--persistent_worker"
+
+
+def expand_arguments(arguments: Sequence[str]) -> List[str]:
+    # Bazel passes "@params" files (one argument per line) when the rule uses a param file.
+    expanded: List[str] = []
+    for argument in arguments:
+        if argument.startswith("@") and not argument.startswith("@@"):
+            expanded.extend(Path(argument[1:]).read_text(encoding="utf-8").splitlines())
+        else:
+            expanded.append(argument)
+    return expanded
+
+
+def run_request(main: Callable[[], int], program: str, arguments: Sequence[str]) -> Tuple[int, str]:
+    output = io.StringIO()
+    sys.argv = [program, *expand_arguments(arguments)]
+    # Anything the stage seeds or caches at import time must look fresh to every action.
+    reset_process_state()
+    with redirect_stdout(output), redirect_stderr(output):
+        try:
+            exit_code = run_profiled(main)
+        except SystemExit as exc:  # argparse errors and explicit exits
+            if isinstance(exc.code, int) or exc.code is None:
+                exit_code = exc.code or 0
+            else:
+                print(exc.code)
+                exit_code = 1
+        except Exception:
+            traceback.print_exc()
+            exit_code = 1
+    return int(exit_code or 0), output.getvalue()
+
+
+def serve_worker(main: Callable[[], int]) -> int:
+    # JSON persistent-worker protocol: one WorkRequest per line on stdin, one WorkResponse per line on stdout.
+    # Keep a private handle on the real stdout and point fd 1 at stderr, so native
+    # libraries printing to stdout cannot corrupt the response stream.
+    protocol = os.fdopen(os.dup(sys.stdout.fileno()), "w", encoding="utf-8")
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+    program = sys.argv[0]
+    for line in sys.stdin:
+        if not line.strip():
+            continue
+        request = json.loads(line)
+        exit_code, output = run_request(main, program, request.get("arguments", []))
+        response = {"exitCode": exit_code, "output": output, "requestId": request.get("requestId", 0)}
+        protocol.write(json.dumps(response) + "\n")
+        protocol.flush()
+    return 0
+
+
+def run_stage(main: Callable[[], int]) -> int:
+    if WORKER_FLAG in sys.argv[1:]:
+        return serve_worker(main)
+    sys.argv = [sys.argv[0], *expand_arguments(sys.argv[1:])]
+    return run_profiled(main)
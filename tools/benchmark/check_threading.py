@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""Check that every threaded OpenCV operation is bit-identical across thread counts.
+
+Each operation in THREADED_OPERATIONS runs sequentially and then under every
+requested thread count on a synthetic sheet, with the parameters the stages use.
+Any output that differs fails the check (exit code 1).
+
+Example:
+  python tools/benchmark/check_threading.py --size 4096 --threads 2,8,64 --repeat 3
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import sys
+import time
+from typing import Callable, Dict, List, Sequence
+
+import cv2
+import numpy as np
+
+from extractors.line_detection.pipeline_utils import THREADED_OPERATIONS, build_kernel
+from tools.benchmark.synthetic_map import generate_map
+
+Operation = Callable[[np.ndarray, np.ndarray, np.ndarray], object]
+
+OPERATIONS: Dict[str, Operation] = {
+    "adaptiveThreshold": lambda image, gray, mask: cv2.adaptiveThreshold(
+        gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY, 31, 2.0
+    ),
+    "bilateralFilter": lambda image, gray, mask: cv2.bilateralFilter(gray, 5, 10, 2),
+    "Canny": lambda image, gray, mask: cv2.Canny(mask, 50, 150),
+    "CLAHE": lambda image, gray, mask: cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8)).apply(gray),
+    "connectedComponents": lambda image, gray, mask: cv2.connectedComponentsWithStats(
+        mask, connectivity=8, ltype=cv2.CV_32S
+    ),
+    "cvtColor": lambda image, gray, mask: [
+        cv2.cvtColor(image, code) for code in (cv2.COLOR_BGR2HSV, cv2.COLOR_BGR2LAB, cv2.COLOR_BGR2GRAY)
+    ],
+    "dilate": lambda image, gray, mask: cv2.dilate(mask, np.ones((3, 3), dtype=np.uint8)),
+    "distanceTransform": lambda image, gray, mask: cv2.distanceTransform(255 - mask, cv2.DIST_L2, 3),
+    "erode": lambda image, gray, mask: cv2.erode(mask, cv2.getStructuringElement(cv2.MORPH_CROSS, (3, 3))),
+    "GaussianBlur": lambda image, gray, mask: [cv2.GaussianBlur(gray, (3, 3), 0), cv2.GaussianBlur(mask, (9, 9), 2)],
+    "inRange": lambda image, gray, mask: cv2.inRange(image, np.array([100, 50, 50]), np.array([140, 255, 255])),
+    "LUT": lambda image, gray, mask: cv2.LUT(gray, np.arange(256, dtype=np.uint8)[::-1].copy()),
+    "medianBlur": lambda image, gray, mask: cv2.medianBlur(gray, 3),
+    "morphologyEx": lambda image, gray, mask: [
+        cv2.morphologyEx(mask, cv2.MORPH_CLOSE, build_kernel("ellipse", 3), iterations=2),
+        cv2.morphologyEx(mask, cv2.MORPH_OPEN, build_kernel("ellipse", 3)),
+    ],
+    "resize": lambda image, gray, mask: cv2.resize(image, None, fx=0.3, fy=0.3, interpolation=cv2.INTER_AREA),
+    "threshold": lambda image, gray, mask: cv2.threshold(gray, 120, 255, cv2.THRESH_BINARY)[1],
+}
+
+
+def flatten(result: object) -> List[np.ndarray]:
+    if isinstance(result, (list, tuple)):
+        return [array for item in result for array in flatten(item)]
+    return [np.asarray(result)]
+
+
+def identical(reference: Sequence[np.ndarray], candidate: Sequence[np.ndarray]) -> bool:
+    return len(reference) == len(candidate) and all(
+        a.dtype == b.dtype and a.shape == b.shape and a.tobytes() == b.tobytes() for a, b in zip(reference, candidate)
+    )
+
+
+def parse_threads(value: str) -> List[int]:
+    counts = [int(item) for item in value.split(",") if item.strip()]
+    if not counts or min(counts) < 2:
+        raise argparse.ArgumentTypeError("Thread counts must be integers >= 2")
+    return counts
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size", type=int, default=2048, help="Synthetic sheet edge in pixels")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--threads",
+        type=parse_threads,
+        default=[2, 4, max(os.cpu_count() or 1, 8)],
+        help="Comma-separated thread counts to compare against the sequential run",
+    )
+    parser.add_argument("--repeat", type=int, default=2, help="Runs per thread count")
+    return parser
+
+
+def main() -> int:
+    args = build_parser().parse_args()
+    missing = sorted(THREADED_OPERATIONS - set(OPERATIONS))
+    if missing:
+        print(f"No check for threaded operations: {', '.join(missing)}", file=sys.stderr)
+        return 1
+    synthetic = generate_map((args.size, args.size), args.seed)
+    image = synthetic.image
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    mask = cv2.inRange(cv2.cvtColor(image, cv2.COLOR_BGR2HSV), np.array([90, 40, 40]), np.array([150, 255, 255]))
+
+    failures = 0
+    for name in sorted(THREADED_OPERATIONS, key=str.lower):
+        operation = OPERATIONS[name]
+        cv2.setNumThreads(0)
+        reference = flatten(operation(image, gray, mask))
+        start = time.perf_counter()
+        operation(image, gray, mask)
+        sequential = time.perf_counter() - start
+        timings = []
+        for threads in args.threads:
+            cv2.setNumThreads(threads)
+            start = time.perf_counter()
+            same = all(identical(reference, flatten(operation(image, gray, mask))) for _ in range(args.repeat))
+            timings.append(f"{threads}t {(time.perf_counter() - start) / args.repeat:.3f}s")
+            if not same:
+                failures += 1
+                print(f"FAIL {name}: output differs with {threads} threads")
+        cv2.setNumThreads(0)
+        print(f"{name:<20} 1t {sequential:.3f}s  " + "  ".join(timings))
+    if failures:
+        return 1
+    print(f"All {len(THREADED_OPERATIONS)} threaded operations are bit-identical across thread counts.")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
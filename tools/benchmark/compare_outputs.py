@@ -0,0 +1,289 @@
+#!/usr/bin/env python3
+"""Compare two runs of a line-detection stage, or a run against ground truth.
+
+Masks (.png) are compared exactly and by pixel IoU. GeoJSON line outputs are
+compared by buffered-overlap precision/recall, Hausdorff distance and
+feature/vertex counts. Directories are compared file by file.
+
+Example:
+  python tools/benchmark/compare_outputs.py before/ after/ --min-iou 1.0 --max-hausdorff 0
+  python tools/benchmark/compare_outputs.py ground_truth.geojson final.geojson \
+    --tolerance 3 --min-precision 0.9 --min-recall 0.9
+"""
+from __future__ import annotations
+
+import argparse
+import json
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+MASK_SUFFIXES = {".png", ".tif", ".tiff"}
+GEOJSON_SUFFIXES = {".geojson"}
+# Lines are rasterized for distance lookups; this caps the raster's longer side.
+MAX_RASTER_SIZE = 8192
+# Points are sampled along every segment at most this many raster cells apart.
+SAMPLE_SPACING = 0.5
+
+
+def load_raster(path: Path) -> np.ndarray:
+    image = cv2.imread(str(path), cv2.IMREAD_UNCHANGED)
+    if image is None:
+        raise ValueError(f"Failed to load raster: {path}")
+    return image
+
+
+def compare_masks(reference: np.ndarray, candidate: np.ndarray) -> dict:
+    if reference.shape != candidate.shape:
+        return {"kind": "mask", "identical": False, "shape_mismatch": [list(reference.shape), list(candidate.shape)]}
+    differing = int(np.count_nonzero(reference != candidate))
+    reference_on = reference > 0 if reference.ndim == 2 else np.any(reference > 0, axis=2)
+    candidate_on = candidate > 0 if candidate.ndim == 2 else np.any(candidate > 0, axis=2)
+    union = int(np.count_nonzero(reference_on | candidate_on))
+    intersection = int(np.count_nonzero(reference_on & candidate_on))
+    return {
+        "kind": "mask",
+        "identical": differing == 0,
+        "differing_pixels": differing,
+        "reference_pixels": int(np.count_nonzero(reference_on)),
+        "candidate_pixels": int(np.count_nonzero(candidate_on)),
+        "iou": intersection / union if union else 1.0,
+    }
+
+
+def iter_line_arrays(geometry: Optional[dict]) -> Iterator[np.ndarray]:
+    if not geometry:
+        return
+    kind = geometry.get("type")
+    if kind == "LineString":
+        coords = np.asarray(geometry["coordinates"], dtype=np.float64)
+        if coords.ndim == 2 and coords.shape[0] >= 2:
+            yield coords[:, :2]
+    elif kind == "MultiLineString":
+        for part in geometry["coordinates"]:
+            yield from iter_line_arrays({"type": "LineString", "coordinates": part})
+    elif kind == "GeometryCollection":
+        for child in geometry.get("geometries", []):
+            yield from iter_line_arrays(child)
+
+
+def load_lines(path: Path) -> Tuple[List[np.ndarray], int]:
+    payload = json.loads(path.read_text(encoding="utf-8"))
+    features = payload.get("features", []) if payload.get("type") == "FeatureCollection" else [payload]
+    lines = [coords for feature in features for coords in iter_line_arrays(feature.get("geometry"))]
+    return lines, len(features)
+
+
+def segment_samples(lines: List[np.ndarray], spacing: float) -> Tuple[np.ndarray, np.ndarray]:
+    """Return points sampled along every segment and the line length each one stands for."""
+    if not lines:
+        return np.empty((0, 2)), np.empty(0)
+    starts = np.concatenate([line[:-1] for line in lines])
+    ends = np.concatenate([line[1:] for line in lines])
+    lengths = np.hypot(*(ends - starts).T)
+    counts = np.maximum(np.ceil(lengths / spacing).astype(np.int64), 1)
+    owner = np.repeat(np.arange(starts.shape[0]), counts)
+    # Midpoints of `count` equal sub-segments, so each sample carries length / count.
+    offsets = np.arange(owner.shape[0]) - np.repeat(np.cumsum(counts) - counts, counts)
+    fractions = (offsets + 0.5) / counts[owner]
+    points = starts[owner] + (ends[owner] - starts[owner]) * fractions[:, np.newaxis]
+    return points, (lengths / counts)[owner]
+
+
+class LineRaster:
+    def __init__(self, samples: np.ndarray, origin: np.ndarray, scale: float, shape: Tuple[int, int]):
+        self.origin = origin
+        self.scale = scale
+        mask = np.full(shape, 255, dtype=np.uint8)
+        # Burn the same samples that are looked up, so identical inputs measure exactly zero.
+        cells = self.to_cells(samples).astype(np.int64)
+        mask[cells[:, 1], cells[:, 0]] = 0
+        # Distance (in cells) from every cell to the nearest rasterized line.
+        self.distance = cv2.distanceTransform(mask, cv2.DIST_L2, cv2.DIST_MASK_PRECISE)
+
+    def to_cells(self, points: np.ndarray) -> np.ndarray:
+        return np.rint((points - self.origin) * self.scale)
+
+    def lookup(self, points: np.ndarray) -> np.ndarray:
+        cells = self.to_cells(points).astype(np.int64)
+        height, width = self.distance.shape
+        cells[:, 0] = np.clip(cells[:, 0], 0, width - 1)
+        cells[:, 1] = np.clip(cells[:, 1], 0, height - 1)
+        return self.distance[cells[:, 1], cells[:, 0]] / self.scale
+
+
+def directed_stats(raster: LineRaster, points: np.ndarray, weights: np.ndarray, tolerance: float) -> dict:
+    if points.shape[0] == 0:
+        return {"within_tolerance": 1.0, "hausdorff": 0.0, "mean_distance": 0.0}
+    distances = raster.lookup(points)
+    total = float(weights.sum())
+    return {
+        "within_tolerance": float(weights[distances <= tolerance].sum() / total) if total else 1.0,
+        "hausdorff": float(distances.max()),
+        "mean_distance": float(np.average(distances, weights=weights)) if total else 0.0,
+    }
+
+
+def compare_lines(
+    reference: List[np.ndarray],
+    candidate: List[np.ndarray],
+    tolerance: float,
+    resolution: Optional[float],
+) -> dict:
+    if not reference or not candidate:
+        # Nothing to measure against: an empty side is perfect only when the other is empty too.
+        return {
+            "precision": 1.0 if not candidate else 0.0,
+            "recall": 1.0 if not reference else 0.0,
+            "hausdorff": 0.0 if not reference and not candidate else float("inf"),
+        }
+    points = np.concatenate(reference + candidate)
+    minimum = points.min(axis=0)
+    extent = float(max((points.max(axis=0) - minimum).max(), 1e-9))
+    # By default the longer side spans MAX_RASTER_SIZE cells whatever the world units are, so
+    # sheets in degrees get the same cell count as sheets in pixels or metres.
+    scale = 1.0 / resolution if resolution else (MAX_RASTER_SIZE - 1) / extent
+    margin = 2.0 / scale
+    origin = minimum - margin
+    width, height = (np.ceil((points.max(axis=0) - origin + margin) * scale).astype(int) + 1).tolist()
+
+    spacing = SAMPLE_SPACING / scale
+    reference_points, reference_weights = segment_samples(reference, spacing)
+    candidate_points, candidate_weights = segment_samples(candidate, spacing)
+    reference_raster = LineRaster(reference_points, origin, scale, (height, width))
+    candidate_raster = LineRaster(candidate_points, origin, scale, (height, width))
+    to_reference = directed_stats(reference_raster, candidate_points, candidate_weights, tolerance)
+    to_candidate = directed_stats(candidate_raster, reference_points, reference_weights, tolerance)
+    return {
+        # Precision: share of candidate length inside the reference buffer; recall is the converse.
+        "precision": to_reference["within_tolerance"],
+        "recall": to_candidate["within_tolerance"],
+        "hausdorff": max(to_reference["hausdorff"], to_candidate["hausdorff"]),
+        "hausdorff_candidate_to_reference": to_reference["hausdorff"],
+        "hausdorff_reference_to_candidate": to_candidate["hausdorff"],
+        "mean_distance_candidate_to_reference": to_reference["mean_distance"],
+        "mean_distance_reference_to_candidate": to_candidate["mean_distance"],
+        # Distances are quantized to the raster cell size.
+        "cell_size": 1.0 / scale,
+    }
+
+
+def compare_geojson(reference_path: Path, candidate_path: Path, tolerance: float, resolution: Optional[float]) -> dict:
+    reference, reference_features = load_lines(reference_path)
+    candidate, candidate_features = load_lines(candidate_path)
+    result = {
+        "kind": "geojson",
+        "reference_features": reference_features,
+        "candidate_features": candidate_features,
+        "reference_vertices": int(sum(line.shape[0] for line in reference)),
+        "candidate_vertices": int(sum(line.shape[0] for line in candidate)),
+        "reference_length": float(sum(np.hypot(*np.diff(line, axis=0).T).sum() for line in reference)),
+        "candidate_length": float(sum(np.hypot(*np.diff(line, axis=0).T).sum() for line in candidate)),
+        "tolerance": tolerance,
+    }
+    result.update(compare_lines(reference, candidate, tolerance, resolution))
+    return result
+
+
+def compare_paths(reference: Path, candidate: Path, args: argparse.Namespace) -> Optional[dict]:
+    suffix = reference.suffix.lower()
+    if suffix in MASK_SUFFIXES:
+        return compare_masks(load_raster(reference), load_raster(candidate))
+    if suffix in GEOJSON_SUFFIXES:
+        return compare_geojson(reference, candidate, args.tolerance, args.resolution)
+    return None
+
+
+def pair_files(reference: Path, candidate: Path) -> Iterator[Tuple[str, Path, Path]]:
+    if reference.is_file():
+        yield reference.name, reference, candidate
+        return
+    for path in sorted(reference.rglob("*")):
+        if path.is_file() and path.suffix.lower() in MASK_SUFFIXES | GEOJSON_SUFFIXES:
+            relative = path.relative_to(reference)
+            yield str(relative), path, candidate / relative
+
+
+def check_thresholds(result: dict, args: argparse.Namespace) -> List[str]:
+    failures = []
+    if result["kind"] == "mask":
+        if "shape_mismatch" in result:
+            return ["shape mismatch"]
+        if result["iou"] < args.min_iou:
+            failures.append(f"IoU {result['iou']:.6f} < {args.min_iou}")
+        return failures
+    if result["precision"] < args.min_precision:
+        failures.append(f"precision {result['precision']:.4f} < {args.min_precision}")
+    if result["recall"] < args.min_recall:
+        failures.append(f"recall {result['recall']:.4f} < {args.min_recall}")
+    if args.max_hausdorff is not None and result["hausdorff"] > args.max_hausdorff:
+        failures.append(f"Hausdorff {result['hausdorff']:.3f} > {args.max_hausdorff}")
+    if args.exact_counts and (
+        result["reference_features"] != result["candidate_features"]
+        or result["reference_vertices"] != result["candidate_vertices"]
+    ):
+        failures.append("feature/vertex counts differ")
+    return failures
+
+
+def format_result(name: str, result: dict) -> str:
+    if result["kind"] == "mask":
+        if "shape_mismatch" in result:
+            return f"{name}: shape mismatch {result['shape_mismatch']}"
+        return f"{name}: identical={result['identical']} iou={result['iou']:.6f} differing={result['differing_pixels']}"
+    return (
+        f"{name}: precision={result['precision']:.4f} recall={result['recall']:.4f} "
+        f"hausdorff={result['hausdorff']:.3f} features={result['reference_features']}->{result['candidate_features']} "
+        f"vertices={result['reference_vertices']}->{result['candidate_vertices']}"
+    )
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Compare stage outputs (masks and GeoJSON) between two runs.")
+    parser.add_argument("reference", help="Reference file or directory (baseline run or ground truth)")
+    parser.add_argument("candidate", help="Candidate file or directory")
+    parser.add_argument("--tolerance", type=float, default=1.5, help="Buffer distance for GeoJSON precision/recall")
+    parser.add_argument("--resolution", type=float, help="World units per raster cell for distance lookups")
+    parser.add_argument("--min-iou", type=float, default=1.0)
+    parser.add_argument("--min-precision", type=float, default=1.0)
+    parser.add_argument("--min-recall", type=float, default=1.0)
+    parser.add_argument("--max-hausdorff", type=float, help="Maximum symmetric Hausdorff distance")
+    parser.add_argument("--exact-counts", action="store_true", help="Require identical feature and vertex counts")
+    parser.add_argument("--output-json", help="Write all comparison results as JSON")
+    return parser
+
+
+def main() -> int:
+    args = build_parser().parse_args()
+    reference = Path(args.reference)
+    candidate = Path(args.candidate)
+    if not reference.exists():
+        raise ValueError(f"Reference does not exist: {reference}")
+
+    results: Dict[str, dict] = {}
+    failed = False
+    for name, reference_path, candidate_path in pair_files(reference, candidate):
+        if not candidate_path.exists():
+            results[name] = {"kind": "missing"}
+            print(f"{name}: missing from candidate")
+            failed = True
+            continue
+        result = compare_paths(reference_path, candidate_path, args)
+        if result is None:
+            raise ValueError(f"Unsupported file type: {reference_path}")
+        result["failures"] = check_thresholds(result, args)
+        results[name] = result
+        failed = failed or bool(result["failures"])
+        print(format_result(name, result) + ("" if not result["failures"] else "  FAIL: " + "; ".join(result["failures"])))
+
+    if args.output_json:
+        output_path = Path(args.output_json)
+        output_path.parent.mkdir(parents=True, exist_ok=True)
+        output_path.write_text(json.dumps(results, indent=2), encoding="utf-8")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""Compare the sample pipeline's outputs between a git revision and the working tree.
+
+Builds the sample targets twice: once in a temporary worktree checked out at
+--reference (default HEAD), once in this checkout. Then it runs
+compare_outputs.py over the two package output directories. Options not listed
+here are passed on to compare_outputs.py. Without any, every mask must be
+identical and every GeoJSON must match exactly.
+
+Example:
+  python tools/benchmark/compare_sample.py
+  python tools/benchmark/compare_sample.py --reference main --tolerance 1.5 \
+    --min-precision 0.99 --min-recall 0.99
+"""
+from __future__ import annotations
+
+import argparse
+import shutil
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+from typing import List
+
+REPO_ROOT = Path(__file__).resolve().parents[2]
+COMPARE_OUTPUTS = Path(__file__).resolve().parent / "compare_outputs.py"
+SAMPLE_TARGET = "//data/line_detection/cam_waterlines:all"
+EXACT = ["--min-iou", "1.0", "--min-precision", "1.0", "--min-recall", "1.0", "--max-hausdorff", "0", "--exact-counts"]
+
+
+def target_package(target: str) -> str:
+    if not target.startswith("//"):
+        raise ValueError(f"Target must be an absolute label, got '{target}'")
+    return target[2:].split(":", 1)[0]
+
+
+def build_outputs(bazel: str, workspace: Path, target: str, destination: Path) -> None:
+    subprocess.run([bazel, "build", target], cwd=workspace, check=True)
+    bazel_bin = subprocess.run(
+        [bazel, "info", "bazel-bin"], cwd=workspace, check=True, capture_output=True, text=True
+    ).stdout.strip()
+    # Copied out (following symlinks) so the second build cannot touch the first one's files.
+    shutil.rmtree(destination, ignore_errors=True)
+    shutil.copytree(Path(bazel_bin) / target_package(target), destination)
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--reference", default="HEAD", help="Git revision to compare the working tree against")
+    parser.add_argument("--target", default=SAMPLE_TARGET, help="Sample targets to build")
+    parser.add_argument("--bazel", default="bazel", help="Bazel (or bazelisk) executable")
+    parser.add_argument("--keep", help="Keep both output trees in this directory")
+    return parser
+
+
+def main() -> int:
+    args, compare_args = build_parser().parse_known_args()
+    with tempfile.TemporaryDirectory(prefix="line_sample_") as scratch:
+        root = Path(args.keep) if args.keep else Path(scratch)
+        worktree = Path(scratch) / "worktree"
+        subprocess.run(
+            ["git", "worktree", "add", "--detach", str(worktree), args.reference], cwd=REPO_ROOT, check=True
+        )
+        try:
+            build_outputs(args.bazel, worktree, args.target, root / "reference")
+        finally:
+            # The worktree's Bazel server would otherwise outlive it.
+            subprocess.run([args.bazel, "shutdown"], cwd=worktree, check=False)
+            subprocess.run(["git", "worktree", "remove", "--force", str(worktree)], cwd=REPO_ROOT, check=False)
+        build_outputs(args.bazel, REPO_ROOT, args.target, root / "candidate")
+
+        command: List[str] = [
+            sys.executable,
+            str(COMPARE_OUTPUTS),
+            str(root / "reference"),
+            str(root / "candidate"),
+            *(compare_args or EXACT),
+        ]
+        return subprocess.run(command).returncode
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,364 @@
+#!/usr/bin/env python3
+"""Benchmark every line-detection stage on synthetic maps.
+
+Each stage runs as its own process, exactly as the Bazel actions do, so peak
+RSS is isolated per stage. Wall and CPU time cover the stage's main() only
+(see time_main.py); interpreter start-up and imports are reported separately.
+
+Example:
+  python tools/benchmark/run_benchmark.py --sizes 1024,4096 \
+    --history benchmarks/history.json --baseline benchmarks/baseline.json
+"""
+from __future__ import annotations
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence
+
+REPO_ROOT = Path(__file__).resolve().parents[2]
+LINE_DETECTION = REPO_ROOT / "extractors" / "line_detection"
+SYNTHETIC_MAP = Path(__file__).resolve().parent / "synthetic_map.py"
+COMPARE_OUTPUTS = Path(__file__).resolve().parent / "compare_outputs.py"
+TIME_MAIN = Path(__file__).resolve().parent / "time_main.py"
+# Stage outputs scored against the synthetic ground truth when --check-accuracy is set.
+ACCURACY_OUTPUTS = {"topology": "final.geojson", "detect_lines": "detect_lines.geojson"}
+ACCURACY_KEYS = ("precision", "recall", "hausdorff", "candidate_features", "candidate_vertices")
+
+STAGES = ("segment", "binarize", "morphology", "artifact", "skeleton", "vectorize", "topology", "detect_lines")
+
+
+@dataclass(frozen=True)
+class StageRun:
+    stage: str
+    wall_seconds: float
+    cpu_seconds: float
+    process_seconds: float
+    peak_rss_bytes: int
+    steps: Optional[list]
+
+
+def stage_commands(work: Path, width: int, height: int) -> Dict[str, List[str]]:
+    # Parameters mirror data/line_detection/cam_waterlines so timings reflect the real pipeline.
+    image = str(work / "map.png")
+    bbox = ["0", "0", str(width), str(height)]
+    return {
+        "segment": [
+            str(LINE_DETECTION / "segment" / "segment_lines.py"),
+            "--image", image,
+            "--lower", "100,50,50", "--upper", "140,255,255",
+            "--aggressive-lower", "90,40,40", "--aggressive-upper", "150,255,255",
+            "--output-conservative", str(work / "conservative.png"),
+            "--output-aggressive", str(work / "aggressive.png"),
+            "--output-merged", str(work / "merged.png"),
+            "--output-debug", str(work / "segment_debug.png"),
+            "--output-metrics", str(work / "segment_metrics.json"),
+        ],
+        "binarize": [
+            str(LINE_DETECTION / "binarize" / "binarize_mask.py"),
+            "--image", image,
+            "--mask", str(work / "merged.png"),
+            "--output", str(work / "binary.png"),
+            "--output-debug", str(work / "binarize_debug.png"),
+            "--output-metrics", str(work / "binarize_metrics.json"),
+        ],
+        "morphology": [
+            str(LINE_DETECTION / "morphology" / "morphology_filter.py"),
+            "--mask", str(work / "binary.png"),
+            "--do-close",
+            "--output", str(work / "morphology.png"),
+            "--output-debug", str(work / "morphology_debug.png"),
+            "--output-stats", str(work / "morphology_stats.json"),
+            "--output-metrics", str(work / "morphology_metrics.json"),
+        ],
+        "artifact": [
+            str(LINE_DETECTION / "artifact" / "artifact_mask.py"),
+            "--mask", str(work / "morphology.png"),
+            "--detect-grid", "--grid-min-length", "140",
+            "--detect-circles", "--circle-min-radius", "40", "--circle-max-radius", "180", "--circle-param2", "35",
+            "--output", str(work / "artifacts.png"),
+            "--output-debug", str(work / "artifact_debug.png"),
+            "--output-metrics", str(work / "artifact_metrics.json"),
+        ],
+        "skeleton": [
+            str(LINE_DETECTION / "skeleton" / "skeletonize_mask.py"),
+            "--mask", str(work / "artifacts.png"),
+            "--prune-spurs", "4",
+            "--output", str(work / "skeleton.png"),
+            "--output-debug", str(work / "skeleton_debug.png"),
+            "--output-metrics", str(work / "skeleton_metrics.json"),
+        ],
+        "vectorize": [
+            str(LINE_DETECTION / "vectorize" / "vectorize_skeleton.py"),
+            "--mask", str(work / "skeleton.png"),
+            "--bbox", *bbox,
+            "--min-path-length", "10", "--gap-bridge", "1.5",
+            "--output", str(work / "raw.geojson"),
+            "--output-debug", str(work / "vectorize_debug.png"),
+            "--output-stats", str(work / "vectorize_stats.json"),
+            "--output-metrics", str(work / "vectorize_metrics.json"),
+        ],
+        "topology": [
+            str(LINE_DETECTION / "topology" / "topology_cleanup.py"),
+            "--input", str(work / "raw.geojson"),
+            "--spur-length", "5.0", "--snap-tolerance", "1.0", "--simplify", "0.3",
+            "--output", str(work / "final.geojson"),
+            "--output-debug", str(work / "topology_debug.json"),
+            "--output-metrics", str(work / "topology_metrics.json"),
+        ],
+        "detect_lines": [
+            str(LINE_DETECTION / "detect_lines.py"),
+            "--image", image,
+            "--bbox", *bbox,
+            "--polygon", f"0,0 {width},0 {width},{height} 0,{height}",
+            "--output", str(work / "detect_lines.geojson"),
+        ],
+    }
+
+
+def load_stage_steps(path: Path) -> Optional[list]:
+    if not path.exists():
+        return None
+    payload = json.loads(path.read_text(encoding="utf-8"))
+    metrics = payload.get("metrics", payload)
+    return metrics.get("steps") if isinstance(metrics, dict) else None
+
+
+def run_stage(stage: str, command: Sequence[str], work: Path, timed: bool = False) -> StageRun:
+    # Children inherit the parent's RSS high-water mark across fork/exec, so this
+    # process must stay small: maps are generated and OpenCV is imported in subprocesses.
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [str(REPO_ROOT), os.environ.get("PYTHONPATH")])))
+    timing_path = work / f"{stage}_timing.json"
+    if timed:
+        command = [str(TIME_MAIN), str(timing_path), *command]
+    with tempfile.TemporaryFile() as log:
+        start = time.perf_counter()
+        process = subprocess.Popen([sys.executable, *command], stdout=log, stderr=subprocess.STDOUT, env=env)
+        # wait4 reports the rusage of this one child, so peak RSS is not shared across stages.
+        _, status, usage = os.wait4(process.pid, 0)
+        wall = time.perf_counter() - start
+        process.returncode = os.waitstatus_to_exitcode(status)
+        if process.returncode != 0:
+            log.seek(0)
+            output = log.read().decode("utf-8", errors="replace")
+            raise RuntimeError(f"Stage {stage} failed with exit code {process.returncode}:\n{output}")
+    peak = usage.ru_maxrss if sys.platform == "darwin" else usage.ru_maxrss * 1024
+    timing = json.loads(timing_path.read_text(encoding="utf-8")) if timed else {}
+    return StageRun(
+        stage=stage,
+        wall_seconds=timing.get("wall_seconds", wall),
+        cpu_seconds=timing.get("cpu_seconds", usage.ru_utime + usage.ru_stime),
+        process_seconds=wall,
+        peak_rss_bytes=int(peak),
+        steps=load_stage_steps(work / f"{stage}_metrics.json"),
+    )
+
+
+def score_output(stage: str, work: Path, tolerance: float) -> dict:
+    report = work / f"{stage}_accuracy.json"
+    command = [
+        str(COMPARE_OUTPUTS),
+        str(work / "ground_truth.geojson"),
+        str(work / ACCURACY_OUTPUTS[stage]),
+        "--tolerance", str(tolerance),
+        "--min-precision", "0", "--min-recall", "0",
+        "--output-json", str(report),
+    ]
+    run_stage("compare", command, work)
+    result = next(iter(json.loads(report.read_text(encoding="utf-8")).values()))
+    return {key: result[key] for key in ACCURACY_KEYS}
+
+
+def benchmark_size(
+    size: int,
+    seed: int,
+    stages: Sequence[str],
+    repeat: int,
+    work: Path,
+    accuracy_tolerance: Optional[float],
+) -> List[dict]:
+    generate = [
+        str(SYNTHETIC_MAP),
+        "--size", str(size),
+        "--seed", str(seed),
+        "--output", str(work / "map.png"),
+        "--output-geojson", str(work / "ground_truth.geojson"),
+        "--output-mask", str(work / "ground_truth.png"),
+    ]
+    run_stage("generate", generate, work)
+
+    megapixels = size * size / 1e6
+    commands = stage_commands(work, size, size)
+    results = []
+    for stage in stages:
+        # Best-of-N damps scheduler noise; peak RSS is the worst seen.
+        runs = [run_stage(stage, commands[stage], work, timed=True) for _ in range(repeat)]
+        best = min(runs, key=lambda run: run.wall_seconds)
+        results.append({
+            "size": size,
+            "stage": stage,
+            "megapixels": round(megapixels, 3),
+            "wall_seconds": round(best.wall_seconds, 4),
+            "cpu_seconds": round(best.cpu_seconds, 4),
+            "process_seconds": round(best.process_seconds, 4),
+            "megapixels_per_second": round(megapixels / best.wall_seconds, 3),
+            "peak_rss_bytes": max(run.peak_rss_bytes for run in runs),
+            "steps": best.steps,
+        })
+        if accuracy_tolerance is not None and stage in ACCURACY_OUTPUTS:
+            results[-1]["accuracy"] = score_output(stage, work, accuracy_tolerance)
+        print(
+            f"{size:>6} {stage:<13} {best.wall_seconds:>9.3f}s {megapixels / best.wall_seconds:>9.2f} MP/s "
+            f"{results[-1]['peak_rss_bytes'] / 2**20:>9.1f} MB  (+{best.process_seconds - best.wall_seconds:.2f}s start-up)",
+            flush=True,
+        )
+    return results
+
+
+def command_output(command: Sequence[str]) -> Optional[str]:
+    try:
+        return subprocess.run(command, cwd=REPO_ROOT, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def find_regressions(
+    results: Sequence[dict],
+    baseline: dict,
+    max_slowdown: float,
+    max_memory_growth: float,
+    max_accuracy_drop: float,
+) -> List[str]:
+    reference = {(entry["size"], entry["stage"]): entry for entry in baseline.get("results", [])}
+    regressions = []
+    for entry in results:
+        previous = reference.get((entry["size"], entry["stage"]))
+        if previous is None:
+            continue
+        label = f"{entry['stage']} @ {entry['size']}"
+        floor = previous["megapixels_per_second"] * (1.0 - max_slowdown)
+        if entry["megapixels_per_second"] < floor:
+            regressions.append(
+                f"{label}: {entry['megapixels_per_second']:.2f} MP/s < baseline "
+                f"{previous['megapixels_per_second']:.2f} MP/s"
+            )
+        ceiling = previous["peak_rss_bytes"] * (1.0 + max_memory_growth)
+        if entry["peak_rss_bytes"] > ceiling:
+            regressions.append(
+                f"{label}: peak RSS {entry['peak_rss_bytes'] / 2**20:.1f} MB > baseline "
+                f"{previous['peak_rss_bytes'] / 2**20:.1f} MB"
+            )
+        for key in ("precision", "recall"):
+            if "accuracy" in entry and "accuracy" in previous:
+                if entry["accuracy"][key] < previous["accuracy"][key] - max_accuracy_drop:
+                    regressions.append(
+                        f"{label}: {key} {entry['accuracy'][key]:.4f} < baseline {previous['accuracy'][key]:.4f}"
+                    )
+    return regressions
+
+
+def parse_sizes(value: str) -> List[int]:
+    sizes = [int(part) for part in value.split(",") if part.strip()]
+    if not sizes or any(size < 256 for size in sizes):
+        raise argparse.ArgumentTypeError("Sizes must be comma-separated integers >= 256")
+    return sizes
+
+
+def parse_stages(value: str) -> List[str]:
+    stages = [part.strip() for part in value.split(",") if part.strip()]
+    unknown = sorted(set(stages) - set(STAGES))
+    if unknown:
+        raise argparse.ArgumentTypeError(f"Unknown stages: {', '.join(unknown)}")
+    # Stages consume each other's outputs, so always run in pipeline order.
+    return [stage for stage in STAGES if stage in stages]
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Benchmark line-detection stages on synthetic maps.")
+    parser.add_argument("--sizes", type=parse_sizes, default=[1024, 2048, 4096], help="Comma-separated square sizes, e.g. 1024,4096,16384")
+    parser.add_argument("--stages", type=parse_stages, default=list(STAGES), help="Comma-separated subset of stages")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=1, help="Runs per stage; the fastest is recorded")
+    parser.add_argument("--work-dir", help="Keep intermediate outputs here instead of a temporary directory")
+    parser.add_argument("--history", help="JSON history file the run is appended to")
+    parser.add_argument("--baseline", help="Baseline JSON to compare against")
+    parser.add_argument("--update-baseline", action="store_true", help="Write this run to --baseline instead of comparing")
+    parser.add_argument("--max-slowdown", type=float, default=0.15, help="Allowed throughput drop vs baseline (fraction)")
+    parser.add_argument("--max-memory-growth", type=float, default=0.15, help="Allowed peak RSS growth vs baseline (fraction)")
+    parser.add_argument("--check-accuracy", action="store_true", help="Score topology/detect_lines output against the ground truth")
+    parser.add_argument("--accuracy-tolerance", type=float, default=3.0, help="Buffer distance for ground-truth precision/recall")
+    parser.add_argument("--max-accuracy-drop", type=float, default=0.01, help="Allowed precision/recall drop vs baseline")
+    return parser
+
+
+def main() -> int:
+    args = build_parser().parse_args()
+    if args.repeat < 1:
+        raise ValueError("--repeat must be >= 1")
+    if args.update_baseline and not args.baseline:
+        raise ValueError("--update-baseline requires --baseline")
+
+    results: List[dict] = []
+    with tempfile.TemporaryDirectory(prefix="line_benchmark_") as scratch:
+        root = Path(args.work_dir) if args.work_dir else Path(scratch)
+        for size in args.sizes:
+            work = root / str(size)
+            work.mkdir(parents=True, exist_ok=True)
+            results.extend(benchmark_size(
+                size,
+                args.seed,
+                args.stages,
+                args.repeat,
+                work,
+                args.accuracy_tolerance if args.check_accuracy else None,
+            ))
+
+    run = {
+        "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+        "commit": command_output(["git", "rev-parse", "HEAD"]),
+        "host": platform.node(),
+        "platform": platform.platform(),
+        "python": platform.python_version(),
+        "opencv": command_output([sys.executable, "-c", "import cv2; print(cv2.__version__)"]),
+        "cpu_count": os.cpu_count(),
+        "seed": args.seed,
+        "repeat": args.repeat,
+        "results": results,
+    }
+
+    if args.history:
+        history_path = Path(args.history)
+        history = json.loads(history_path.read_text(encoding="utf-8")) if history_path.exists() else {"runs": []}
+        history["runs"].append(run)
+        history_path.parent.mkdir(parents=True, exist_ok=True)
+        history_path.write_text(json.dumps(history, indent=2), encoding="utf-8")
+
+    if args.baseline:
+        baseline_path = Path(args.baseline)
+        if args.update_baseline:
+            baseline_path.parent.mkdir(parents=True, exist_ok=True)
+            baseline_path.write_text(json.dumps(run, indent=2), encoding="utf-8")
+        elif baseline_path.exists():
+            baseline = json.loads(baseline_path.read_text(encoding="utf-8"))
+            regressions = find_regressions(
+                results, baseline, args.max_slowdown, args.max_memory_growth, args.max_accuracy_drop
+            )
+            for regression in regressions:
+                print(f"REGRESSION {regression}")
+            if regressions:
+                return 1
+        else:
+            print(f"No baseline at {baseline_path}; run with --update-baseline to create one.")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
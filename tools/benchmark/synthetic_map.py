@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+"""Generate deterministic synthetic map sheets with known line geometry.
+
+Example:
+  python tools/benchmark/synthetic_map.py --size 4096 --seed 7 \
+    --output synthetic_4096.png --output-geojson synthetic_4096.geojson \
+    --output-mask synthetic_4096_mask.png
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import string
+from dataclasses import dataclass
+from pathlib import Path
+from typing import List, Sequence, Tuple
+
+import cv2
+import numpy as np
+
+# Water-blue target lines (BGR); HSV hue ~105, well inside the default 100-140 band.
+LINE_COLOR = (200, 120, 40)
+DISTRACTOR_COLORS = ((40, 40, 200), (60, 160, 60), (30, 110, 190))
+GRID_COLOR = (150, 150, 150)
+CLUTTER_COLOR = (40, 40, 40)
+PAPER_COLOR = (215, 232, 240)
+GRAIN_TILE = 512
+BAND_ROWS = 1024
+# Feature densities are per megapixel so every size has comparable clutter.
+LINES_PER_MEGAPIXEL = 6.0
+DISTRACTORS_PER_MEGAPIXEL = 3.0
+CIRCLES_PER_MEGAPIXEL = 1.5
+LABELS_PER_MEGAPIXEL = 40.0
+LINE_STEP = 12.0
+
+
+@dataclass(frozen=True)
+class SyntheticMap:
+    image: np.ndarray
+    mask: np.ndarray
+    lines: List[np.ndarray]
+    thickness: int
+
+
+def random_walk(rng: np.random.Generator, width: int, height: int, length: float) -> np.ndarray:
+    steps = max(int(length / LINE_STEP), 2)
+    start = rng.uniform((0.05 * width, 0.05 * height), (0.95 * width, 0.95 * height))
+    heading = rng.uniform(0.0, 2.0 * np.pi)
+    # Smoothly varying curvature gives river-like meanders without self-overlapping zigzags.
+    turns = np.cumsum(rng.normal(0.0, 0.12, steps - 1))
+    turns = np.convolve(turns, np.ones(5) / 5.0, mode="same")
+    angles = heading + turns
+    offsets = np.stack([np.cos(angles), np.sin(angles)], axis=1) * LINE_STEP
+    points = np.vstack([start, start + np.cumsum(offsets, axis=0)])
+    inside = (
+        (points[:, 0] >= 0) & (points[:, 0] <= width - 1) & (points[:, 1] >= 0) & (points[:, 1] <= height - 1)
+    )
+    # Keep the leading run inside the sheet so ground truth never leaves the frame.
+    stop = int(np.argmin(inside)) if not inside.all() else points.shape[0]
+    return points[:stop]
+
+
+def cubic_weights(source: int, target: int) -> np.ndarray:
+    # Dense (target, source) matrix of cv2.resize's INTER_CUBIC weights (a = -0.75, replicated
+    # border), so the upsampling can be applied one band of rows at a time.
+    position = (np.arange(target) + 0.5) * (source / target) - 0.5
+    base = np.floor(position)
+    t = position - base
+    a = -0.75
+    taps = np.column_stack([
+        ((a * (t + 1) - 5 * a) * (t + 1) + 8 * a) * (t + 1) - 4 * a,
+        ((a + 2) * t - (a + 3)) * t * t + 1,
+        ((a + 2) * (1 - t) - (a + 3)) * (1 - t) * (1 - t) + 1,
+    ])
+    taps = np.column_stack([taps, 1 - taps.sum(axis=1)])
+    columns = np.clip(base.astype(np.int64)[:, None] + np.arange(-1, 3), 0, source - 1)
+    weights = np.zeros((target, source), dtype=np.float32)
+    np.add.at(weights, (np.repeat(np.arange(target), 4), columns.ravel()), taps.ravel().astype(np.float32))
+    return weights
+
+
+def draw_background(rng: np.random.Generator, width: int, height: int) -> np.ndarray:
+    coarse = rng.normal(0.0, 6.0, (max(height // 256, 2), max(width // 256, 2), 3)).astype(np.float32)
+    # A full-frame float32 tint would be 12 bytes per pixel (3 GB at 16k²), so only the
+    # horizontal pass is materialized and rows are interpolated band by band.
+    horizontal = np.matmul(cubic_weights(coarse.shape[1], width), coarse).reshape(len(coarse), -1)
+    vertical = cubic_weights(coarse.shape[0], height)
+    image = np.empty((height, width, 3), dtype=np.uint8)
+    grain = rng.integers(0, 12, (GRAIN_TILE, GRAIN_TILE, 1), dtype=np.uint8)
+    for top in range(0, height, BAND_ROWS):
+        bottom = min(top + BAND_ROWS, height)
+        tint = (vertical[top:bottom] @ horizontal).reshape(bottom - top, width, 3)
+        band = np.clip(tint + np.float32(PAPER_COLOR), 0, 255).astype(np.uint8)
+        rows = np.arange(top, bottom) % GRAIN_TILE
+        cols = np.arange(width) % GRAIN_TILE
+        image[top:bottom] = cv2.subtract(band, np.repeat(grain[rows][:, cols], 3, axis=2))
+    return image
+
+
+def draw_grid(image: np.ndarray, rng: np.random.Generator) -> None:
+    height, width = image.shape[:2]
+    spacing = int(rng.integers(300, 500))
+    for x in range(spacing // 2, width, spacing):
+        cv2.line(image, (x, 0), (x, height - 1), GRID_COLOR, 2)
+    for y in range(spacing // 2, height, spacing):
+        cv2.line(image, (0, y), (width - 1, y), GRID_COLOR, 2)
+
+
+def draw_circles(image: np.ndarray, rng: np.random.Generator, count: int) -> None:
+    height, width = image.shape[:2]
+    for _ in range(count):
+        center = (int(rng.integers(0, width)), int(rng.integers(0, height)))
+        radius = int(rng.integers(40, 180))
+        cv2.circle(image, center, radius, CLUTTER_COLOR, 2, cv2.LINE_AA)
+
+
+def draw_labels(image: np.ndarray, rng: np.random.Generator, count: int) -> None:
+    height, width = image.shape[:2]
+    alphabet = np.array(list(string.ascii_uppercase + string.digits))
+    for _ in range(count):
+        text = "".join(rng.choice(alphabet, int(rng.integers(3, 10))))
+        origin = (int(rng.integers(0, width)), int(rng.integers(20, height)))
+        scale = float(rng.uniform(0.5, 1.2))
+        cv2.putText(image, text, origin, cv2.FONT_HERSHEY_SIMPLEX, scale, CLUTTER_COLOR, 1, cv2.LINE_AA)
+
+
+def apply_jpeg_noise(image: np.ndarray, quality: int) -> np.ndarray:
+    if quality <= 0:
+        return image
+    success, encoded = cv2.imencode(".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    if not success:
+        raise ValueError("Failed to JPEG-encode synthetic map")
+    return cv2.imdecode(encoded, cv2.IMREAD_COLOR)
+
+
+def generate_map(size: Sequence[int], seed: int, thickness: int = 3, jpeg_quality: int = 75) -> SyntheticMap:
+    width, height = size
+    if width < 256 or height < 256:
+        raise ValueError("Synthetic maps must be at least 256x256")
+    rng = np.random.default_rng(seed)
+    megapixels = width * height / 1e6
+    diagonal = float(np.hypot(width, height))
+
+    image = draw_background(rng, width, height)
+    draw_grid(image, rng)
+    draw_circles(image, rng, int(round(CIRCLES_PER_MEGAPIXEL * megapixels)))
+    draw_labels(image, rng, int(round(LABELS_PER_MEGAPIXEL * megapixels)))
+
+    for _ in range(int(round(DISTRACTORS_PER_MEGAPIXEL * megapixels))):
+        points = random_walk(rng, width, height, rng.uniform(0.1, 0.4) * diagonal)
+        if points.shape[0] >= 2:
+            color = DISTRACTOR_COLORS[int(rng.integers(len(DISTRACTOR_COLORS)))]
+            cv2.polylines(image, [np.rint(points).astype(np.int32)], False, color, thickness, cv2.LINE_AA)
+
+    lines: List[np.ndarray] = []
+    for _ in range(max(int(round(LINES_PER_MEGAPIXEL * megapixels)), 1)):
+        points = random_walk(rng, width, height, rng.uniform(0.1, 0.5) * diagonal)
+        if points.shape[0] >= 2 and np.hypot(*(points[-1] - points[0])) >= 4 * LINE_STEP:
+            lines.append(points)
+    mask = np.zeros((height, width), dtype=np.uint8)
+    pixel_lines = [np.rint(points).astype(np.int32) for points in lines]
+    cv2.polylines(mask, pixel_lines, False, 255, thickness)
+    cv2.polylines(image, pixel_lines, False, LINE_COLOR, thickness, cv2.LINE_AA)
+
+    return SyntheticMap(image=apply_jpeg_noise(image, jpeg_quality), mask=mask, lines=lines, thickness=thickness)
+
+
+def lines_to_geojson(lines: Sequence[np.ndarray], width: int, height: int) -> dict:
+    # Same pixel->world mapping vectorize applies for --bbox 0 0 width height.
+    features = []
+    for index, points in enumerate(lines):
+        world_x = points[:, 0] * (width / (width - 1))
+        world_y = height - points[:, 1] * (height / (height - 1))
+        features.append({
+            "type": "Feature",
+            "geometry": {"type": "LineString", "coordinates": np.column_stack([world_x, world_y]).round(3).tolist()},
+            "properties": {"id": index},
+        })
+    return {"type": "FeatureCollection", "features": features}
+
+
+def parse_size(value: str) -> Tuple[int, int]:
+    parts = value.lower().split("x")
+    if len(parts) == 1:
+        parts = parts * 2
+    if len(parts) != 2:
+        raise argparse.ArgumentTypeError("Size must be N or WIDTHxHEIGHT")
+    return int(parts[0]), int(parts[1])
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Generate a synthetic map sheet with known line geometry.")
+    parser.add_argument("--size", type=parse_size, default=(1024, 1024), help="N or WIDTHxHEIGHT")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--thickness", type=int, default=3)
+    parser.add_argument("--jpeg-quality", type=int, default=75, help="0 disables JPEG noise")
+    parser.add_argument("--output", required=True, help="Map image output")
+    parser.add_argument("--output-geojson", help="Ground-truth line GeoJSON (bbox 0 0 width height)")
+    parser.add_argument("--output-mask", help="Ground-truth line mask")
+    return parser
+
+
+def main() -> int:
+    args = build_parser().parse_args()
+    synthetic = generate_map(args.size, args.seed, args.thickness, args.jpeg_quality)
+    height, width = synthetic.image.shape[:2]
+    Path(args.output).parent.mkdir(parents=True, exist_ok=True)
+    if not cv2.imwrite(args.output, synthetic.image):
+        raise ValueError(f"Failed to write image: {args.output}")
+    if args.output_mask and not cv2.imwrite(args.output_mask, synthetic.mask):
+        raise ValueError(f"Failed to write mask: {args.output_mask}")
+    if args.output_geojson:
+        payload = lines_to_geojson(synthetic.lines, width, height)
+        Path(args.output_geojson).write_text(json.dumps(payload), encoding="utf-8")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
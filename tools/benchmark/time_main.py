@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+"""Run a stage script's main() and record how long main() alone took.
+
+Interpreter start-up and the numpy/OpenCV/shapely imports happen before the clock
+starts, so the timing is the stage's own work. run_benchmark.py runs every stage
+through this wrapper in a fresh process.
+
+Example:
+  python tools/benchmark/time_main.py timing.json \
+    extractors/line_detection/skeleton/skeletonize_mask.py --mask mask.png ...
+"""
+from __future__ import annotations
+
+import importlib.util
+import json
+import resource
+import sys
+import time
+from pathlib import Path
+
+
+def cpu_seconds() -> float:
+    # Reaped child processes count too, so stages with worker pools are not undercounted.
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return own.ru_utime + own.ru_stime + children.ru_utime + children.ru_stime
+
+
+def main() -> int:
+    if len(sys.argv) < 3:
+        print(__doc__, file=sys.stderr)
+        return 2
+    timing_path, script, *arguments = sys.argv[1:]
+    # Same import path the script gets when run directly.
+    sys.path.insert(0, str(Path(script).resolve().parent))
+    spec = importlib.util.spec_from_file_location("timed_stage", script)
+    if spec is None or spec.loader is None:
+        raise ValueError(f"Cannot load stage script '{script}'")
+    module = importlib.util.module_from_spec(spec)
+    # Registered so dataclasses and pickled worker-pool tasks can find the module.
+    sys.modules[spec.name] = module
+    spec.loader.exec_module(module)
+
+    sys.argv = [script, *arguments]
+    start_wall = time.perf_counter()
+    start_cpu = cpu_seconds()
+    status = module.main()
+    timing = {
+        "wall_seconds": time.perf_counter() - start_wall,
+        "cpu_seconds": cpu_seconds() - start_cpu,
+    }
+    Path(timing_path).write_text(json.dumps(timing), encoding="utf-8")
+    return status
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
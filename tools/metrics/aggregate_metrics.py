@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""Aggregate per-stage performance metrics from a Bazel build into a report.
+
+Example:
+  bazel build //data/line_detection/cam_waterlines:all --output_groups=+metrics
+  python tools/metrics/aggregate_metrics.py bazel-bin/data/line_detection \
+    --output-json stage_report.json
+"""
+from __future__ import annotations
+
+import argparse
+import json
+from collections import defaultdict
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+
+def iter_json_files(paths: Iterable[str]) -> Iterator[Path]:
+    for value in paths:
+        path = Path(value)
+        if path.is_dir():
+            yield from sorted(path.rglob("*.json"))
+        elif path.suffix == ".json":
+            yield path
+
+
+def extract_metrics(payload: object) -> Optional[dict]:
+    if not isinstance(payload, dict):
+        return None
+    if "stage" in payload and "steps" in payload:
+        return payload
+    nested = payload.get("metrics")
+    if isinstance(nested, dict) and "stage" in nested and "steps" in nested:
+        return nested
+    return None
+
+
+def load_metrics(paths: Iterable[str]) -> List[Tuple[Path, dict]]:
+    records: List[Tuple[Path, dict]] = []
+    for path in iter_json_files(paths):
+        try:
+            payload = json.loads(path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            continue
+        metrics = extract_metrics(payload)
+        if metrics is not None:
+            records.append((path, metrics))
+    return records
+
+
+def aggregate(records: Iterable[Tuple[Path, dict]]) -> Dict[str, dict]:
+    stages: Dict[str, dict] = {}
+    for path, metrics in records:
+        stage = stages.setdefault(
+            metrics["stage"],
+            {
+                "runs": 0,
+                "wall_seconds": 0.0,
+                "cpu_seconds": 0.0,
+                "max_wall_seconds": 0.0,
+                "peak_rss_bytes": 0,
+                "input_pixels": 0,
+                "steps": defaultdict(lambda: {"wall_seconds": 0.0, "cpu_seconds": 0.0, "calls": 0}),
+                "counts": defaultdict(int),
+                "files": [],
+            },
+        )
+        stage["runs"] += 1
+        stage["wall_seconds"] += float(metrics.get("wall_seconds", 0.0))
+        stage["cpu_seconds"] += float(metrics.get("cpu_seconds", 0.0))
+        stage["max_wall_seconds"] = max(stage["max_wall_seconds"], float(metrics.get("wall_seconds", 0.0)))
+        stage["peak_rss_bytes"] = max(stage["peak_rss_bytes"], int(metrics.get("peak_rss_bytes", 0)))
+        for step in metrics.get("steps", []):
+            entry = stage["steps"][step["name"]]
+            entry["wall_seconds"] += float(step.get("wall_seconds", 0.0))
+            entry["cpu_seconds"] += float(step.get("cpu_seconds", 0.0))
+            entry["calls"] += int(step.get("calls", 1))
+        for key, value in metrics.get("counts", {}).items():
+            stage["counts"][key] += int(value)
+        stage["files"].append(str(path))
+
+    report: Dict[str, dict] = {}
+    for name, stage in sorted(stages.items()):
+        wall = stage["wall_seconds"]
+        pixels = stage["counts"].get("input_pixels", 0)
+        report[name] = {
+            "runs": stage["runs"],
+            "wall_seconds": round(wall, 6),
+            "cpu_seconds": round(stage["cpu_seconds"], 6),
+            "mean_wall_seconds": round(wall / stage["runs"], 6),
+            "max_wall_seconds": round(stage["max_wall_seconds"], 6),
+            "peak_rss_bytes": stage["peak_rss_bytes"],
+            "megapixels_per_second": round(pixels / 1e6 / wall, 3) if wall > 0 and pixels else None,
+            "steps": {
+                step: {key: round(value, 6) if isinstance(value, float) else value for key, value in entry.items()}
+                for step, entry in sorted(stage["steps"].items(), key=lambda item: -item[1]["wall_seconds"])
+            },
+            "counts": dict(stage["counts"]),
+            "files": stage["files"],
+        }
+    return report
+
+
+def format_report(report: Dict[str, dict]) -> str:
+    lines = [
+        f"{'stage':<22} {'runs':>5} {'wall s':>10} {'cpu s':>10} {'peak RSS MB':>12} {'MP/s':>8}  top steps",
+    ]
+    for name, stage in sorted(report.items(), key=lambda item: -item[1]["wall_seconds"]):
+        throughput = stage["megapixels_per_second"]
+        top_steps = ", ".join(
+            f"{step} {entry['wall_seconds']:.3f}s" for step, entry in list(stage["steps"].items())[:3]
+        )
+        lines.append(
+            f"{name:<22} {stage['runs']:>5} {stage['wall_seconds']:>10.3f} {stage['cpu_seconds']:>10.3f} "
+            f"{stage['peak_rss_bytes'] / 2**20:>12.1f} {throughput if throughput is not None else '-':>8}  {top_steps}"
+        )
+    return "\n".join(lines)
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Aggregate line-detection stage metrics into a per-stage report.")
+    parser.add_argument("paths", nargs="+", help="Metrics/stats JSON files or directories to search (e.g. bazel-bin)")
+    parser.add_argument("--output-json", help="Write the aggregated report as JSON")
+    return parser
+
+
+def main() -> int:
+    args = build_parser().parse_args()
+    records = load_metrics(args.paths)
+    if not records:
+        raise SystemExit("No stage metrics found.")
+    report = aggregate(records)
+    print(format_report(report))
+    if args.output_json:
+        output_path = Path(args.output_json)
+        output_path.parent.mkdir(parents=True, exist_ok=True)
+        output_path.write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding="utf-8")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
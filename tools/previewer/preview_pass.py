@@ -3,38 +3,94 @@ from __future__ import annotations
 
 import argparse
 import json
+import os
 from pathlib import Path
-from typing import List, Optional
+from typing import Iterator, List, Optional, Sequence, Tuple
 
 import cv2
 import numpy as np
 
-from extractors.line_detection.pipeline_utils import Bounds, load_image, load_mask, mask_to_rgba
+from extractors.line_detection.pipeline_utils import Bounds, crop_to_roi, load_image, load_mask, load_roi, mask_to_rgba
 from tools.previewer.preview_utils import (
+    MAX_PREVIEW_SIZE,
     PreviewAsset,
     build_asset_list,
     build_debug_section,
     build_opacity_panels,
     build_parameters_section,
-    encode_png,
+    build_preview_image,
+    build_resolution_note,
+    build_shared_images,
+    downscale,
+    preview_size,
     wrap_html,
 )
 
 
-def render_geojson_overlay(geojson: dict, bounds: Bounds, width: int, height: int) -> np.ndarray:
-    overlay = np.zeros((height, width, 4), dtype=np.uint8)
+LINE_GEOMETRY_DEPTH = {
+    "LineString": 0,
+    "MultiLineString": 1,
+    "Polygon": 1,
+    "MultiPolygon": 2,
+}
+
+
+def iter_geometries(geojson: dict) -> Iterator[dict]:
     for feature in geojson.get("features", []):
-        coords = feature.get("geometry", {}).get("coordinates", [])
-        points = []
-        for x, y in coords:
-            x_ratio = (x - bounds.min_x) / (bounds.max_x - bounds.min_x)
-            y_ratio = (bounds.max_y - y) / (bounds.max_y - bounds.min_y)
-            px = int(round(x_ratio * (width - 1)))
-            py = int(round(y_ratio * (height - 1)))
-            points.append((px, py))
-        if len(points) >= 2:
-            cv2.polylines(overlay, [np.array(points, dtype=np.int32)], False, (255, 0, 0, 200), 2)
-    return overlay
+        geometry = feature.get("geometry") or {}
+        if geometry.get("type") == "GeometryCollection":
+            yield from geometry.get("geometries", [])
+        else:
+            yield geometry
+
+
+def collect_line_coordinates(geojson: dict) -> Tuple[List[Sequence[float]], List[int]]:
+    coordinates: List[Sequence[float]] = []
+    lengths: List[int] = []
+    for geometry in iter_geometries(geojson):
+        depth = LINE_GEOMETRY_DEPTH.get(geometry.get("type"))
+        if depth is None:
+            continue
+        parts = [geometry.get("coordinates", [])]
+        for _ in range(depth):
+            parts = [part for group in parts for part in group]
+        for part in parts:
+            if len(part) >= 2:
+                coordinates.extend(part)
+                lengths.append(len(part))
+    return coordinates, lengths
+
+
+def coordinates_to_array(coordinates: List[Sequence[float]]) -> np.ndarray:
+    try:
+        world = np.array(coordinates, dtype=np.float64)
+    except ValueError:
+        # Mixed 2D/3D positions cannot be converted in one go.
+        world = np.array([point[:2] for point in coordinates], dtype=np.float64)
+    return world[:, :2]
+
+
+def render_geojson_overlay(geojson: dict, bounds: Bounds, width: int, height: int) -> np.ndarray:
+    coordinates, lengths = collect_line_coordinates(geojson)
+    if not lengths:
+        return np.zeros((height, width, 4), dtype=np.uint8)
+    # Single conversion of every vertex, then one affine world->pixel transform.
+    world = coordinates_to_array(coordinates)
+    scale = np.array(
+        [(width - 1) / (bounds.max_x - bounds.min_x), -(height - 1) / (bounds.max_y - bounds.min_y)]
+    )
+    origin = np.array([bounds.min_x, bounds.max_y])
+    pixels = np.rint((world - origin) * scale).astype(np.int32)
+    polylines = np.split(pixels, np.cumsum(lengths)[:-1])
+    mask = np.zeros((height, width), dtype=np.uint8)
+    cv2.polylines(mask, polylines, False, 255, 2)
+    return mask_to_rgba(mask, (255, 0, 0))
+
+
+def relative_href(path: str, output_path: str) -> str:
+    # Unresolved on purpose: resolving follows sandbox and execroot symlinks, which would bake
+    # machine-specific locations into the page.
+    return Path(os.path.relpath(path, os.path.dirname(output_path) or ".")).as_posix()
 
 
 def load_assets(path: Optional[str]) -> List[PreviewAsset]:
@@ -59,12 +115,17 @@ def build_parser() -> argparse.ArgumentParser:
     parser.add_argument("--mask", help="Binary mask to overlay")
     parser.add_argument("--geojson", help="GeoJSON overlay instead of mask")
     parser.add_argument("--bbox", nargs=4, metavar=("MIN_X", "MIN_Y", "MAX_X", "MAX_Y"))
+    parser.add_argument("--roi", help="ROI metadata JSON; mask overlays are drawn on its crop window")
     parser.add_argument("--overlay-color", default="0,200,255", help="Overlay color as R,G,B")
     parser.add_argument("--debug", action="append", default=[], help="Debug image paths")
     parser.add_argument("--assets-json", help="JSON list of build assets")
     parser.add_argument("--params-json", help="JSON parameters for the pass")
     parser.add_argument("--title", default="Line detection preview")
+    parser.add_argument("--max-preview-size", type=int, default=MAX_PREVIEW_SIZE, help="Longest preview side in pixels (0 keeps full size)")
     parser.add_argument("--output", required=True, help="HTML output")
+    parser.add_argument("--image-short-path", help="Path the full-resolution link uses instead of --image")
+    parser.add_argument("--debug-short-path", action="append", default=[], help="Link path per --debug, in order")
+    parser.add_argument("--output-short-path", help="Path links are made relative to instead of --output")
     return parser
 
 
@@ -74,12 +135,21 @@ def main() -> int:
     if not args.mask and not args.geojson:
         raise ValueError("Provide --mask or --geojson for overlay generation")
 
+    output_path = Path(args.output)
+    if args.debug_short_path and len(args.debug_short_path) != len(args.debug):
+        raise ValueError("Give one --debug-short-path per --debug")
+    link_base = args.output_short_path or args.output
     image = load_image(args.image)
+    if args.mask:
+        # Masks from ROI runs cover only the crop window; GeoJSON stays in sheet coordinates.
+        image = crop_to_roi(image, load_roi(args.roi))
     height, width = image.shape[:2]
+    size = preview_size(width, height, args.max_preview_size)
 
-    overlay_rgba: Optional[np.ndarray] = None
     if args.mask:
         mask = load_mask(args.mask)
+        # Any covered source pixel keeps the preview pixel lit, so thin lines survive downscaling.
+        mask = downscale(mask, size)
         color = tuple(int(c) for c in args.overlay_color.split(","))
         overlay_rgba = mask_to_rgba(mask, color)
     else:
@@ -87,28 +157,47 @@ def main() -> int:
             raise ValueError("--bbox is required for GeoJSON overlays")
         bounds = Bounds.from_sequence(args.bbox)
         geojson = json.loads(Path(args.geojson).read_text(encoding="utf-8"))
-        overlay_rgba = render_geojson_overlay(geojson, bounds, width, height)
+        overlay_rgba = render_geojson_overlay(geojson, bounds, size[0], size[1])
 
-    overlay_png = encode_png(overlay_rgba)
+    source_preview = build_preview_image(downscale(image, size), (width, height), relative_href(args.image_short_path or args.image, link_base))
+    overlay_preview = build_preview_image(overlay_rgba, (width, height))
 
     debug_images = []
-    for debug_path in args.debug:
+    for debug_path, debug_link in zip(args.debug, args.debug_short_path or args.debug):
         debug_image = cv2.imread(debug_path, cv2.IMREAD_UNCHANGED)
         if debug_image is None:
             continue
-        debug_images.append((Path(debug_path).stem, encode_png(debug_image)))
+        debug_height, debug_width = debug_image.shape[:2]
+        debug_size = preview_size(debug_width, debug_height, args.max_preview_size)
+        debug_images.append(
+            (
+                Path(debug_path).stem,
+                build_preview_image(
+                    downscale(debug_image, debug_size),
+                    (debug_width, debug_height),
+                    relative_href(debug_link, link_base),
+                ),
+            )
+        )
 
     assets = load_assets(args.assets_json)
     parameters = load_parameters(args.params_json)
 
-    image_png = encode_png(image)
-    panels = build_opacity_panels(image_png, overlay_png)
+    shared_images = build_shared_images(source_preview, overlay_preview)
+    panels = build_opacity_panels()
     assets_html = build_asset_list(assets)
     parameters_html = build_parameters_section(parameters)
     debug_html = build_debug_section(debug_images)
 
-    html = wrap_html(args.title, panels, assets_html, parameters_html, debug_html)
-    output_path = Path(args.output)
+    html = wrap_html(
+        args.title,
+        shared_images,
+        build_resolution_note(source_preview),
+        panels,
+        assets_html,
+        parameters_html,
+        debug_html,
+    )
     output_path.parent.mkdir(parents=True, exist_ok=True)
     output_path.write_text(html, encoding="utf-8")
     return 0
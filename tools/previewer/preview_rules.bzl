@@ -4,6 +4,7 @@ def run_preview_action(
         overlay_mask = None,
         overlay_geojson = None,
         bbox = None,
+        roi = None,
         debug_images = None,
         title = "Line detection preview",
         parameters = None,
@@ -11,6 +12,10 @@ def run_preview_action(
     output = ctx.actions.declare_file(ctx.label.name + "_preview.html")
     args = ctx.actions.args()
     args.add("--image", image.path)
+    # Links in the page use short paths, so they hold in bazel-bin and in copies of it and
+    # stay the same on every host.
+    args.add("--image-short-path", image.short_path)
+    args.add("--output-short-path", output.short_path)
     if overlay_mask:
         args.add("--mask", overlay_mask.path)
     if overlay_geojson:
@@ -18,17 +23,22 @@ def run_preview_action(
     if bbox:
         args.add("--bbox")
         args.add_all(bbox)
+    if roi:
+        args.add("--roi", roi.path)
     args.add("--title", title)
     args.add("--output", output.path)
     if debug_images:
         for debug_image in debug_images:
             args.add("--debug", debug_image.path)
+            args.add("--debug-short-path", debug_image.short_path)
 
     inputs = [image]
     if overlay_mask:
         inputs.append(overlay_mask)
     if overlay_geojson:
         inputs.append(overlay_geojson)
+    if roi:
+        inputs.append(roi)
     if debug_images:
         inputs.extend(debug_images)
 
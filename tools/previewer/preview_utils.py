@@ -1,14 +1,18 @@
 from __future__ import annotations
 
 import base64
+import html
 from dataclasses import dataclass
-from typing import Iterable, List, Tuple
+from typing import Iterable, List, Optional, Tuple
 
 import cv2
 import numpy as np
 
 
 OPACITIES = [0.20, 0.35, 0.50, 0.65, 0.80]
+MAX_PREVIEW_SIZE = 2048
+PNG_COMPRESSION = 1
+JPEG_QUALITY = 85
 
 
 @dataclass(frozen=True)
@@ -17,14 +21,83 @@ class PreviewAsset:
     path: str
 
 
+@dataclass(frozen=True)
+class PreviewImage:
+    data_url: str
+    width: int
+    height: int
+    full_width: int
+    full_height: int
+    full_href: Optional[str] = None
+
+    @property
+    def downscaled(self) -> bool:
+        return (self.width, self.height) != (self.full_width, self.full_height)
+
+
+def preview_size(width: int, height: int, max_size: int = MAX_PREVIEW_SIZE) -> Tuple[int, int]:
+    longest = max(width, height)
+    if max_size <= 0 or longest <= max_size:
+        return width, height
+    scale = max_size / float(longest)
+    return max(1, int(round(width * scale))), max(1, int(round(height * scale)))
+
+
+def downscale(image: np.ndarray, size: Tuple[int, int]) -> np.ndarray:
+    if (image.shape[1], image.shape[0]) == size:
+        return image
+    return cv2.resize(image, size, interpolation=cv2.INTER_AREA)
+
+
 def encode_png(image: np.ndarray) -> str:
-    success, encoded = cv2.imencode(".png", image)
+    success, encoded = cv2.imencode(".png", image, [cv2.IMWRITE_PNG_COMPRESSION, PNG_COMPRESSION])
     if not success:
         raise ValueError("Failed to encode PNG")
     return base64.b64encode(encoded.tobytes()).decode("utf-8")
 
 
-def build_opacity_panels(image_png: str, overlay_png: str) -> str:
+def encode_jpeg(image: np.ndarray) -> str:
+    success, encoded = cv2.imencode(".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY])
+    if not success:
+        raise ValueError("Failed to encode JPEG")
+    return base64.b64encode(encoded.tobytes()).decode("utf-8")
+
+
+def build_preview_image(
+    image: np.ndarray,
+    full_size: Tuple[int, int],
+    full_href: Optional[str] = None,
+) -> PreviewImage:
+    if image.ndim == 3 and image.shape[2] == 3:
+        data_url = f"data:image/jpeg;base64,{encode_jpeg(image)}"
+    else:
+        data_url = f"data:image/png;base64,{encode_png(image)}"
+    return PreviewImage(
+        data_url=data_url,
+        width=image.shape[1],
+        height=image.shape[0],
+        full_width=full_size[0],
+        full_height=full_size[1],
+        full_href=full_href,
+    )
+
+
+def build_shared_images(image: PreviewImage, overlay: PreviewImage) -> str:
+    # Each image is embedded exactly once; every panel references it through CSS.
+    return f"""
+    <style>
+      :root {{
+        --source-image: url("{image.data_url}");
+        --overlay-image: url("{overlay.data_url}");
+      }}
+      .stack {{
+        aspect-ratio: {image.width} / {image.height};
+      }}
+    </style>
+    """
+
+
+def build_opacity_panels() -> str:
     panels: List[str] = []
     for opacity in OPACITIES:
         panels.append(
@@ -32,8 +105,8 @@ def build_opacity_panels(image_png: str, overlay_png: str) -> str:
         <div class=\"panel\">
           <div class=\"panel-title\">Opacity {opacity:.2f}</div>
           <div class=\"stack\">
-            <img src=\"data:image/png;base64,{image_png}\" style=\"opacity: {opacity:.2f};\" />
-            <img src=\"data:image/png;base64,{overlay_png}\" />
+            <div class=\"layer source\" style=\"opacity: {opacity:.2f};\"></div>
+            <div class=\"layer overlay\"></div>
           </div>
         </div>
         """
@@ -41,7 +114,19 @@ def build_opacity_panels(image_png: str, overlay_png: str) -> str:
     return "".join(panels)
 
 
-def build_debug_section(debug_images: Iterable[Tuple[str, str]]) -> str:
+def build_resolution_note(image: PreviewImage) -> str:
+    if not image.downscaled:
+        return ""
+    link = ""
+    if image.full_href:
+        link = f' <a href=\"{html.escape(image.full_href)}\">Open full-resolution image</a>.'
+    return (
+        f"<p>Downscaled to {image.width}&times;{image.height} from "
+        f"{image.full_width}&times;{image.full_height}.{link}</p>"
+    )
+
+
+def build_debug_section(debug_images: Iterable[Tuple[str, PreviewImage]]) -> str:
     items = list(debug_images)
     if not items:
         return ""
@@ -49,10 +134,11 @@ def build_debug_section(debug_images: Iterable[Tuple[str, str]]) -> str:
         f"""
         <div class=\"debug-item\">
           <div class=\"panel-title\">{label}</div>
-          <img src=\"data:image/png;base64,{data}\" />
+          <img src=\"{image.data_url}\" />
+          {build_resolution_note(image)}
         </div>
         """
-        for label, data in items
+        for label, image in items
     )
     return f"""
     <div class=\"debug\">
@@ -99,7 +185,15 @@ def build_parameters_section(parameters: dict) -> str:
     """
 
 
-def wrap_html(title: str, panels: str, assets: str, parameters: str, debug: str) -> str:
+def wrap_html(
+    title: str,
+    shared_images: str,
+    resolution_note: str,
+    panels: str,
+    assets: str,
+    parameters: str,
+    debug: str,
+) -> str:
     return f"""<!doctype html>
 <html lang=\"en\">
 <head>
@@ -136,14 +230,17 @@ def wrap_html(title: str, panels: str, assets: str, parameters: str, debug: str)
       position: relative;
       width: 100%;
     }}
-    .stack img {{
-      width: 100%;
-      display: block;
-    }}
-    .stack img + img {{
+    .stack .layer {{
       position: absolute;
-      left: 0;
-      top: 0;
+      inset: 0;
+      background-size: 100% 100%;
+      background-repeat: no-repeat;
+    }}
+    .stack .source {{
+      background-image: var(--source-image);
+    }}
+    .stack .overlay {{
+      background-image: var(--overlay-image);
     }}
     .debug, .assets, .parameters {{
       padding: 0 24px 24px;
@@ -177,11 +274,13 @@ def wrap_html(title: str, panels: str, assets: str, parameters: str, debug: str)
       font-weight: 600;
     }}
   </style>
+  {shared_images}
 </head>
 <body>
   <header>
     <h1>{title}</h1>
     <p>Overlay preview sweep with varying background opacity.</p>
+    {resolution_note}
   </header>
   <section class=\"grid\">
     {panels}